@@ -0,0 +1,32 @@
+from typing import Annotated, Any, Literal
+from datetime import datetime
+from pydantic import BaseModel
+
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+
+class Job(BaseModel):
+    """A background job, stored at jobs/{id} (see JobRunner)"""
+    id: Annotated[str, "Unique identifier for the job"]
+    kind: Annotated[str, "Registered job kind, e.g. 'delete_tree'"]
+    owner: Annotated[str, "Username of the user who started the job"]
+    status: JobStatus = "queued"
+    params: Annotated[dict[str, Any], "Arguments passed to the job's handler"] = {}
+    done: Annotated[int, "Units of work finished so far"] = 0
+    total: Annotated[int, "Units of work in the job, None until known"] | None = None
+    cancel_requested: bool = False
+    migration: Annotated[bool, "Queued by submit_once; settles migrations/{kind} when it ends"] = False
+    result: Annotated[dict[str, Any], "Returned by the handler when the job succeeds"] | None = None
+    error: Annotated[str, "Why the job failed"] | None = None
+    created_at: datetime | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    updated_at: datetime | None = None
+
+    model_config = {
+        "from_attributes": True,
+    }
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
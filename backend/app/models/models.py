@@ -24,3 +24,17 @@ class VirtualFile(BaseModel):
         },
         "from_attributes":True #type:ignore
     }
+
+
+class SharedFile(BaseModel):
+    """Entry in a user's "shared with me" inbox, stored at users/{user_id}/shared/{file_id}"""
+    id: Annotated[str, "ID of the shared file"]
+    name: Annotated[str, "Name of the shared file or directory"]
+    root: Annotated[str, "Username of the owner"]
+    directory: Annotated[bool, "True if this is a directory, False if this is a file"] = False
+    permissions: Annotated[list[str], "Permissions granted to the user, ['view'] or ['view', 'edit']"] = []
+    shared_at: Annotated[datetime, "Timestamp of the (last) share"] | None = None
+
+    model_config = {
+        "from_attributes": True,
+    }
@@ -0,0 +1,101 @@
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic.alias_generators import to_camel
+
+from .models import VirtualFile
+
+
+class SpaceModel(BaseModel):
+    """Spaces are read by the frontend as-is (frontend/types/spaces.ts): camelCase on
+    the wire, timestamps in milliseconds since the epoch"""
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True, from_attributes=True)
+
+
+class SpaceUser(SpaceModel):
+    id: str = Field(..., description="User id")
+    username: str
+    is_creator: bool = False
+    can_edit: bool = False
+    is_active: bool = Field(True, description="Seen within SPACES_IDLE_SECONDS")
+    last_activity: int
+
+
+class ChatMessage(SpaceModel):
+    id: str
+    user_id: str
+    username: str
+    message: str
+    timestamp: int
+
+
+class EditRequest(SpaceModel):
+    id: str
+    user_id: str
+    username: str
+    timestamp: int
+    pending: bool = True
+
+
+class CodeSpace(SpaceModel):
+    id: str
+    name: str
+    join_code: str
+    created_at: int
+    creator_id: str
+    creator_name: str
+    users: list[SpaceUser] = []
+    active_file: VirtualFile | None = None
+    messages: list[ChatMessage] = Field([], description="The most recent messages, oldest first")
+    edit_requests: list[EditRequest] = []
+    is_public: bool = False
+    last_activity: int
+    version: int = Field(0, description="Version of the active file's content, for operations")
+
+
+class SpaceCreate(SpaceModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    is_public: bool = False
+
+
+class SpaceJoin(SpaceModel):
+    join_code: str = Field(..., min_length=1, max_length=20)
+
+
+class ChatMessageCreate(SpaceModel):
+    message: str = Field(..., min_length=1, max_length=2000)
+
+
+class ActiveFileUpdate(SpaceModel):
+    file_id: str
+
+
+class EditDecision(SpaceModel):
+    grant: bool
+
+
+class OperationSubmit(SpaceModel):
+    """An edit to the active file, in the format of app.services.ot"""
+    base_version: int = Field(..., ge=0, description="The version the operation was made on")
+    ops: list[int | str]
+
+
+class AppliedOperation(SpaceModel):
+    version: int = Field(..., description="The version this operation produced")
+    user_id: str
+    ops: list[int | str]
+
+
+class OperationLog(SpaceModel):
+    version: int
+    operations: list[AppliedOperation]
+
+
+class SpaceResponse(SpaceModel):
+    space: CodeSpace
+
+
+class SpaceListResponse(SpaceModel):
+    spaces: list[CodeSpace]
+
+
+class SaveResult(SpaceModel):
+    version: int = Field(..., description="The version now written to the file")
@@ -27,6 +27,22 @@ class User(BaseModel):
 class UserSecure(User):
     password: str = Field(exclude=True, description="Password of the user, excluded in responses")
 
+class UserPublic(BaseModel):
+    """User fields that are safe to list; never carries the password hash"""
+    id: str = Field(..., description="Unique identifier for the user")
+    username: str = Field(..., description="Username of the user")
+    email: EmailStr = Field(..., description="Email address of the user")
+    role: UserRole = Field(
+        UserRole.USER, description="Role of the user in the system")
+    created_at: datetime | None = Field(
+        None, description="Timestamp when the user was created")
+    updated_at: datetime | None = Field(
+        None, description="Timestamp when the user was last updated")
+
+    class Config:
+        from_attributes = True
+        use_enum_values = True
+
 class UserCreate(BaseModel):
     username: str = Field(..., min_length=3,  max_length=50)
     email: EmailStr
@@ -52,4 +68,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None
-    email: EmailStr | None
\ No newline at end of file
+    email: EmailStr | None
+    id: str | None = None
\ No newline at end of file
@@ -0,0 +1,268 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from prometheus_client import Counter, Histogram
+
+from .metrics import route_template
+
+
+FIRESTORE_OPERATIONS = Counter(
+    "sensei_firestore_operations_total",
+    "Firestore documents read/written and queries run",
+    ["op"],
+)
+FIRESTORE_RPC_LATENCY = Histogram(
+    "sensei_firestore_rpc_duration_seconds",
+    "Latency of Firestore calls by method",
+    ["method"],
+    buckets=(0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+FIRESTORE_READS_PER_REQUEST = Histogram(
+    "sensei_firestore_reads_per_request",
+    "Firestore documents read while serving one request",
+    ["route"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000),
+)
+FIRESTORE_WRITES_PER_REQUEST = Histogram(
+    "sensei_firestore_writes_per_request",
+    "Firestore documents written while serving one request",
+    ["route"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 500),
+)
+
+
+@dataclass
+class FirestoreStats:
+    """Firestore cost of one request"""
+    reads: int = 0
+    writes: int = 0
+    queries: int = 0
+    streamed: int = 0
+    calls: int = 0
+    seconds: float = 0.0
+
+    def server_timing(self) -> str:
+        return (f'firestore;dur={self.seconds * 1000:.1f};desc="{self.calls} calls", '
+                f'fs-reads;desc="{self.reads}", fs-writes;desc="{self.writes}", '
+                f'fs-queries;desc="{self.queries}"')
+
+
+_request_stats: ContextVar[FirestoreStats | None] = ContextVar(
+    "firestore_request_stats", default=None)
+
+_reads = FIRESTORE_OPERATIONS.labels("read")
+_writes = FIRESTORE_OPERATIONS.labels("write")
+_queries = FIRESTORE_OPERATIONS.labels("query")
+
+
+def current_stats() -> FirestoreStats | None:
+    """Stats of the request being served, if any"""
+    return _request_stats.get()
+
+
+def _record(method: str, elapsed: float, reads: int = 0, writes: int = 0, queries: int = 0, streamed: int = 0) -> None:
+    FIRESTORE_RPC_LATENCY.labels(method).observe(elapsed)
+    if reads:
+        _reads.inc(reads)
+    if writes:
+        _writes.inc(writes)
+    if queries:
+        _queries.inc(queries)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.calls += 1
+        stats.seconds += elapsed
+        stats.reads += reads
+        stats.writes += writes
+        stats.queries += queries
+        stats.streamed += streamed
+
+
+def _unwrap(obj):
+    return obj._wrapped if isinstance(obj, _Proxy) else obj
+
+
+class _Proxy:
+    """Delegates everything it doesn't override to the wrapped object"""
+
+    def __init__(self, wrapped) -> None:
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __repr__(self) -> str:
+        return f"<instrumented {self._wrapped!r}>"
+
+
+class InstrumentedQuery(_Proxy):
+    """Counts query executions and the documents they return"""
+
+    def _chain(self, name):
+        def method(*args, **kwargs):
+            return InstrumentedQuery(getattr(self._wrapped, name)(*args, **kwargs))
+        return method
+
+    def __getattr__(self, name):
+        if name in ('where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+                    'start_at', 'start_after', 'end_at', 'end_before'):
+            return self._chain(name)
+        return getattr(self._wrapped, name)
+
+    async def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        docs = await self._wrapped.get(*args, **kwargs)
+        # Firestore bills a query that matches nothing as one read
+        _record('query.get', time.perf_counter() - started,
+                reads=max(1, len(docs)), queries=1)
+        return docs
+
+    async def stream(self, *args, **kwargs):
+        started = time.perf_counter()
+        count = 0
+        try:
+            async for doc in self._wrapped.stream(*args, **kwargs):
+                count += 1
+                yield doc
+        finally:
+            _record('query.stream', time.perf_counter() - started,
+                    reads=max(1, count), queries=1, streamed=count)
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    async def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = await self._wrapped.add(*args, **kwargs)
+        _record('collection.add', time.perf_counter() - started, writes=1)
+        return result
+
+
+class InstrumentedDocument(_Proxy):
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    async def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        snapshot = await self._wrapped.get(*args, **kwargs)
+        _record('document.get', time.perf_counter() - started, reads=1)
+        return snapshot
+
+    async def _write(self, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        result = await getattr(self._wrapped, method)(*args, **kwargs)
+        _record(f'document.{method}', time.perf_counter() - started, writes=1)
+        return result
+
+    async def set(self, *args, **kwargs):
+        return await self._write('set', *args, **kwargs)
+
+    async def create(self, *args, **kwargs):
+        return await self._write('create', *args, **kwargs)
+
+    async def update(self, *args, **kwargs):
+        return await self._write('update', *args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        return await self._write('delete', *args, **kwargs)
+
+
+class InstrumentedBatch(_Proxy):
+    """Counts the writes queued on a batch and times its commit"""
+
+    def __init__(self, wrapped) -> None:
+        super().__init__(wrapped)
+        self._pending = 0
+
+    def _queue(self, method: str, reference, *args, **kwargs):
+        self._pending += 1
+        getattr(self._wrapped, method)(_unwrap(reference), *args, **kwargs)
+        return self
+
+    def set(self, reference, *args, **kwargs):
+        return self._queue('set', reference, *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._queue('create', reference, *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._queue('update', reference, *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._queue('delete', reference, *args, **kwargs)
+
+    async def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = await self._wrapped.commit(*args, **kwargs)
+        _record('batch.commit', time.perf_counter() - started,
+                writes=self._pending)
+        self._pending = 0
+        return result
+
+
+class InstrumentedClient(_Proxy):
+    """Firestore async client that accounts every call to the current request.
+
+    Transactions are handed out unwrapped: reads made through instrumented
+    documents or get_all are counted, but transactional writes are not.
+    """
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedCollection(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def batch(self, *args, **kwargs):
+        return InstrumentedBatch(self._wrapped.batch(*args, **kwargs))
+
+    async def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(ref) for ref in references]
+        started = time.perf_counter()
+        count = 0
+        try:
+            async for snapshot in self._wrapped.get_all(references, *args, **kwargs):
+                count += 1
+                yield snapshot
+        finally:
+            _record('client.get_all', time.perf_counter() - started,
+                    reads=len(references), streamed=count)
+
+
+class FirestoreAccountingMiddleware:
+    """ASGI middleware that gives each request its own FirestoreStats, reports
+    them in a Server-Timing header and in per-route read/write histograms."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = FirestoreStats()
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"server-timing", stats.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = route_template(scope)
+            FIRESTORE_READS_PER_REQUEST.labels(route).observe(stats.reads)
+            FIRESTORE_WRITES_PER_REQUEST.labels(route).observe(stats.writes)
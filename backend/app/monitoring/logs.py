@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from starlette.datastructures import Headers
+
+from .metrics import route_template
+
+
+access_logger = logging.getLogger("sensei.access")
+
+# Mutable per-request fields; dependencies fill in 'user' after authentication
+_request_context: ContextVar[dict | None] = ContextVar(
+    "log_request_context", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord(
+    "", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def request_context() -> dict | None:
+    return _request_context.get()
+
+
+def set_log_user(username: str | None) -> None:
+    """Attach the authenticated user to the current request's log lines"""
+    context = _request_context.get()
+    if context is not None:
+        context["user"] = username
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto the record, in the thread that logged it"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _request_context.get()
+        if context:
+            for key, value in context.items():
+                if not key.startswith("_") and not hasattr(record, key):
+                    setattr(record, key, value)
+            if not hasattr(record, "route"):
+                # Known once the router has matched the request
+                record.route = route_template(context["_scope"])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Drops a share of high-volume records.
+
+    A record logged with `extra={"sample_rate": 0.1}` is kept 10% of the time.
+    Warnings and errors are never sampled out.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sample_rate":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_listener: QueueListener | None = None
+
+
+def setup_logging(level: str | None = None) -> QueueListener:
+    """Route all logging through a queue so emitting never blocks the event loop.
+
+    Records are formatted and written to stdout by a QueueListener thread.
+    Safe to call more than once; the running listener is reused.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level or os.getenv("LOG_LEVEL", "info").upper())
+
+    _listener = QueueListener(
+        log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """Gives every request an id (honouring an incoming X-Request-ID), exposes
+    it to log records and writes one access log line per request.
+
+    Successful requests are sampled at LOG_ACCESS_SAMPLE_RATE; 4xx/5xx are
+    always logged.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.sample_rate = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", 1.0))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex
+        context = {"request_id": request_id, "user": None, "_scope": scope}
+        token = _request_context.set(context)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            route = route_template(scope)
+            extra = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": duration_ms,
+            }
+            if status_code < 400:
+                extra["sample_rate"] = self.sample_rate
+            access_logger.info(
+                "%s %s %s", scope["method"], route, status_code, extra=extra)
+            _request_context.reset(token)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from prometheus_client import Counter, Histogram
+
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_ROUTE = "<unknown>"
+
+LOOP_LAG = Histogram(
+    "sensei_event_loop_lag_seconds",
+    "How late the loop lag sampler woke up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = Counter(
+    "sensei_event_loop_stalls_total",
+    "Times the event loop was blocked longer than the stall threshold",
+    ["route"],
+)
+LOOP_STALL_DURATION = Histogram(
+    "sensei_event_loop_stall_seconds",
+    "Duration of event loop stalls by the route whose code was blocking",
+    ["route"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def endpoint_code_map(app) -> dict:
+    """Map the code objects of every route endpoint (and what it wraps) to the route path"""
+    codes = {}
+    for route in getattr(app, "routes", []):
+        func = getattr(route, "endpoint", None)
+        path = getattr(route, "path", None)
+        while func is not None and path is not None:
+            code = getattr(func, "__code__", None)
+            if code is not None:
+                codes[code] = path
+            func = getattr(func, "__wrapped__", None)
+    return codes
+
+
+class LoopMonitor:
+    """Detects event loop lag and stalls caused by blocking code.
+
+    An asyncio task sleeps for `interval` and records how late it wakes up
+    (sensei_event_loop_lag_seconds) as a heartbeat. A watchdog thread checks
+    the heartbeat; when the loop hasn't ticked for `stall_threshold` beyond
+    the interval it captures the loop thread's stack, attributes it to the
+    route whose endpoint is on that stack, and logs it. The stall's total
+    duration is recorded once the loop recovers.
+    """
+
+    def __init__(self, interval: float | None = None, stall_threshold: float | None = None) -> None:
+        self.interval = interval or float(
+            os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+        self.stall_threshold = stall_threshold or float(
+            os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+        self._heartbeat = time.monotonic()
+        self._codes: dict = {}
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.stalls: list[dict] = []
+
+    def start(self, app=None) -> None:
+        """Start sampling on the running loop; `app` is used to map stacks to routes"""
+        if app is not None:
+            self._codes = endpoint_code_map(app)
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+
+    async def _sample(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - started - self.interval))
+            self._heartbeat = now
+
+    def _route_for(self, frame) -> str:
+        while frame is not None:
+            route = self._codes.get(frame.f_code)
+            if route is not None:
+                return route
+            frame = frame.f_back
+        return UNKNOWN_ROUTE
+
+    def _watch(self) -> None:
+        stall = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._heartbeat
+            age = time.monotonic() - beat
+
+            if stall is not None and beat != stall["started"]:
+                # The loop ticked again: the stall is over
+                duration = beat - stall["started"] - self.interval
+                stall["duration"] = duration
+                LOOP_STALL_DURATION.labels(stall["route"]).observe(duration)
+                self.stalls = (self.stalls + [stall])[-20:]
+                stall = None
+
+            if stall is None and age > self.interval + self.stall_threshold:
+                # First time we see this stall: capture what is blocking
+                frame = sys._current_frames().get(self._loop_thread_id)
+                route = self._route_for(frame)
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                stall = {"route": route, "started": beat, "stack": stack}
+                LOOP_STALLS.labels(route).inc()
+                logger.warning(
+                    "Event loop blocked for %.3fs in route %s\n%s", age, route, stack,
+                    extra={"route": route, "blocked_seconds": round(age, 3)})
@@ -0,0 +1,147 @@
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, REGISTRY, generate_latest, multiprocess)
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+REQUEST_LATENCY = Histogram(
+    "sensei_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+             0.5, 1.0, 2.5, 5.0, 10.0),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "sensei_http_requests_in_progress",
+    "HTTP requests currently being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+RESPONSE_SIZE = Histogram(
+    "sensei_http_response_size_bytes",
+    "HTTP response body size by route template",
+    ["method", "route"],
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+REQUEST_ERRORS = Counter(
+    "sensei_http_request_errors_total",
+    "HTTP responses with status >= 400, or unhandled exceptions (status 500)",
+    ["method", "route", "status"],
+)
+CACHE_REQUESTS = Counter(
+    "sensei_cache_requests_total",
+    "Cache lookups by cache name and result (hit or miss)",
+    ["cache", "result"],
+)
+
+SINGLEFLIGHT_CALLS = Counter(
+    "sensei_singleflight_calls_total",
+    "Coalesced reads by group and role (leader ran the call, shared joined one in flight)",
+    ["group", "role"],
+)
+
+CHANGE_LISTENERS = Gauge(
+    "sensei_change_listeners",
+    "Firestore snapshot listeners open in the ChangeHub",
+    multiprocess_mode="livesum",
+)
+WRITE_BEHIND_SAVES = Counter(
+    "sensei_write_behind_saves_total",
+    "Autosaves buffered, and file writes made by flushing them",
+    ["result"],
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "sensei_websocket_connections",
+    "WebSocket connections currently open",
+    multiprocess_mode="livesum",
+)
+JOBS = Counter(
+    "sensei_jobs_total",
+    "Background jobs finished, by kind and final status",
+    ["kind", "status"],
+)
+JOBS_RUNNING = Gauge(
+    "sensei_jobs_running",
+    "Background jobs currently running",
+    multiprocess_mode="livesum",
+)
+
+
+def cache_counters(name: str) -> tuple:
+    """Pre-bound (hit, miss) counters for a named cache"""
+    return CACHE_REQUESTS.labels(name, "hit"), CACHE_REQUESTS.labels(name, "miss")
+
+
+def singleflight_counters(name: str) -> tuple:
+    """Pre-bound (leader, shared) counters for a named singleflight group"""
+    return SINGLEFLIGHT_CALLS.labels(name, "leader"), SINGLEFLIGHT_CALLS.labels(name, "shared")
+
+
+def route_template(scope) -> str:
+    """The path template of the route that handled `scope`, e.g. /files/{file_id}"""
+    route = scope.get("route")
+    if route is None:
+        # Older Starlette versions don't record the matched route in the scope
+        app = scope.get("app")
+        for candidate in getattr(app, "routes", []):
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, in-flight requests, response sizes
+    and errors, labelled by route template rather than raw path."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        body_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            RESPONSE_SIZE.labels(method, route).observe(body_size)
+            if status_code >= 400:
+                REQUEST_ERRORS.labels(method, route, str(status_code)).inc()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus scrape endpoint"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Several worker processes: aggregate their metric files
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
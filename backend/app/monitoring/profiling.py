@@ -0,0 +1,144 @@
+import asyncio
+import cProfile
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from starlette.datastructures import Headers
+
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_FLAG = b"__profile=1"
+
+
+def profile_dir() -> Path:
+    path = Path(os.getenv("PROFILE_DIR", "profiles"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def profile_path(profile_id: str) -> Path | None:
+    """Path of a stored request profile, or None if the id is unknown"""
+    try:
+        uuid.UUID(profile_id)
+    except ValueError:
+        return None
+    path = profile_dir() / f"{profile_id}.prof"
+    return path if path.exists() else None
+
+
+class ProfilingMiddleware:
+    """Runs a single request under cProfile when an admin asks for it.
+
+    A request is profiled when it carries `X-Profile: 1` (or `?__profile=1`)
+    and a bearer token belonging to an admin. The pstats dump is stored under
+    PROFILE_DIR and its id returned in the `X-Profile-Id` response header;
+    fetch it from GET /api/v1/admin/profiles/{id} and open it with snakeviz,
+    flameprof or `python -m pstats`.
+
+    cProfile sees the whole thread, so other requests running concurrently on
+    the same event loop show up in the profile too. The middleware is only
+    installed when PROFILING_ENABLED=true, so it costs nothing otherwise.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        if PROFILE_QUERY_FLAG in scope.get("query_string", b""):
+            return True
+        return Headers(scope=scope).get(PROFILE_HEADER) == "1"
+
+    @staticmethod
+    async def _is_admin(scope) -> bool:
+        from ..services.auth_service import AuthService
+
+        authorization = Headers(scope=scope).get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return False
+        try:
+            user = await AuthService().get_current_user(token)
+        except Exception:
+            return False
+        return user is not None and user.role == "admin"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope) or not await self._is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = str(uuid.uuid4())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(str(profile_dir() / f"{profile_id}.prof"))
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in the worker at a fixed interval.
+
+    Output is in the collapsed-stack format ("frame;frame;frame count" per
+    line) understood by flamegraph.pl, speedscope and inferno. Sampling runs
+    on its own thread, so it also catches code that blocks the event loop.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                self.samples[f"{thread_name};{self._collapse(frame)}"] += 1
+
+    async def profile(self, seconds: float) -> str:
+        """Sample for `seconds` and return collapsed stacks"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A sampling profile is already running")
+        try:
+            thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True)
+            thread.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                self._stop.set()
+                await asyncio.to_thread(thread.join)
+        finally:
+            self._lock.release()
+
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
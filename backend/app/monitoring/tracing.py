@@ -0,0 +1,138 @@
+import inspect
+import os
+import sys
+from functools import wraps
+
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from .metrics import route_template
+
+
+tracer = trace.get_tracer("sensei")
+
+_provider = None
+
+
+def setup_tracing():
+    """Install an OpenTelemetry SDK tracer provider when TRACING_EXPORTER is set.
+
+    TRACING_EXPORTER=console writes spans to stdout, TRACING_EXPORTER=file
+    appends them as JSON lines to TRACING_FILE (default traces.jsonl); both
+    work offline. Without it the API's no-op tracer is used and spans cost
+    next to nothing.
+    """
+    global _provider
+    exporter_name = os.getenv("TRACING_EXPORTER", "").lower()
+    if not exporter_name or _provider is not None:
+        return _provider
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if exporter_name == "file":
+        out = open(os.getenv("TRACING_FILE", "traces.jsonl"), "a")
+    elif exporter_name == "console":
+        out = sys.stdout
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER '{exporter_name}'")
+
+    exporter = ConsoleSpanExporter(
+        out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": "sensei"}))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+    return _provider
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def traced(name: str):
+    """Decorator running a function (sync, async or async generator) in a span"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @wraps(func)
+            async def agen_wrapper(*args, **kwargs):
+                # Not made current: the generator may be resumed from other contexts
+                span = tracer.start_span(name)
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except Exception as e:
+                    span.record_exception(e)
+                    span.set_status(Status(StatusCode.ERROR))
+                    raise
+                finally:
+                    span.end()
+            return agen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.start_as_current_span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_public_methods(cls):
+    """Class decorator putting every public method of `cls` in a span named Class.method"""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or not inspect.isfunction(value):
+            continue
+        setattr(cls, attr, traced(f"{cls.__name__}.{attr}")(value))
+    return cls
+
+
+class TracingMiddleware:
+    """Opens the root server span of each request, named after its route template.
+
+    When the framework or an ASGI instrumentation already opened a server
+    span for the request, that span is used as the root instead of nesting
+    a second one under it.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if trace.get_current_span().get_span_context().is_valid:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with tracer.start_as_current_span(method, kind=SpanKind.SERVER) as span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_template(scope)
+                span.update_name(f"{method} {route}")
+                span.set_attribute("http.request.method", method)
+                span.set_attribute("http.route", route)
+                span.set_attribute("http.response.status_code", status_code)
+                if status_code >= 500:
+                    span.set_status(Status(StatusCode.ERROR))
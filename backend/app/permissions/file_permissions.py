@@ -4,6 +4,7 @@ from fastapi import HTTPException, status
 
 from ..services.authorization_service import AuthorizationService
 from ..services.filesystem import FileSystem
+from ..monitoring.tracing import tracer
 
 
 fs = FileSystem()
@@ -26,25 +27,25 @@ class PermissionRequired:
                     detail="Missing file_id or current_user"
                 )
 
-     
-            file = await fs.get_file(file_id)
-
-            if not file:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="File not found"
-                )
-
-            has_permission = False
-            if self.permission == "view":
-                has_permission = await authorization_service.can_user_view_file(current_user.username, file)
-            elif self.permission == "edit":
-                has_permission = await authorization_service.can_user_edit_file(current_user.username, file)
-            if not has_permission:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"You don't have {self.permission} permission for this file"
-                )
+            with tracer.start_as_current_span(f"PermissionRequired.{self.permission}"):
+                file = await fs.get_file(file_id, cached=True)
+
+                if not file:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="File not found"
+                    )
+
+                has_permission = False
+                if self.permission == "view":
+                    has_permission = await authorization_service.can_user_view_file(current_user.username, file)
+                elif self.permission == "edit":
+                    has_permission = await authorization_service.can_user_edit_file(current_user.username, file)
+                if not has_permission:
+                    raise HTTPException(
+                        status_code=status.HTTP_403_FORBIDDEN,
+                        detail=f"You don't have {self.permission} permission for this file"
+                    )
 
             return await func(*args, **kwargs)
 
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi.responses import FileResponse, PlainTextResponse
+
+from ..models.jobs import Job
+from ..models.users import UserSecure
+from ..monitoring.profiling import SamplingProfiler, profile_path
+
+from .auth_router import get_current_user
+from .jobs_router import submit_job
+
+
+router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
+
+# Data migrations an admin can start, see the JobRunner.register calls
+MIGRATIONS = ('backfill_reservations', 'backfill_shared_inboxes')
+
+
+async def get_current_admin(current_user: UserSecure = Depends(get_current_user)) -> UserSecure:
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+
+@router.post('/profile', response_class=PlainTextResponse)
+async def sample_worker(
+    seconds: float = Query(10, gt=0, le=120),
+    interval: float = Query(0.005, ge=0.001, le=1),
+    current_user: UserSecure = Depends(get_current_admin)
+):
+    """
+    Sample every thread of this worker for `seconds` and return the stacks in
+    collapsed format (feed to flamegraph.pl or speedscope).
+    """
+    try:
+        collapsed = await SamplingProfiler(interval).profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    return PlainTextResponse(collapsed)
+
+
+@router.get('/profiles/{profile_id}')
+async def get_request_profile(
+    profile_id: str,
+    current_user: UserSecure = Depends(get_current_admin)
+):
+    """Download a pstats dump recorded by the X-Profile request flag"""
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return FileResponse(path, media_type="application/octet-stream",
+                        filename=f"{profile_id}.prof")
+
+
+@router.post('/migrations/{kind}', response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def run_migration(
+    kind: str,
+    current_user: UserSecure = Depends(get_current_admin)
+):
+    """Start a data migration as a background job (poll GET /api/v1/jobs/{id})"""
+    if kind not in MIGRATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown migration, expected one of {', '.join(MIGRATIONS)}"
+        )
+    return await submit_job(kind, current_user.username)
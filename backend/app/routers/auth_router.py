@@ -1,15 +1,22 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+import logging
+
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from ..services.auth_service import AuthService
-from ..models.users import User, UserCreate, UserUpdate, UserLogin, Token, TokenData, UserSecure
+from ..services.password_hasher import HasherOverloaded
+from ..monitoring.logs import set_log_user
+from ..models.users import User, UserCreate, UserUpdate, UserLogin, Token, TokenData, UserSecure, UserPublic
 
+logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1/auth", tags=["auth"])
 security = HTTPBearer()
 auth_service = AuthService()
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserPublic:
     user = await auth_service.get_current_user(credentials.credentials)
+    set_log_user(user.username if user else None)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -18,6 +25,28 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     return user
 
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenData:
+    """
+    Claims-only authentication: verifies the JWT without loading the user.
+    Use for endpoints that only need the username/email/id carried by the token.
+    """
+    claims = auth_service.verify_token(credentials.credentials)
+    set_log_user(claims.username if claims else None)
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+def _overloaded(exc: HasherOverloaded) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @router.post('/register', response_model=User, status_code=status.HTTP_201_CREATED)
 async def register(user_data: UserCreate) -> User:
     try:
@@ -28,8 +57,10 @@ async def register(user_data: UserCreate) -> User:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
+    except HasherOverloaded as e:
+        raise _overloaded(e)
     except Exception as e:
-        print(e)
+        logger.exception("User registration failed")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred while creating the user"
@@ -37,7 +68,12 @@ async def register(user_data: UserCreate) -> User:
     
 @router.post('/login', response_model=Token)
 async def login(user_login: UserLogin) -> Token:
-    user_token = await auth_service.authenticate_user(user_login)
+    try:
+        user_token = await auth_service.authenticate_user(user_login)
+    except HasherOverloaded as e:
+        raise _overloaded(e)
+    except ValueError:
+        user_token = None
     if not user_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -46,8 +82,8 @@ async def login(user_login: UserLogin) -> Token:
         )
     return user_token 
 
-@router.get('/me', response_model = User)
-async def get_me(current_user: UserSecure = Depends(get_current_user)) -> UserSecure:
+@router.get('/me', response_model = UserPublic)
+async def get_me(current_user: UserPublic = Depends(get_current_user)) -> UserPublic:
     """
     Get the current authenticated user.
     """
@@ -72,18 +108,45 @@ async def update_me(user_update: UserUpdate, current_user: User = Depends(get_cu
             detail="An error occurred while updating the user"
         )
     
-@router.get('/users/all/', response_model=list[UserSecure])
-async def get_all_users(current_user: UserSecure = Depends(get_current_user)) -> list[UserSecure]:
-    """
-    Get all users in the system.
-    """
+def _require_admin(current_user: UserSecure) -> None:
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have permission to view all users"
         )
-    
-    users = await auth_service.get_all_users()
-    return users #type:ignore
 
-__all__ = ["get_current_user"]
\ No newline at end of file
+@router.get('/users/all/', response_model=list[UserPublic])
+async def get_all_users(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    current_user: UserSecure = Depends(get_current_user)
+) -> list[UserPublic]:
+    """
+    Get one page of users, ordered by username.
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    """
+    _require_admin(current_user)
+
+    users, next_cursor = await auth_service.list_users(limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
+
+@router.get('/users/all/stream')
+async def stream_all_users(
+    cursor: str | None = None,
+    current_user: UserSecure = Depends(get_current_user)
+) -> StreamingResponse:
+    """
+    Stream every user as NDJSON (one JSON object per line).
+    """
+    _require_admin(current_user)
+
+    async def ndjson():
+        async for user in auth_service.stream_users(cursor):
+            yield user.model_dump_json() + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+__all__ = ["get_current_user", "get_current_claims"]
\ No newline at end of file
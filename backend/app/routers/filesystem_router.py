@@ -1,14 +1,26 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from pydantic import BaseModel
-from typing import List
+import asyncio
+import os
+import time
+
+import orjson
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Literal
 
 from ..services.filesystem import FileSystem
 from ..services.authorization_service import AuthorizationService
-from ..models.models import VirtualFile
-from ..models.users import UserSecure
+from ..services.change_hub import ChangeHub, FileSubscription, TooManyListeners
+from ..services.file_events import FileEvents
+from ..monitoring.metrics import WEBSOCKET_CONNECTIONS
+from ..models.models import VirtualFile, SharedFile
+from ..models.jobs import Job
+from ..models.users import UserSecure, TokenData
 from ..permissions.file_permissions import PermissionRequired
+from .responses import TrustedJSONResponse
 
-from .auth_router import get_current_user
+from .auth_router import get_current_user, get_current_claims, auth_service
+from .jobs_router import submit_job
 
 
 router = APIRouter(prefix="/api/v1/filesystem", tags=["filesystem"])
@@ -26,15 +38,21 @@ class ShareWithMultipleRequest(BaseModel):
     permissions: List[str]
 
 
+class WatchRequest(BaseModel):
+    action: Literal["subscribe", "unsubscribe"]
+    file_id: str
+    subtree: bool = False  # directories only: also watch everything below it
+
+
 @router.get('/user/files/', response_model=list[VirtualFile], status_code=status.HTTP_200_OK,)
-async def get_user_files(current_user: UserSecure = Depends(get_current_user)) -> list[VirtualFile]:
+async def get_user_files(current_user: TokenData = Depends(get_current_claims)) -> TrustedJSONResponse:
     files = await fs.get_user_files(current_user.username)
     if not files:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No files found for the user"
         )
-    return files
+    return TrustedJSONResponse(files)
 
 
 @router.get('/files/public', response_model=List[VirtualFile])
@@ -42,7 +60,7 @@ async def get_public_files(limit: int = 50):
     """Get public files (no authentication required)"""
     try:
         public_files = await fs.get_public_files(limit)
-        return public_files
+        return TrustedJSONResponse(public_files)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -50,11 +68,17 @@ async def get_public_files(limit: int = 50):
         )
 
 
-@router.get('/files/shared-with-me', response_model=List[VirtualFile])
-async def get_shared_files(current_user: UserSecure = Depends(get_current_user)):
-    """Get files shared with the current user"""
+@router.get('/files/shared-with-me', response_model=List[SharedFile])
+async def get_shared_files(
+    limit: int = 50,
+    cursor: str | None = None,
+    current_user: UserSecure = Depends(get_current_user)
+):
+    """Get files shared with the current user, most recently shared first.
+    Pass the id of the last entry as `cursor` to fetch the next page."""
     try:
-        shared_files = await fs.get_shared_files(current_user.username)
+        shared_files = await fs.get_shared_files(
+            current_user.id, limit=limit, start_after=cursor, username=current_user.username)
         return shared_files
     except Exception as e:
         raise HTTPException(
@@ -66,13 +90,13 @@ async def get_shared_files(current_user: UserSecure = Depends(get_current_user))
 @router.post('/files/create', response_model=VirtualFile, status_code=status.HTTP_201_CREATED)
 async def create_file(
         file_data: dict,
-        current_user: UserSecure = Depends(get_current_user)) -> VirtualFile:
+        current_user: UserSecure = Depends(get_current_user)) -> TrustedJSONResponse:
     file_data['root'] = current_user.username
 
     try:
         file = VirtualFile.model_validate(file_data)
         created_file = await fs.create_file(file)
-        return created_file
+        return TrustedJSONResponse(created_file, status_code=status.HTTP_201_CREATED)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,29 +105,30 @@ async def create_file(
 
 
 @router.get("/files/public/{file_id}", response_model=VirtualFile, status_code=status.HTTP_200_OK)
-async def get_public_file(file_id: str) -> VirtualFile:
+async def get_public_file(file_id: str) -> TrustedJSONResponse:
     """
     Get a public file by its ID.
     """
-    file = await fs.get_file(file_id)
-    if not file or not file.public:
+    file = await fs.get_public_file(file_id)
+    if not file:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Public file not found"
         )
-    return file
+    return TrustedJSONResponse(file)
 
 
 @router.get('/files/{file_id}', response_model=VirtualFile, status_code=status.HTTP_200_OK)
 @PermissionRequired(permission="view")
-async def get_file(file_id: str, current_user: UserSecure = Depends(get_current_user)) -> VirtualFile:
-    file = await fs.get_file(file_id)
+async def get_file(file_id: str, current_user: UserSecure = Depends(get_current_user)) -> TrustedJSONResponse:
+    # PermissionRequired just read it through the cache
+    file = await fs.get_file(file_id, cached=True)
     if not file:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
-    return file
+    return TrustedJSONResponse(file)
 
 
 @router.post('/files/{file_id}/share', status_code=status.HTTP_200_OK)
@@ -116,7 +141,7 @@ async def share_file(
     """Share a file with another user"""
     try:
         success = await fs.share_file_with_user(
-            current_user.id,
+            current_user.username,
             file_id,
             share_request.username,
             share_request.permissions
@@ -177,7 +202,7 @@ async def share_file_with_multiple(
     for username in share_request.usernames:
         try:
             success = await fs.share_file_with_user(
-                current_user.id, file_id, username, share_request.permissions
+                current_user.username, file_id, username, share_request.permissions
             )
             results.append({
                 "username": username,
@@ -194,6 +219,34 @@ async def share_file_with_multiple(
     return {"results": results}
 
 
+async def _owned_file(file_id: str, current_user: UserSecure, action: str) -> VirtualFile:
+    file = await fs.get_file(file_id, cached=True)
+    if not file:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    if file.root != current_user.username:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"You do not have permission to {action} this file"
+        )
+    return file
+
+
+@router.post('/files/{file_id}/share-tree', response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def share_tree(
+    file_id: str,
+    share_request: ShareWithMultipleRequest,
+    current_user: UserSecure = Depends(get_current_user)
+):
+    """Share a directory and everything below it, as a background job (poll GET /api/v1/jobs/{id})"""
+    await _owned_file(file_id, current_user, "share")
+    return await submit_job('share_tree', current_user.username, owner_id=current_user.username,
+                            file_id=file_id, usernames=share_request.usernames,
+                            permissions=share_request.permissions)
+
+
 @router.delete('/files/{file_id}/share/{username}', status_code=status.HTTP_200_OK)
 @PermissionRequired(permission="edit")
 async def revoke_file_access(
@@ -204,7 +257,7 @@ async def revoke_file_access(
     """Revoke a user's access to a file"""
     try:
         success = await fs.revoke_user_access(
-            current_user.id, file_id, username
+            current_user.username, file_id, username
         )
 
         if not success:
@@ -229,7 +282,7 @@ async def get_file_permissions(
 ):
     """Get file permissions and sharing info"""
     try:
-        file = await fs.get_file(file_id)
+        file = await fs.get_file(file_id, cached=True)
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
 
@@ -253,7 +306,31 @@ async def get_file_permissions(
 async def update_file(
         file_id: str,
         file_data: dict,
-        current_user: UserSecure = Depends(get_current_user)) -> VirtualFile:
+        autosave: bool = False,
+        current_user: UserSecure = Depends(get_current_user)) -> TrustedJSONResponse:
+    """
+    Replace the file's content. With `autosave=true` the save is
+    write-behind: it is merged with the file's other saves and written
+    within AUTOSAVE_WINDOW seconds (or by POST .../flush); until then this
+    worker serves the new content.
+    """
+    new_content = file_data.get('content')
+    if new_content is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Content is required to update the file"
+        )
+
+    if autosave:
+        # PermissionRequired just read it through the cache; nothing to read back
+        file = await fs.get_file(file_id, cached=True)
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
+        await fs.update_file(file_id, new_content, buffered=True)
+        return TrustedJSONResponse(file.model_copy(update={'content': new_content}))
 
     file = await fs.get_file(file_id)
     if not file:
@@ -263,12 +340,6 @@ async def update_file(
         )
 
     try:
-        new_content = file_data.get('content')
-        if new_content is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Content is required to update the file"
-            )
         await fs.update_file(file_id, new_content)
         updated_file = await fs.get_file(file_id)
         if not updated_file:
@@ -276,7 +347,7 @@ async def update_file(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Failed to update file"
             )
-        return updated_file
+        return TrustedJSONResponse(updated_file)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -284,6 +355,14 @@ async def update_file(
         )
 
 
+@router.post('/files/{file_id}/flush', status_code=status.HTTP_200_OK)
+@PermissionRequired(permission="edit")
+async def flush_file(file_id: str, current_user: UserSecure = Depends(get_current_user)):
+    """Write the file's buffered autosave now, e.g. when the editor closes"""
+    written = await fs.buffer.flush(file_id)
+    return {"written": bool(written)}
+
+
 @router.delete('/files/{file_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_file(
         file_id: str,
@@ -303,7 +382,7 @@ async def delete_file(
         )
 
     try:
-        await fs.delete_file(file_id)
+        await fs.delete_file(file_id, file)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -311,6 +390,15 @@ async def delete_file(
         )
 
 
+@router.delete('/files/{file_id}/tree', response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+async def delete_tree(
+        file_id: str,
+        current_user: UserSecure = Depends(get_current_user)):
+    """Delete a directory and everything below it, as a background job (poll GET /api/v1/jobs/{id})"""
+    await _owned_file(file_id, current_user, "delete")
+    return await submit_job('delete_tree', current_user.username, file_id=file_id)
+
+
 @router.get('/search', response_model=List[VirtualFile])
 async def search_files(
     query: str,
@@ -324,7 +412,8 @@ async def search_files(
             query,
             current_user.username,
             include_shared,
-            include_public
+            include_public,
+            user_id=current_user.id
         )
 
         # Filter results based on view permissions
@@ -333,7 +422,7 @@ async def search_files(
             can_view = await authorization_service.can_user_view_file(current_user.id, file)
             if can_view:
                 accessible_files.append(file)
-        return accessible_files
+        return TrustedJSONResponse(accessible_files)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -342,11 +431,11 @@ async def search_files(
 
 
 @router.get('/user/tree', response_model=dict)
-async def get_file_tree(current_user: UserSecure = Depends(get_current_user)):
+async def get_file_tree(current_user: TokenData = Depends(get_current_claims)):
     """Get hierarchical file tree for the current user"""
     try:
         tree = await fs.get_file_tree(current_user.username)
-        return tree
+        return TrustedJSONResponse(tree)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -377,3 +466,160 @@ async def move_file(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error moving file: {str(e)}"
         )
+
+
+# Events queued for a client that stops reading; past this it is disconnected
+WS_QUEUE_SIZE = int(os.getenv('WS_QUEUE_SIZE', 256))
+WS_MAX_SUBSCRIPTIONS = int(os.getenv('WS_MAX_SUBSCRIPTIONS', 100))
+WS_MAX_SUBTREE_DIRECTORIES = int(os.getenv('WS_MAX_SUBTREE_DIRECTORIES', 100))
+
+
+@router.websocket('/ws')
+async def watch_files(websocket: WebSocket, token: str | None = None):
+    """
+    Push changes to files instead of polling for them.
+
+    Authenticate with `?token=<jwt>` (browsers can't set headers on a
+    WebSocket) or an Authorization header, then send
+    `{"action": "subscribe", "file_id": ..., "subtree": false}` or
+    `{"action": "unsubscribe", "file_id": ...}`. Events are described in
+    FileSubscription; every subscription first gets the current state.
+    Clients too slow to keep up are closed with code 1013 and should
+    reconnect and resubscribe.
+    """
+    if token is None:
+        scheme, _, credentials = websocket.headers.get('authorization', '').partition(' ')
+        token = credentials if scheme.lower() == 'bearer' else None
+    current_user = await auth_service.get_current_user(token) if token else None
+    if current_user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
+        return
+
+    await websocket.accept()
+    WEBSOCKET_CONNECTIONS.inc()
+    hub = ChangeHub.initialize()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+    subscriptions: dict[str, FileSubscription] = {}
+
+    def send(event: dict | None) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop the backlog and tell the writer to disconnect
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def write() -> None:
+        while (event := await queue.get()) is not None:
+            await websocket.send_text(orjson.dumps(event).decode())
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many pending events")
+
+    async def subscribe(request: WatchRequest) -> None:
+        current = subscriptions.get(request.file_id)
+        if current is not None and current.active:
+            current.stop()
+        elif sum(s.active for s in subscriptions.values()) >= WS_MAX_SUBSCRIPTIONS:
+            send({"type": "error", "subscription": request.file_id, "detail": "Too many subscriptions"})
+            return
+        file = await fs.get_file(request.file_id, cached=True)
+        if file is None:
+            send({"type": "error", "subscription": request.file_id, "detail": "File not found"})
+            return
+        if not file.public and current_user.username not in (file.can_view or []):
+            send({"type": "error", "subscription": request.file_id,
+                  "detail": "You don't have view permission for this file"})
+            return
+        subscription = FileSubscription(hub, current_user.username, request.file_id, send,
+                                        subtree=request.subtree, max_directories=WS_MAX_SUBTREE_DIRECTORIES)
+        try:
+            # Snapshots arrive on the loop later, so "subscribed" still goes first
+            subscription.start()
+        except TooManyListeners as e:
+            subscriptions.pop(request.file_id, None)
+            send({"type": "error", "subscription": request.file_id, "detail": str(e)})
+            return
+        subscriptions[request.file_id] = subscription
+        send({"type": "subscribed", "subscription": request.file_id, "subtree": request.subtree})
+
+    writer = asyncio.create_task(write())
+    try:
+        while not writer.done():
+            try:
+                request = WatchRequest.model_validate(await websocket.receive_json())
+            except (ValidationError, ValueError) as e:
+                send({"type": "error", "detail": f"Invalid message: {e}"})
+                continue
+            if request.action == "subscribe":
+                await subscribe(request)
+            elif (subscription := subscriptions.pop(request.file_id, None)) is not None:
+                subscription.stop()
+                send({"type": "unsubscribed", "subscription": request.file_id})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for subscription in subscriptions.values():
+            subscription.stop()
+        writer.cancel()
+        WEBSOCKET_CONNECTIONS.dec()
+
+
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+SSE_MAX_AGE = float(os.getenv('SSE_MAX_AGE', 300))
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 2000))
+
+
+@router.get('/events')
+async def file_events(
+        request: Request,
+        token: str | None = None,
+        authorization: str | None = Header(default=None),
+        last_event_id: str | None = Header(default=None)):
+    """
+    Server-Sent Events stream of changes to the user's tree and shares.
+
+    Events are `created`, `moved`, `deleted`, `shared` and `unshared`
+    (see FileEvents), each with an `id:` the browser sends back as
+    Last-Event-ID when it reconnects, so nothing is missed in between.
+    A `reset` event means events were lost: fetch /user/tree and
+    /files/shared-with-me again. Authenticate with `?token=<jwt>`
+    (EventSource can't set headers) or an Authorization header. The
+    stream ends every SSE_MAX_AGE seconds and the client reconnects,
+    which lets workers restart and connections rebalance.
+    """
+    if token is None:
+        scheme, _, credentials = (authorization or '').partition(' ')
+        token = credentials if scheme.lower() == 'bearer' else None
+    claims = auth_service.verify_token(token) if token else None
+    if claims is None or claims.username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    events = FileEvents.initialize()
+    subscription = events.subscribe(claims.username, last_event_id)
+
+    async def stream():
+        deadline = time.monotonic() + SSE_MAX_AGE
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), min(SSE_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                frame = f"event: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+                yield f"id: {event['id']}\n{frame}" if 'id' in event else frame
+        finally:
+            events.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Don't let nginx-style proxies hold events back
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+
+from ..models.jobs import Job
+from ..models.users import UserSecure
+from ..services.jobs import JobRunner, JobNotFound, JobQueueFull
+
+from .auth_router import get_current_user
+
+
+router = APIRouter(prefix="/api/v1/jobs", tags=["jobs"])
+
+
+async def submit_job(kind: str, owner: str, **params) -> Job:
+    """Queue a background job for a router; answer 503 when the queue is full"""
+    try:
+        return await JobRunner.initialize().submit(kind, owner, **params)
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many background jobs, try again later: {e}",
+            headers={"Retry-After": "30"},
+        )
+
+
+async def _own_job(job_id: str, current_user: UserSecure) -> Job:
+    job = await JobRunner.initialize().get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    if job.owner != current_user.username and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to access this job"
+        )
+    return job
+
+
+@router.get('/{job_id}', response_model=Job)
+async def get_job(job_id: str, current_user: UserSecure = Depends(get_current_user)):
+    """Status, progress (`done` of `total`) and, once finished, result or error of a job"""
+    return await _own_job(job_id, current_user)
+
+
+@router.post('/{job_id}/cancel', response_model=Job)
+async def cancel_job(job_id: str, current_user: UserSecure = Depends(get_current_user)):
+    """Cancel a job; a running job stops at its next step, so poll until it is finished"""
+    await _own_job(job_id, current_user)
+    try:
+        return await JobRunner.initialize().cancel(job_id)
+    except JobNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    # Firestore timestamps are a datetime subclass, which orjson doesn't serialise itself
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class TrustedJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, for models the services built from our own store.
+
+    Returning it from an endpoint skips FastAPI's response_model round trip
+    (validate the returned models again, dump them, json.dumps the result):
+    models are validated once when read from Firestore and dumped once here.
+    Keep response_model on the route for the OpenAPI schema, and don't use
+    it for anything built from request input.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default)
@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+
+from ..models.spaces import (ActiveFileUpdate, AppliedOperation, ChatMessage, ChatMessageCreate, EditDecision,
+                             EditRequest, OperationLog, OperationSubmit, SaveResult, SpaceCreate, SpaceJoin,
+                             SpaceListResponse, SpaceResponse)
+from ..models.users import UserPublic
+from ..services.spaces import SpaceService, SpaceNotFound, StaleOperation
+
+from .auth_router import get_current_user
+
+
+router = APIRouter(prefix="/api/v1/spaces", tags=["spaces"])
+spaces = SpaceService()
+
+
+@contextmanager
+def _space_errors():
+    """Map SpaceService errors to HTTP errors"""
+    try:
+        yield
+    except SpaceNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+    except StaleOperation as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get('', response_model=SpaceListResponse)
+async def list_spaces(limit: int = Query(50, ge=1, le=100),
+                      current_user: UserPublic = Depends(get_current_user)):
+    """Public spaces and the ones the user is in, without messages or files"""
+    return SpaceListResponse(spaces=await spaces.list_spaces(current_user, limit))
+
+
+@router.post('', response_model=SpaceResponse, status_code=status.HTTP_201_CREATED)
+async def create_space(space: SpaceCreate, current_user: UserPublic = Depends(get_current_user)):
+    return SpaceResponse(space=await spaces.create_space(current_user, space.name, space.is_public))
+
+
+@router.post('/join', response_model=SpaceResponse)
+async def join_space_by_code(join: SpaceJoin, current_user: UserPublic = Depends(get_current_user)):
+    with _space_errors():
+        return SpaceResponse(space=await spaces.join_by_code(current_user, join.join_code))
+
+
+@router.get('/{space_id}', response_model=SpaceResponse)
+async def get_space(space_id: str, current_user: UserPublic = Depends(get_current_user)):
+    with _space_errors():
+        return SpaceResponse(space=await spaces.get_space(space_id, current_user))
+
+
+@router.post('/{space_id}', response_model=SpaceResponse)
+async def join_space(space_id: str, current_user: UserPublic = Depends(get_current_user)):
+    """Join a public space (or rejoin one) by id; private spaces need /join with the code"""
+    with _space_errors():
+        return SpaceResponse(space=await spaces.join_space(current_user, space_id))
+
+
+@router.delete('/{space_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def leave_space(space_id: str, current_user: UserPublic = Depends(get_current_user)) -> None:
+    with _space_errors():
+        await spaces.leave_space(current_user, space_id)
+
+
+@router.post('/{space_id}/messages', response_model=ChatMessage, status_code=status.HTTP_201_CREATED)
+async def send_message(space_id: str, message: ChatMessageCreate,
+                       current_user: UserPublic = Depends(get_current_user)):
+    with _space_errors():
+        return await spaces.send_message(current_user, space_id, message.message)
+
+
+@router.post('/{space_id}/edit-requests', response_model=EditRequest, status_code=status.HTTP_201_CREATED)
+async def request_edit(space_id: str, current_user: UserPublic = Depends(get_current_user)):
+    with _space_errors():
+        return await spaces.request_edit(current_user, space_id)
+
+
+@router.put('/{space_id}/edit-requests/{user_id}', response_model=SpaceResponse)
+async def decide_edit(space_id: str, user_id: str, decision: EditDecision,
+                      current_user: UserPublic = Depends(get_current_user)):
+    """Creator only: grant or deny a user's edit request (deny also revokes editing)"""
+    with _space_errors():
+        return SpaceResponse(space=await spaces.decide_edit(current_user, space_id, user_id, decision.grant))
+
+
+@router.put('/{space_id}/active-file', response_model=SpaceResponse)
+async def set_active_file(space_id: str, update: ActiveFileUpdate,
+                          current_user: UserPublic = Depends(get_current_user)):
+    with _space_errors():
+        return SpaceResponse(space=await spaces.set_active_file(current_user, space_id, update.file_id))
+
+
+@router.post('/{space_id}/operations', response_model=AppliedOperation)
+async def submit_operation(space_id: str, operation: OperationSubmit,
+                           current_user: UserPublic = Depends(get_current_user)):
+    """
+    Apply an edit to the active file, made on `baseVersion` (see app.services.ot).
+    The response is the operation as applied, transformed past concurrent
+    edits, and the version it produced. 409 means the client is too far
+    behind and should reload the space.
+    """
+    with _space_errors():
+        return await spaces.submit_operation(current_user, space_id, operation.base_version, operation.ops)
+
+
+@router.get('/{space_id}/operations', response_model=OperationLog)
+async def get_operations(space_id: str, since: int = Query(..., ge=0),
+                         current_user: UserPublic = Depends(get_current_user)):
+    """Operations applied after version `since`; apply them in order to catch up"""
+    with _space_errors():
+        return await spaces.get_operations(current_user, space_id, since)
+
+
+@router.post('/{space_id}/save', response_model=SaveResult)
+async def save_active_file(space_id: str, current_user: UserPublic = Depends(get_current_user)):
+    """Write the active file now instead of at the next snapshot"""
+    with _space_errors():
+        return SaveResult(version=await spaces.save(current_user, space_id))
@@ -1,29 +1,67 @@
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import jwt
-import bcrypt
+import logging
 import os
+import time
 import uuid
+from typing import AsyncIterator
+from urllib.parse import quote
 
 from firebase_admin.firestore import SERVER_TIMESTAMP  # type:ignore
+from firebase_admin.firestore_async import async_transactional  # type:ignore
 
+from .cache import TTLCache
 from .firebase_service import FirebaseService
-from ..models.users import User, UserCreate, UserUpdate, UserLogin, Token, TokenData, UserSecure
+from .jobs import JobContext, JobRunner
+from .password_hasher import PasswordHasher
+from .shared_cache import SharedCache
+from .singleflight import SingleFlight
+from ..monitoring.tracing import trace_public_methods
+from ..models.users import User, UserCreate, UserUpdate, UserLogin, Token, TokenData, UserSecure, UserPublic
 
+logger = logging.getLogger(__name__)
 
+
+@trace_public_methods
 class AuthService:
-    def __init__(self):
-        self.db = FirebaseService().db
+    # Shared by every AuthService instance in the process.
+    # Verified JWT claims keyed by sha256(token); users resolved from them live in the SharedCache.
+    _token_cache = TTLCache(
+        maxsize=int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000)),
+        ttl=float(os.getenv('AUTH_TOKEN_CACHE_TTL', 300)),
+        name='auth_tokens')
+    _password_hasher = PasswordHasher()
+    # Concurrent lookups of one username share a single query
+    _user_flights = SingleFlight('users')
+    # Set once the backfill_reservations migration is seen to have succeeded; never unset
+    _reservations_complete = False
+
+    def __init__(self, db=None):
+        self._db = db
         self.secret_key = os.getenv(
             'JWT_SECRET_KEY', 'a-wild-key-like-Azula-or-keyla-bee')
         self.algorithm = "HS256"
         self.access_token_expire_minutes = 60 * 24 * 7
 
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
     def _hash_password(self, password: str) -> str:
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        return self._password_hasher._hash_sync(password)
 
     def _verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return self._password_hasher._verify_sync(plain_password, hashed_password)
+
+    async def hash_password(self, password: str) -> str:
+        """Hash on the bcrypt worker pool; raises HasherOverloaded when saturated"""
+        return await self._password_hasher.hash(password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify on the bcrypt worker pool; raises HasherOverloaded when saturated"""
+        return await self._password_hasher.verify(plain_password, hashed_password)
 
     def _create_access_token(self, data: dict, expires_delta: timedelta | None = None) -> str:
         to_encode = data.copy()
@@ -38,21 +76,19 @@ class AuthService:
             to_encode, self.secret_key, algorithm=self.algorithm)
         return encoded_jwt
 
-    async def create_user(self, user_data: UserCreate) -> User:
-        issue_dict = dict()
-        existing_user = await self.get_user_by_username(user_data.username)
-        if existing_user:
-            issue_dict['username'] = 'Username already exists'
-
-        existing_email = await self.get_user_by_email(user_data.email)
-        if existing_email:
-            issue_dict['email'] = 'Email already exists'
+    def _username_ref(self, username: str):
+        return self.db.collection('usernames').document(quote(username, safe=''))
 
-        if issue_dict:
-            raise ValueError(issue_dict)
+    def _email_ref(self, email: str):
+        return self.db.collection('emails').document(quote(email.lower(), safe=''))
 
-        user_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, user_data.username))
-        hashed_password = self._hash_password(user_data.password)
+    async def create_user(self, user_data: UserCreate) -> User:
+        """
+        Create a user, reserving usernames/{username} and emails/{email} in the
+        same transaction so two concurrent registrations can't both succeed.
+        """
+        user_id = str(uuid.uuid4())
+        hashed_password = await self.hash_password(user_data.password)
 
         user_doc = {
             "id": user_id,
@@ -64,46 +100,188 @@ class AuthService:
             "updated_at": SERVER_TIMESTAMP
         }
 
-        doc_ref = self.db.collection('users').document(user_id)
-        await doc_ref.set(user_doc)
-
-        created_doc = await doc_ref.get()
-        if not created_doc.exists:
-            raise Exception("User creation failed")
+        if not await self._reservations_backfilled():
+            await self._check_unreserved_accounts(user_data)
+
+        user_ref = self.db.collection('users').document(user_id)
+        username_ref = self._username_ref(user_data.username)
+        email_ref = self._email_ref(user_data.email)
+
+        @async_transactional
+        async def reserve_and_create(transaction):
+            issue_dict = dict()
+            async for snapshot in self.db.get_all([username_ref, email_ref], transaction=transaction):
+                if not snapshot.exists:
+                    continue
+                if snapshot.reference.path == username_ref.path:
+                    issue_dict['username'] = 'Username already exists'
+                else:
+                    issue_dict['email'] = 'Email already exists'
+
+            if issue_dict:
+                raise ValueError(issue_dict)
+
+            transaction.create(username_ref, {"user_id": user_id})
+            transaction.create(email_ref, {"user_id": user_id})
+            transaction.create(user_ref, user_doc)
+
+        await reserve_and_create(self.db.transaction())
+
+        now = datetime.utcnow()
+        return User.model_validate({**user_doc, "created_at": now, "updated_at": now})
+
+    async def _reservations_backfilled(self) -> bool:
+        if not AuthService._reservations_complete:
+            AuthService._reservations_complete = await JobRunner(self.db).migration_completed('backfill_reservations')
+        return AuthService._reservations_complete
+
+    async def _check_unreserved_accounts(self, user_data: UserCreate) -> None:
+        """
+        Until backfill_reservations has succeeded, accounts older than
+        reservations may have none: look their username and email up as
+        registration did before.
+        """
+        users = self.db.collection('users')
+        by_username, by_email = await asyncio.gather(
+            users.where('username', '==', user_data.username).limit(1).get(),
+            users.where('email', '==', user_data.email).limit(1).get())
+        issue_dict = dict()
+        if by_username:
+            issue_dict['username'] = 'Username already exists'
+        if by_email:
+            issue_dict['email'] = 'Email already exists'
+        if issue_dict:
+            raise ValueError(issue_dict)
 
-        user_data_dict = created_doc.to_dict()
-        if user_data_dict:
-            # user_data_dict.pop("password", None)
-            return User.model_validate(user_data_dict)
-        raise Exception("User creation failed, no data returned")
+    async def backfill_reservations(self, job: JobContext | None = None) -> dict:
+        """
+        Create missing usernames/ and emails/ reservation documents for users
+        registered before reservations existed. Queued at startup as the
+        'backfill_reservations' job until it succeeds (see main.py); until
+        then create_user also queries 'users' directly.
+
+        A username or email already reserved by another user is a duplicate
+        that predates reservations: it is left as is, logged and reported.
+
+        Returns:
+            dict: 'written', the number of reservations created, and
+            'conflicts', one {'user_id', 'field', 'value', 'reserved_by'}
+            per duplicate
+        """
+        written, conflicts, users = 0, [], 0
+        async for doc in self.db.collection('users').stream():
+            data = doc.to_dict()
+            if not data or not data.get('username') or not data.get('email'):
+                continue
+            refs = {'username': self._username_ref(data['username']),
+                    'email': self._email_ref(data['email'])}
+
+            @async_transactional
+            async def reserve(transaction, user_id: str) -> tuple[int, list[dict]]:
+                owners = {snapshot.reference.path: (snapshot.to_dict() or {}).get('user_id')
+                          async for snapshot in self.db.get_all(list(refs.values()), transaction=transaction)
+                          if snapshot.exists}
+                created, clashes = 0, []
+                for field, ref in refs.items():
+                    owner = owners.get(ref.path)
+                    if owner is None:
+                        transaction.create(ref, {"user_id": user_id})
+                        created += 1
+                    elif owner != user_id:
+                        clashes.append({'user_id': user_id, 'field': field,
+                                        'value': data[field], 'reserved_by': owner})
+                return created, clashes
+
+            created, clashes = await reserve(self.db.transaction(), doc.id)
+            written += created
+            for clash in clashes:
+                logger.warning("Duplicate account found by the reservation backfill", extra=clash)
+            conflicts += clashes
+            users += 1
+            if job is not None:
+                await job.progress(users)
+        return {'written': written, 'conflicts': conflicts}
 
     async def authenticate_user(self, user_login: UserLogin) -> Token:
         user = await self.get_user_by_email(user_login.email)
-        if not user or not self._verify_password(user_login.password, user.password):
+        if not user or not await self.verify_password(user_login.password, user.password):
             raise ValueError("Invalid email or password")
 
+        # Transparently upgrade hashes made with a different BCRYPT_ROUNDS
+        if self._password_hasher.needs_rehash(user.password):
+            try:
+                new_hash = await self.hash_password(user_login.password)
+                await self.db.collection('users').document(user.id).update({
+                    'password': new_hash
+                })
+                await self.invalidate_user(user.username)
+            except Exception as e:
+                # The login itself succeeded; the upgrade is retried next time
+                logger.warning("Password rehash failed", extra={
+                               "user": user.username, "error": str(e)})
+
         access_token_expires = timedelta(
             minutes=self.access_token_expire_minutes)
         access_token = self._create_access_token(
-            data={"sub": user.username, "email": user.email},
+            data={"sub": user.username, "email": user.email, "uid": user.id},
             expires_delta=access_token_expires
         )
 
         return Token(access_token=access_token, expires_in=self.access_token_expire_minutes)
 
-    async def get_current_user(self, token: str) -> User | None:
+    def verify_token(self, token: str) -> TokenData | None:
+        """Decode and verify a JWT, returning its claims without touching Firestore.
+
+        Verified claims are cached by token hash until the token expires
+        (or the cache TTL elapses, whichever is sooner).
+        """
+        token_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        claims = self._token_cache.get(token_key)
+        if claims is not None:
+            return claims
+
         try:
             payload = jwt.decode(token, self.secret_key,
                                  algorithms=[self.algorithm])
-            username: str = payload.get("sub")
-            email: str = payload.get("email")
-            if username is None or email is None:
-                return None
-            return await self.get_user_by_username(username)
         except jwt.PyJWTError:
             return None
 
+        username = payload.get("sub")
+        email = payload.get("email")
+        if username is None or email is None:
+            return None
+
+        claims = TokenData(username=username, email=email,
+                           id=payload.get("uid"))
+        ttl = self._token_cache.ttl
+        if payload.get("exp") is not None:
+            ttl = min(ttl, payload["exp"] - time.time())
+        self._token_cache.set(token_key, claims, ttl=ttl)
+        return claims
+
+    async def get_current_user(self, token: str) -> UserPublic | None:
+        claims = self.verify_token(token)
+        if claims is None or claims.username is None:
+            return None
+
+        # Cached without the password hash, which never leaves Firestore
+        return await SharedCache.initialize().get_or_load(
+            'user', claims.username, UserPublic,
+            lambda: self.get_user_by_username(claims.username))
+
+    async def invalidate_user(self, *usernames: str) -> None:
+        """Forget cached users and verified tokens for the given usernames, on every worker"""
+        cache = SharedCache.initialize()
+        for username in usernames:
+            self._user_flights.forget(username)
+            await cache.invalidate('user', username)
+        self._token_cache.evict(
+            lambda _, claims: claims.username in usernames)
+
     async def get_user_by_username(self, username: str) -> UserSecure | None:
+        return await self._user_flights.do(username, lambda: self._fetch_user_by_username(username))
+
+    async def _fetch_user_by_username(self, username: str) -> UserSecure | None:
         query = self.db.collection('users').where('username', '==', username)
         docs = await query.get()
         if docs:
@@ -125,48 +303,100 @@ class AuthService:
 
     async def update_user(self, user_id: str, user_update: UserUpdate) -> User:
         user_doc_ref = self.db.collection('users').document(user_id)
-        user_doc = await user_doc_ref.get()
 
-        if not user_doc.exists:
-            raise ValueError("User not found")
-
-        user_data = user_doc.to_dict()
-        if not user_data:
-            raise ValueError("User data is empty")
+        @async_transactional
+        async def apply_update(transaction) -> tuple[dict, str | None]:
+            user_doc = await user_doc_ref.get(transaction=transaction)
+
+            if not user_doc.exists:
+                raise ValueError("User not found")
+
+            user_data = user_doc.to_dict()
+            if not user_data:
+                raise ValueError("User data is empty")
+            previous = dict(user_data)
+
+            # Moves are (old reservation, new reservation) pairs; all reads
+            # must happen before the transaction's first write.
+            moves = []
+            if user_update.username is not None and user_update.username != previous.get('username'):
+                new_ref = self._username_ref(user_update.username)
+                reservation = await new_ref.get(transaction=transaction)
+                if reservation.exists and (reservation.to_dict() or {}).get('user_id') != user_id:
+                    raise ValueError("Username already exists")
+                moves.append((self._username_ref(previous['username']), new_ref))
+                user_data['username'] = user_update.username
+
+            if user_update.email is not None and user_update.email.lower() != str(previous.get('email', '')).lower():
+                new_ref = self._email_ref(user_update.email)
+                reservation = await new_ref.get(transaction=transaction)
+                if reservation.exists and (reservation.to_dict() or {}).get('user_id') != user_id:
+                    raise ValueError("Email already exists")
+                moves.append((self._email_ref(previous['email']), new_ref))
+            if user_update.email is not None:
+                user_data['email'] = user_update.email
+
+            if user_update.role is not None:
+                user_data['role'] = user_update.role.value
+
+            for old_ref, new_ref in moves:
+                transaction.delete(old_ref)
+                transaction.set(new_ref, {"user_id": user_id})
+
+            transaction.set(user_doc_ref, {
+                **user_data, 'updated_at': SERVER_TIMESTAMP})
+            return user_data, previous.get('username')
+
+        user_data, previous_username = await apply_update(self.db.transaction())
+        await self.invalidate_user(previous_username, user_data['username'])
+
+        # user_data.pop("password", None)
+        return User.model_validate({**user_data, 'updated_at': datetime.utcnow()})
+
+    # Fields fetched for user listings; 'password' is never read
+    PUBLIC_USER_FIELDS = ['id', 'username', 'email',
+                          'role', 'created_at', 'updated_at']
+
+    def _user_listing_query(self, start_after: str | None = None):
+        query = self.db.collection('users').select(
+            self.PUBLIC_USER_FIELDS).order_by('username')
+        if start_after:
+            query = query.start_after({'username': start_after})
+        return query
+
+    async def list_users(self, limit: int = 100, start_after: str | None = None) -> tuple[list[UserPublic], str | None]:
+        """
+        One page of users ordered by username, without password hashes.
+
+        Args:
+            limit: Maximum number of users to return
+            start_after: username of the last user of the previous page (cursor)
+
+        Returns:
+            tuple: the users, and the cursor for the next page (None on the last page)
+        """
+        users = []
+        async for doc in self._user_listing_query(start_after).limit(limit).stream():
+            user_data = doc.to_dict()
+            if user_data:
+                users.append(UserPublic.model_validate(user_data))
 
-        if user_update.username is not None:
-            existing_user = await self.get_user_by_username(user_update.username)
-            if existing_user and existing_user.id != user_id:
-                raise ValueError("Username already exists")
-            user_data['username'] = user_update.username
+        next_cursor = users[-1].username if len(users) == limit else None
+        return users, next_cursor
 
-        if user_update.email is not None:
-            existing_email = await self.get_user_by_email(user_update.email)
-            if existing_email and existing_email.id != user_id:
-                raise ValueError("Email already exists")
-            user_data['email'] = user_update.email
+    async def stream_users(self, start_after: str | None = None) -> AsyncIterator[UserPublic]:
+        """Yield every user, without password hashes, one document at a time"""
+        async for doc in self._user_listing_query(start_after).stream():
+            user_data = doc.to_dict()
+            if user_data:
+                yield UserPublic.model_validate(user_data)
 
-        if user_update.role is not None:
-            user_data['role'] = user_update.role.value
+    async def get_all_users(self) -> list[UserPublic]:
+        return [user async for user in self.stream_users()]
 
-        user_data['updated_at'] = SERVER_TIMESTAMP
-        await user_doc_ref.set(user_data)
 
-        updated_doc = await user_doc_ref.get()
-        updated_data = updated_doc.to_dict()
-        if updated_data:
-            # updated_data.pop("password", None)
-            return User.model_validate(updated_data)
+async def _backfill_reservations(job: JobContext) -> dict:
+    return await AuthService(job.db).backfill_reservations(job)
 
-        raise Exception("User update failed, no data returned")
 
-    async def get_all_users(self) -> list[User]:
-        users = []
-        query = self.db.collection('users')
-        docs = await query.get()
-        for doc in docs:
-            user_data = doc.to_dict()
-            if user_data:
-                # user_data.pop("password", None)
-                users.append(User.model_validate(user_data))
-        return users
+JobRunner.register('backfill_reservations', _backfill_reservations)
@@ -1,49 +1,52 @@
 from enum import Enum 
 
+from .filesystem import FileSystem
 from .firebase_service import FirebaseService
+from .shared_cache import SharedCache
 from ..models.users import User, UserCreate, UserUpdate, UserLogin, Token, Token, UserSecure
 from ..models.models import VirtualFile
+from ..monitoring.tracing import trace_public_methods
 
+@trace_public_methods
 class AuthorizationService:
-    def __init__(self):
-        self.db = FirebaseService().db
+    def __init__(self, db=None):
+        self._db = db
 
-    async def _get_user_view_list(self, file:VirtualFile):
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
+    async def _get_user_view_list(self, file:VirtualFile, cached: bool = False) -> list[str]:
         """
         Get the list of user IDs who can view the file.
+        `cached` reads through the SharedCache, for permission checks.
         """
-        doc_ref = self.db.collection('files').document(file.id)
-        doc = await doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
-            if data:
-                return data.get('can_view', [])
-        return []
+        current = await FileSystem(self.db).get_file(file.id, cached=cached)
+        # A copy: the cached model is shared
+        return list(current.can_view or []) if current else []
     
-    async def _get_user_edit_list(self, file:VirtualFile):
+    async def _get_user_edit_list(self, file:VirtualFile, cached: bool = False) -> list[str]:
         """
         Get the list of user IDs who can edit the file.
+        `cached` reads through the SharedCache, for permission checks.
         """
-        doc_ref = self.db.collection('files').document(file.id)
-        doc = await doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
-            if data:
-                return data.get('can_edit', [])
-        return []
+        current = await FileSystem(self.db).get_file(file.id, cached=cached)
+        return list(current.can_edit or []) if current else []
     
     async def can_user_view_file(self, user_id: str, file: VirtualFile) -> bool:
         """
         Check if a user can view a file.
+        Served from the cached file, which every ACL write invalidates.
         """
-        can_view = await self._get_user_view_list(file)
+        can_view = await self._get_user_view_list(file, cached=True)
         return user_id in can_view
     
     async def can_user_edit_file(self, user_id: str, file: VirtualFile) -> bool:
         """
         Check if a user can edit a file.
+        Served from the cached file, which every ACL write invalidates.
         """
-        can_edit = await self._get_user_edit_list(file)
+        can_edit = await self._get_user_edit_list(file, cached=True)
         return user_id in can_edit
     
     async def add_user_to_view_list(self, user_id: str, file: VirtualFile) -> None:
@@ -55,6 +58,7 @@ class AuthorizationService:
             can_view.append(user_id)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_view': can_view})
+            await SharedCache.initialize().invalidate('file', file.id)
 
     async def add_user_to_edit_list(self, user_id: str, file: VirtualFile) -> None:
         """
@@ -65,6 +69,7 @@ class AuthorizationService:
             can_edit.append(user_id)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_edit': can_edit})
+            await SharedCache.initialize().invalidate('file', file.id)
 
     async def remove_user_from_view_list(self, user_id: str, file: VirtualFile) -> None:
         """
@@ -75,6 +80,7 @@ class AuthorizationService:
             can_view.remove(user_id)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_view': can_view})
+            await SharedCache.initialize().invalidate('file', file.id)
 
     async def remove_user_from_edit_list(self, user_id: str, file: VirtualFile) -> None:
         """
@@ -85,6 +91,7 @@ class AuthorizationService:
             can_edit.remove(user_id)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_edit': can_edit})
+            await SharedCache.initialize().invalidate('file', file.id)
     
     async def get_user_permissions(self, user_id: str, file: VirtualFile) -> dict:
         """
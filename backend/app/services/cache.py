@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..monitoring.metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """In-process LRU cache whose entries expire after `ttl` seconds.
+
+    Entries are evicted least-recently-used first once `maxsize` is reached.
+    Meant to be used from the event loop thread only; it does no locking.
+    A named cache reports hits and misses to sensei_cache_requests_total.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, name: str | None = None) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._hits, self._misses = cache_counters(name) if name else (None, None)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value, or `default` if missing or expired"""
+        value = self._lookup(key)
+        if value is _MISSING:
+            if self._misses is not None:
+                self._misses.inc()
+            return default
+        if self._hits is not None:
+            self._hits.inc()
+        return value
+
+    def _lookup(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Store a value; `ttl` overrides the cache default for this entry"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def evict(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Drop every entry for which predicate(key, value) is true"""
+        doomed = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+        for key in doomed:
+            del self._data[key]
+        return len(doomed)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SWRCache:
+    """Read-through LRU cache with stale-while-revalidate and request coalescing.
+
+    An entry is served as is for `ttl` seconds. For `stale_ttl` seconds after
+    that it is still served, but the first reader starts a background refresh.
+    Misses and older entries are loaded inline, and concurrent loads of one
+    key share a single call. Values may be None (cache "not found" too).
+    invalidate() drops the entry and detaches any load in flight for it, so a
+    read that started before a write can't put the old value back.
+    Like TTLCache, meant to be used from the event loop thread only.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, stale_ttl: float = 60.0,
+                 name: str | None = None) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Task] = {}
+        self._hits, self._misses = cache_counters(name) if name else (None, None)
+
+    async def get_or_load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for `key`, calling `load()` to fill or refresh it"""
+        item = self._data.get(key)
+        if item is not None:
+            age = time.monotonic() - item[0]
+            if age < self.ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                if self._hits is not None:
+                    self._hits.inc()
+                if age >= self.ttl and key not in self._loading:
+                    self._start_load(key, load)
+                return item[1]
+            del self._data[key]
+
+        if self._misses is not None:
+            self._misses.inc()
+        task = self._loading.get(key) or self._start_load(key, load)
+        # A caller going away (client disconnect) mustn't cancel the shared load
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = asyncio.ensure_future(load())
+        self._loading[key] = task
+        task.add_done_callback(lambda t: self._loaded(key, t))
+        return task
+
+    def _loaded(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._loading.get(key) is not task:
+            # Invalidated while loading; the result may predate the write
+            if not task.cancelled():
+                task.exception()
+            return
+        del self._loading[key]
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            # Inline waiters get the error; a failed background refresh keeps the stale value
+            logger.debug("Cache load failed", extra={"cache": self.name, "error": repr(error)})
+            return
+        self._data[key] = (time.monotonic(), task.result())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def evict(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Drop every entry for which predicate(key, value) is true.
+
+        Loads in flight are detached if predicate(key, None) is true, since
+        their value isn't known yet.
+        """
+        doomed = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+        for key in doomed:
+            self.invalidate(key)
+        for key in [k for k in self._loading if predicate(k, None)]:
+            del self._loading[key]
+        return len(doomed)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._loading.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
@@ -0,0 +1,270 @@
+import asyncio
+import functools
+import logging
+import os
+from typing import Callable
+
+from .firebase_service import FirebaseService
+from ..models.models import VirtualFile
+from ..monitoring.metrics import CHANGE_LISTENERS
+
+logger = logging.getLogger(__name__)
+
+# callback(target, changes, initial): changes are (file_id, file or None if gone/out of the target)
+ChangeCallback = Callable[[tuple, list, bool], None]
+
+
+class TooManyListeners(Exception):
+    """The hub already runs CHANGE_HUB_MAX_LISTENERS listeners"""
+
+
+class _Listener:
+    def __init__(self, target: tuple) -> None:
+        self.target = target
+        self.callbacks: list[ChangeCallback] = []
+        self.handle = None
+        # file_id -> raw document, None until the first snapshot arrives
+        self.state: dict[str, dict] | None = None
+
+
+def _payload(file_id: str, data: dict | None) -> dict | None:
+    if data is None:
+        return None
+    return VirtualFile.model_validate({**data, 'id': file_id}).model_dump(mode='json')
+
+
+class ChangeHub:
+    """Firestore snapshot listeners shared by every subscriber in the process.
+
+    A target is ('file', id), the file's document, or ('children', id), the
+    files whose parent is directory `id` (one query listener per directory,
+    not one per child). The first watch() of a target opens its listener
+    and the last unwatch() closes it; in between its changes are fanned out
+    to every callback, so N clients watching a hot file cost one listener
+    instead of N pollers.
+
+    Callbacks run on the event loop, first with the target's current
+    contents (initial=True), then with what changed in each snapshot.
+    """
+    _instance = None
+
+    def __init__(self, client=None, max_listeners: int = 1000) -> None:
+        self._client = client
+        self.max_listeners = max_listeners
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._listeners: dict[tuple, _Listener] = {}
+
+    @classmethod
+    def initialize(cls) -> "ChangeHub":
+        """The process-wide hub; listeners are only opened once something is watched"""
+        if cls._instance is None:
+            cls._instance = cls(max_listeners=int(os.getenv('CHANGE_HUB_MAX_LISTENERS', 1000)))
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        """Close every listener of the process-wide hub, if one was created"""
+        hub, cls._instance = cls._instance, None
+        if hub is not None:
+            hub.stop()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = FirebaseService.listener_client()
+        return self._client
+
+    def __len__(self) -> int:
+        return len(self._listeners)
+
+    def _query(self, target: tuple):
+        kind, file_id = target
+        files = self.client.collection('files')
+        if kind == 'file':
+            return files.document(file_id)
+        if kind == 'children':
+            return files.where('parent', '==', file_id)
+        raise ValueError(f"Unknown target: {target!r}")
+
+    def watch(self, target: tuple, callback: ChangeCallback) -> None:
+        """Call callback with the changes to target until unwatch(); raises TooManyListeners"""
+        listener = self._listeners.get(target)
+        if listener is not None:
+            listener.callbacks.append(callback)
+            if listener.state is not None:
+                # Later subscribers start from the last snapshot, without another read
+                self._loop.call_soon(self._replay, listener, callback)
+            return
+
+        if len(self._listeners) >= self.max_listeners:
+            raise TooManyListeners(f"Already {len(self._listeners)} change listeners open")
+        self._loop = asyncio.get_running_loop()
+        listener = self._listeners[target] = _Listener(target)
+        listener.callbacks.append(callback)
+        listener.handle = self._query(target).on_snapshot(
+            functools.partial(self._on_snapshot, listener))
+        CHANGE_LISTENERS.set(len(self._listeners))
+
+    def unwatch(self, target: tuple, callback: ChangeCallback) -> None:
+        listener = self._listeners.get(target)
+        if listener is None or callback not in listener.callbacks:
+            return
+        listener.callbacks.remove(callback)
+        if not listener.callbacks:
+            del self._listeners[target]
+            listener.handle.unsubscribe()
+            CHANGE_LISTENERS.set(len(self._listeners))
+
+    def stop(self) -> None:
+        listeners, self._listeners = self._listeners, {}
+        for listener in listeners.values():
+            listener.handle.unsubscribe()
+        CHANGE_LISTENERS.set(0)
+
+    def _on_snapshot(self, listener: _Listener, docs, changes, read_time) -> None:
+        # On the listener's thread with Firestore: copy the data, then hop to the loop
+        state = {doc.id: doc.to_dict() for doc in docs}
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, listener, state)
+        except RuntimeError:
+            # The loop closed while shutting down
+            pass
+
+    def _deliver(self, listener: _Listener, state: dict[str, dict]) -> None:
+        if self._listeners.get(listener.target) is not listener:
+            return
+        previous, listener.state = listener.state, state
+        if previous is None:
+            changes = self._initial(listener)
+        else:
+            changes = [(file_id, _payload(file_id, state.get(file_id)))
+                       for file_id in [*previous, *(k for k in state if k not in previous)]
+                       if previous.get(file_id) != state.get(file_id)]
+        if not changes:
+            return
+        for callback in list(listener.callbacks):
+            if callback in listener.callbacks:
+                self._call(callback, listener.target, changes, previous is None)
+
+    def _replay(self, listener: _Listener, callback: ChangeCallback) -> None:
+        if self._listeners.get(listener.target) is listener and callback in listener.callbacks:
+            self._call(callback, listener.target, self._initial(listener), True)
+
+    @staticmethod
+    def _initial(listener: _Listener) -> list:
+        kind, file_id = listener.target
+        if kind == 'file':
+            return [(file_id, _payload(file_id, listener.state.get(file_id)))]
+        return [(child_id, _payload(child_id, data)) for child_id, data in listener.state.items()]
+
+    @staticmethod
+    def _call(callback: ChangeCallback, target: tuple, changes: list, initial: bool) -> None:
+        # One broken subscriber mustn't stop the others from hearing about the change
+        try:
+            callback(target, changes, initial)
+        except Exception:
+            logger.exception("Change callback failed", extra={"target": list(target)})
+
+
+class FileSubscription:
+    """One client's subscription to a file, or to a directory and everything below it.
+
+    Turns the hub's changes into events for `send`:
+        {"type": "updated", "file": {...}}                 the file itself changed
+        {"type": "deleted", "file_id": ...}                the file is gone
+        {"type": "added", "parent": ..., "file": {...}}    subtree: a file appeared in a directory
+        {"type": "updated", "parent": ..., "file": {...}}  subtree: a file in it changed
+        {"type": "removed", "parent": ..., "file_id": ...} subtree: a file left a directory
+        {"type": "error", "detail": ...}
+    Each event also carries "subscription" (the subscribed id) and
+    "initial" (true for the contents sent when watching starts). Files the
+    user can't view are left out, and losing access to the subscribed file
+    ends the subscription, as does its deletion.
+    """
+
+    def __init__(self, hub: ChangeHub, username: str, file_id: str, send: Callable[[dict], None],
+                 subtree: bool = False, max_directories: int = 100) -> None:
+        self.hub = hub
+        self.username = username
+        self.file_id = file_id
+        self.subtree = subtree
+        self.max_directories = max_directories
+        self.active = False
+        self._send = send
+        # Watched directory -> the children the user was told about
+        self._directories: dict[str, set[str]] = {}
+
+    def start(self) -> None:
+        self.hub.watch(('file', self.file_id), self._on_change)
+        self.active = True
+
+    def stop(self) -> None:
+        self.active = False
+        self.hub.unwatch(('file', self.file_id), self._on_change)
+        for directory_id in list(self._directories):
+            self._unwatch_directory(directory_id)
+
+    def _can_view(self, file: dict) -> bool:
+        return file['public'] or self.username in (file['can_view'] or [])
+
+    def _emit(self, event: dict, initial: bool = False) -> None:
+        self._send({**event, "subscription": self.file_id, "initial": initial})
+
+    def _on_change(self, target: tuple, changes: list, initial: bool) -> None:
+        if not self.active:
+            return
+        kind, target_id = target
+        if kind == 'file':
+            self._on_file(changes[0][1], initial)
+        else:
+            self._on_children(target_id, changes, initial)
+
+    def _on_file(self, file: dict | None, initial: bool) -> None:
+        if file is None:
+            self._emit({"type": "deleted", "file_id": self.file_id}, initial)
+            self.stop()
+        elif not self._can_view(file):
+            self._emit({"type": "error", "detail": "You no longer have view permission for this file"}, initial)
+            self.stop()
+        else:
+            self._emit({"type": "updated", "file": file}, initial)
+            if self.subtree and file['directory'] and self.file_id not in self._directories:
+                self._watch_directory(self.file_id)
+
+    def _on_children(self, directory_id: str, changes: list, initial: bool) -> None:
+        known = self._directories.get(directory_id)
+        if known is None:
+            return
+        for child_id, file in changes:
+            if file is not None and self._can_view(file):
+                if initial and child_id in known:
+                    # Replay of something already sent
+                    continue
+                event_type = "updated" if child_id in known else "added"
+                known.add(child_id)
+                self._emit({"type": event_type, "parent": directory_id, "file": file}, initial)
+                if file['directory'] and child_id not in self._directories:
+                    self._watch_directory(child_id)
+            elif child_id in known:
+                known.discard(child_id)
+                self._emit({"type": "removed", "parent": directory_id, "file_id": child_id}, initial)
+                self._unwatch_directory(child_id)
+
+    def _watch_directory(self, directory_id: str) -> None:
+        if len(self._directories) >= self.max_directories:
+            self._emit({"type": "error", "detail": f"Subtree too large, directory {directory_id} is not watched"})
+            return
+        self._directories[directory_id] = set()
+        try:
+            self.hub.watch(('children', directory_id), self._on_change)
+        except TooManyListeners as e:
+            del self._directories[directory_id]
+            self._emit({"type": "error", "detail": f"{e}, directory {directory_id} is not watched"})
+
+    def _unwatch_directory(self, directory_id: str) -> None:
+        known = self._directories.pop(directory_id, None)
+        if known is None:
+            return
+        self.hub.unwatch(('children', directory_id), self._on_change)
+        for child_id in known:
+            self._unwatch_directory(child_id)
@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Iterable
+
+import orjson
+
+from .shared_cache import SharedCache
+from ..models.models import VirtualFile
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('created', 'moved', 'deleted', 'shared', 'unshared')
+# Tells a subscriber it missed events and should fetch its tree and inbox again
+RESET = {'type': 'reset'}
+
+
+class EventSubscription:
+    """Events for one user, as a bounded queue; overflowing replaces the backlog with a reset"""
+
+    def __init__(self, username: str, maxsize: int) -> None:
+        self.username = username
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event: dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class FileEvents:
+    """Bus for changes to file trees and sharing, fed by FileSystem's mutations.
+
+    publish() sends an event to the users it names, on every worker: it
+    goes out on the SharedCache backend's pub/sub channel
+    ({CACHE_NAMESPACE}:events) and each process started with start()
+    hands it to its local subscribers. Events look like
+        {"id": ..., "type": "created"|"moved"|"deleted"|"shared"|"unshared",
+         "file": {"id", "name", "parent", "directory", "root"}, ...}
+    with "from"/"to" on moves and "user"/"permissions" on (un)shares.
+
+    The last FILE_EVENTS_REPLAY events are kept so a reconnecting client
+    can resume after the last id it saw; older ids get a reset instead.
+    """
+    _instance = None
+
+    def __init__(self, backend=None, channel: str = 'sensei:events',
+                 queue_size: int = 256, replay: int = 1000) -> None:
+        self.backend = backend
+        self.channel = channel
+        self.queue_size = queue_size
+        self._recent: deque[dict] = deque(maxlen=replay)
+        self._subscribers: dict[str, set[EventSubscription]] = {}
+        self._listener: asyncio.Task | None = None
+        self._sequence = itertools.count()
+
+    @classmethod
+    def initialize(cls) -> "FileEvents":
+        if cls._instance is None:
+            cache = SharedCache.initialize()
+            cls._instance = cls(
+                cache.backend, f"{cache.namespace}:events",
+                queue_size=int(os.getenv('FILE_EVENTS_QUEUE_SIZE', 256)),
+                replay=int(os.getenv('FILE_EVENTS_REPLAY', 1000)))
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        events, cls._instance = cls._instance, None
+        if events is not None:
+            await events.stop()
+
+    async def start(self) -> None:
+        """Receive events published by other processes (and this one) through the backend"""
+        if self._listener is None and self.backend is not None:
+            self._listener = asyncio.create_task(self.backend.listen(self.channel, self._on_message))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def subscribe(self, username: str, last_event_id: str | None = None) -> EventSubscription:
+        """Start receiving the user's events, after `last_event_id` when resuming"""
+        subscription = EventSubscription(username, self.queue_size)
+        if last_event_id:
+            ids = [event['id'] for event in self._recent]
+            if last_event_id in ids:
+                for event in list(self._recent)[ids.index(last_event_id) + 1:]:
+                    if username in event['users']:
+                        subscription.put(self._public(event))
+            else:
+                subscription.put(RESET)
+        self._subscribers.setdefault(username, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription) -> None:
+        subscribers = self._subscribers.get(subscription.username)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.username]
+
+    @staticmethod
+    def _public(event: dict) -> dict:
+        return {key: value for key, value in event.items() if key != 'users'}
+
+    async def publish(self, event_type: str, file: VirtualFile, users: Iterable[str], **fields) -> dict:
+        """Tell `users` about a change to `file`; call after the write has been committed"""
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type: {event_type!r}")
+        event = {
+            # Sortable across workers, unique within them
+            'id': f"{time.time_ns() // 1_000_000:013d}-{next(self._sequence)}-{uuid.uuid4().hex[:6]}",
+            'type': event_type,
+            'file': {'id': file.id, 'name': file.name, 'parent': file.parent,
+                     'directory': file.directory, 'root': file.root},
+            **fields,
+            'users': sorted(set(users)),
+        }
+        if self._listener is None:
+            self._deliver(event)
+            return event
+        try:
+            await self.backend.publish(self.channel, orjson.dumps(event).decode())
+        except Exception as e:
+            # Other workers miss it; this one still delivers
+            logger.warning("File event not broadcast: %r", e)
+            self._deliver(event)
+        return event
+
+    def _on_message(self, message: bytes | str | None) -> None:
+        if message is None:
+            # Lost connection to the backend: events may have been missed
+            self._recent.clear()
+            for subscribers in self._subscribers.values():
+                for subscription in subscribers:
+                    subscription.put(RESET)
+            return
+        self._deliver(orjson.loads(message))
+
+    def _deliver(self, event: dict) -> None:
+        self._recent.append(event)
+        public = self._public(event)
+        for username in event['users']:
+            for subscription in self._subscribers.get(username, ()):
+                subscription.put(public)
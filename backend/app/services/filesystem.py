@@ -1,8 +1,23 @@
+import asyncio
+import logging
+import os
+
 from firebase_admin import firestore_async as firestore
+from google.api_core.exceptions import NotFound
+from .cache import SWRCache
+from .file_events import FileEvents
 from .firebase_service import FirebaseService
-from ..models.models import VirtualFile
+from .jobs import JobContext, JobRunner
+from .shared_cache import SharedCache
+from .singleflight import SingleFlight
+from .write_behind import WriteBehindBuffer
+from ..models.models import VirtualFile, SharedFile
+from ..monitoring.tracing import trace_public_methods
+
+logger = logging.getLogger(__name__)
 
 
+@trace_public_methods
 class FileSystem:
     """Virtual Filesystem for each user, for each user the root is located at {username}/
     Each created file is actually a json document with markers that allow the filesystem to
@@ -22,15 +37,83 @@ class FileSystem:
             "created_at": timestamp // Timestamp of creation
             "updated_at": timestamp // Timestamp of last update
         }
+    - Sharing a file also writes a small entry into the target user's inbox at
+      users/{user_id}/shared/{file_id} (see SharedFile), in the same batch as the
+      can_view/can_edit update, so "shared with me" never has to scan 'files'.
+      Shares older than the inbox are copied in by backfill_shared_inbox, run
+      for each user on their first "shared with me" read.
+    - Public files and the public listing are served from an in-process
+      stale-while-revalidate cache (keys ('file', id) and ('list', limit)).
+      get_file(cached=True) reads through the SharedCache, for read-only
+      paths such as permission checks. Every write that changes a file calls
+      _invalidate(), which clears both, on every worker.
+    - Concurrent get_file calls for one id share a single Firestore read
+      (SingleFlight); a write makes later calls read afresh.
+    - update_file(buffered=True) is write-behind for autosaves: the content
+      waits in the WriteBehindBuffer and is written with the other saves of
+      the window. get_file returns buffered content in this process.
+    - Creating, moving, deleting, sharing and unsharing publish an event to
+      the users it concerns (FileEvents), for the /events stream.
+    - Operations on a whole subtree (share_tree, delete_tree) and backfills
+      run as background jobs (JobRunner), registered at the end of the module.
     """
 
-    def __init__(self, ) -> None:
-        db = FirebaseService().db
-        if db is None:
-            raise RuntimeError(
-                "FirebaseService is not properly initialized: 'db' is None.")
-        else:
-            self.db = db
+    # Shared by all instances, like AuthService's caches
+    _public_cache = SWRCache(
+        maxsize=int(os.getenv('PUBLIC_CACHE_SIZE', 1024)),
+        ttl=float(os.getenv('PUBLIC_CACHE_TTL', 30)),
+        stale_ttl=float(os.getenv('PUBLIC_CACHE_STALE_TTL', 60)),
+        name='public_files')
+    _file_flights = SingleFlight('files')
+    # Users whose share inbox is known to be backfilled (see get_shared_files)
+    _inbox_ready: set[str] = set()
+
+    def __init__(self, db=None, buffer: WriteBehindBuffer | None = None,
+                 events: FileEvents | None = None) -> None:
+        self._db = db
+        self._buffer = buffer
+        self._events = events
+
+    @property
+    def db(self):
+        # Resolved per use, so module-level instances don't create the client at import
+        return self._db if self._db is not None else FirebaseService().db
+
+    @property
+    def buffer(self) -> WriteBehindBuffer:
+        return self._buffer if self._buffer is not None else WriteBehindBuffer.initialize()
+
+    @property
+    def events(self) -> FileEvents:
+        return self._events if self._events is not None else FileEvents.initialize()
+
+    async def _emit(self, event_type: str, file: VirtualFile, users, **fields) -> None:
+        """Publish a change event; the write already happened, so a failure is only logged"""
+        try:
+            await self.events.publish(event_type, file, users, **fields)
+        except Exception:
+            logger.exception("Failed to publish file event", extra={"file_id": file.id, "event": event_type})
+
+    async def _invalidate(self, *file_ids: str, listings: bool = False) -> None:
+        """Forget cached copies of files after a write; `listings` drops every public listing too"""
+        if listings:
+            self._public_cache.evict(lambda key, _: key[0] == 'list')
+        cache = SharedCache.initialize()
+        for file_id in file_ids:
+            # Reaches _forget on every worker
+            await cache.invalidate('file', file_id)
+
+    @classmethod
+    def _forget(cls, file_id: str | None) -> None:
+        if file_id is None:
+            cls._public_cache.clear()
+            cls._file_flights.clear()
+            return
+        cls._file_flights.forget(file_id)
+        cls._public_cache.invalidate(('file', file_id))
+        # Listings (or loads still in flight) that may contain the file
+        cls._public_cache.evict(lambda key, files: key[0] == 'list' and (
+            files is None or any(f.id == file_id for f in files)))
 
     async def create_file(self, file: VirtualFile) -> VirtualFile:
         """Create a virtual file"""
@@ -54,10 +137,26 @@ class FileSystem:
         final_data = created_doc.to_dict()
         if final_data:
             final_data['id'] = created_doc.id
-        return VirtualFile.model_validate(final_data)
-
-    async def get_file(self, file_id: str) -> VirtualFile | None:
-        """Get a virtual file by id"""
+        # Clears a cached 'not found' too
+        await self._invalidate(file.id, listings=file.public)
+        created = VirtualFile.model_validate(final_data)
+        await self._emit('created', created, created.can_view)
+        return created
+
+    async def get_file(self, file_id: str, cached: bool = False) -> VirtualFile | None:
+        """Get a virtual file by id; `cached` reads through the SharedCache (read-only paths only)"""
+        if cached:
+            file = await SharedCache.initialize().get_or_load(
+                'file', file_id, VirtualFile, lambda: self._file_flights.do(file_id, lambda: self._fetch_file(file_id)))
+        else:
+            file = await self._file_flights.do(file_id, lambda: self._fetch_file(file_id))
+        content = self.buffer.pending(file_id)
+        if file is not None and content is not None:
+            # An autosave not written yet; the cached model is shared, so copy it
+            file = file.model_copy(update={'content': content})
+        return file
+
+    async def _fetch_file(self, file_id: str) -> VirtualFile | None:
         doc_ref = self.db.collection('files').document(file_id)
         doc = await doc_ref.get()
         if doc.exists:
@@ -67,16 +166,48 @@ class FileSystem:
                 return VirtualFile.model_validate(data)
         return None
 
-    async def update_file(self, file_id: str, content: str) -> None:
+    async def update_file(self, file_id: str, content: str, buffered: bool = False) -> None:
+        """Replace the content; `buffered` autosaves write-behind (see WriteBehindBuffer)"""
+        if buffered and self.buffer.enabled:
+            self.buffer.put(file_id, content)
+            return
+        # This write supersedes any autosave still buffered
+        await self.buffer.discard(file_id)
         doc_ref = self.db.collection('files').document(file_id)
         await doc_ref.update({
             'content': content,
             'updated_at': firestore.SERVER_TIMESTAMP  # type: ignore
         })
+        await self._invalidate(file_id)
 
-    async def delete_file(self, file_id: str) -> None:
-        doc_ref = self.db.collection('files').document(file_id)
-        await doc_ref.delete()
+    async def delete_file(self, file_id: str, file: VirtualFile | None = None) -> None:
+        """Delete a file; pass `file` when already read, it says who to notify"""
+        if file is None:
+            file = await self.get_file(file_id, cached=True)
+        await self.buffer.discard(file_id)
+        refs = [self.db.collection('files').document(file_id)]
+
+        # Drop the file from the inbox of everyone it was shared with
+        if file is not None:
+            from .auth_service import AuthService
+            auth_service = AuthService(self._db)
+            users = await asyncio.gather(*(
+                auth_service.get_user_by_username(username)
+                for username in set(file.can_view or []) if username != file.root))
+            refs += [self._shared_inbox(user.id).document(file_id) for user in users if user]
+
+        # Firestore caps a batch at 500 writes; the file goes in the first one
+        for start in range(0, len(refs), 500):
+            batch = self.db.batch()
+            for ref in refs[start:start + 500]:
+                batch.delete(ref)
+            await batch.commit()
+        await self._invalidate(file_id)
+        # A space editing the file would keep serving it from memory
+        from .spaces import LiveDocuments
+        LiveDocuments.file_deleted(file_id)
+        if file is not None:
+            await self._emit('deleted', file, file.can_view)
 
     async def get_user_files(self, username: str):
         query = self.db.collection('files').where('root', '==', username)
@@ -95,14 +226,21 @@ class FileSystem:
         """Share a file with a user"""
         doc_ref = self.db.collection('files').document(file_id)
 
-    async def search_files(self, query: str, username: str, include_shared: bool = True, include_public: bool = True) -> list[VirtualFile]:
-        """Search files by name or content"""
+    async def search_files(self, query: str, username: str, include_shared: bool = True, include_public: bool = True, user_id: str | None = None) -> list[VirtualFile]:
+        """Search files by name or content
+
+        When user_id is given, shared files are looked up through the user's
+        share inbox (backfilled first if it never was) instead of an
+        array_contains scan over 'files'.
+        """
         files = []
+        seen = set()  # ids already returned, owned files show up in the other scans too
 
         # Search in user's own files
         user_query = self.db.collection('files').where('root', '==', username)
         async for doc in user_query.stream():
             if doc.exists:
+                seen.add(doc.id)
                 data = doc.to_dict()
                 if data and self._matches_search(data, query):
                     data['id'] = doc.id
@@ -110,29 +248,31 @@ class FileSystem:
 
         # Search in shared files
         if include_shared:
-            shared_query = self.db.collection('files').where(
-                'can_view', 'array_contains', username)
-            async for doc in shared_query.stream():
-                if doc.exists:
+            if user_id is not None:
+                await self._ensure_inbox(username, user_id)
+                shared_docs = self._stream_inbox_files(user_id)
+            else:
+                shared_docs = self.db.collection('files').where(
+                    'can_view', 'array_contains', username).stream()
+            async for doc in shared_docs:
+                if doc.exists and doc.id not in seen:  # Avoid duplicates
+                    seen.add(doc.id)
                     data = doc.to_dict()
                     if data and self._matches_search(data, query):
                         data['id'] = doc.id
-                        file = VirtualFile.model_validate(data)
-                        if file not in files:  # Avoid duplicates
-                            files.append(file)
+                        files.append(VirtualFile.model_validate(data))
 
         # Search in public files
         if include_public:
             public_query = self.db.collection(
                 'files').where('public', '==', True)
             async for doc in public_query.stream():
-                if doc.exists:
+                if doc.exists and doc.id not in seen:  # Avoid duplicates
+                    seen.add(doc.id)
                     data = doc.to_dict()
                     if data and self._matches_search(data, query):
                         data['id'] = doc.id
-                        file = VirtualFile.model_validate(data)
-                        if file not in files:  # Avoid duplicates
-                            files.append(file)
+                        files.append(VirtualFile.model_validate(data))
 
         return files
 
@@ -141,33 +281,140 @@ class FileSystem:
         query_lower = query.lower()
 
         # Search in file name
-        if query_lower in file_data.get('name', '').lower():
+        if query_lower in (file_data.get('name') or '').lower():
             return True
 
-        # Search in file content
-        if query_lower in file_data.get('content', '').lower():
+        # Search in file content (None for directories)
+        if query_lower in (file_data.get('content') or '').lower():
             return True
 
         return False
 
-    async def get_shared_files(self, username: str) -> list[VirtualFile]:
-        """Get files shared with a specific user"""
+    def _shared_inbox(self, user_id: str):
+        """Reference to a user's "shared with me" inbox subcollection"""
+        return self.db.collection('users').document(user_id).collection('shared')
+
+    async def _stream_inbox_files(self, user_id: str):
+        """Yield the file documents referenced by a user's share inbox"""
+        refs = []
+        async for entry in self._shared_inbox(user_id).stream():
+            refs.append(self.db.collection('files').document(entry.id))
+        if refs:
+            async for doc in self.db.get_all(refs):
+                yield doc
+
+    async def get_shared_files(self, user_id: str, limit: int = 50, start_after: str | None = None,
+                               username: str | None = None) -> list[SharedFile]:
+        """
+        Get files shared with a specific user, most recently shared first.
+
+        Args:
+            user_id: ID of the user whose inbox to read
+            limit: Maximum number of entries to return
+            start_after: file ID of the last entry of the previous page (cursor)
+            username: the user's username; when given, an inbox that was never
+                backfilled is backfilled first, so shares made before the
+                inbox existed still show up
+
+        Returns:
+            list[SharedFile]: inbox entries ordered by shared_at, descending
+        """
+        if username is not None:
+            await self._ensure_inbox(username, user_id)
+        inbox = self._shared_inbox(user_id)
+        query = inbox.order_by(
+            'shared_at', direction=firestore.Query.DESCENDING)
+
+        if start_after:
+            cursor = await inbox.document(start_after).get()
+            if cursor.exists:
+                query = query.start_after(cursor)
+
         files = []
+        async for doc in query.limit(limit).stream():
+            data = doc.to_dict()
+            if data:
+                data['id'] = doc.id
+                files.append(SharedFile.model_validate(data))
+
+        return files
 
-        # Files where user is in can_view list
+    async def _ensure_inbox(self, username: str, user_id: str) -> None:
+        """Backfill the user's inbox once, marked by users/{id}.shared_inbox_backfilled"""
+        if user_id in self._inbox_ready:
+            return
+        user = await self.db.collection('users').document(user_id).get()
+        if not (user.exists and (user.to_dict() or {}).get('shared_inbox_backfilled')):
+            await self.backfill_shared_inbox(username, user_id)
+        self._inbox_ready.add(user_id)
+
+    async def backfill_shared_inbox(self, username: str, user_id: str) -> int:
+        """
+        Populate a user's share inbox from the can_view lists of existing files.
+
+        Shares made before the inbox existed are only recorded on the file
+        documents; this runs the old array_contains scan once to copy them over.
+
+        Returns:
+            int: number of inbox entries written
+        """
         query = self.db.collection('files').where(
             'can_view', 'array_contains', username)
+        batch = self.db.batch()
+        written = 0
         async for doc in query.stream():
-            if doc.exists:
-                data = doc.to_dict()
-                if data and data.get('root') != username:  # Exclude own files
-                    data['id'] = doc.id
-                    files.append(VirtualFile.model_validate(data))
-
-        return files
+            data = doc.to_dict()
+            if not data or data.get('root') == username:  # Exclude own files
+                continue
+            permissions = ['view']
+            if username in (data.get('can_edit') or []):
+                permissions.append('edit')
+            batch.set(self._shared_inbox(user_id).document(doc.id), {
+                'id': doc.id,
+                'name': data.get('name'),
+                'root': data.get('root'),
+                'directory': data.get('directory', False),
+                'permissions': permissions,
+                'shared_at': data.get('updated_at') or firestore.SERVER_TIMESTAMP,
+            })
+            written += 1
+            # Firestore caps a batch at 500 writes
+            if written % 500 == 0:
+                await batch.commit()
+                batch = self.db.batch()
+
+        if written % 500:
+            await batch.commit()
+        try:
+            await self.db.collection('users').document(user_id).update({'shared_inbox_backfilled': True})
+        except NotFound:
+            pass
+        return written
+
+    async def backfill_shared_inboxes(self, job: JobContext | None = None) -> dict:
+        """Run backfill_shared_inbox for every user"""
+        from .auth_service import AuthService
+        users = written = 0
+        async for user in AuthService(self._db).stream_users():
+            written += await self.backfill_shared_inbox(user.username, user.id)
+            users += 1
+            if job is not None:
+                await job.progress(users)
+        return {'users': users, 'written': written}
 
     async def get_public_files(self, limit: int = 50) -> list[VirtualFile]:
-        """Get public files"""
+        """Get public files, cached (see _public_cache)"""
+        return await self._public_cache.get_or_load(
+            ('list', limit), lambda: self._load_public_files(limit))
+
+    async def get_public_file(self, file_id: str) -> VirtualFile | None:
+        """Get a file if it is public, cached (see _public_cache); None if missing or private"""
+        async def load():
+            file = await self.get_file(file_id)
+            return file if file is not None and file.public else None
+        return await self._public_cache.get_or_load(('file', file_id), load)
+
+    async def _load_public_files(self, limit: int) -> list[VirtualFile]:
         files = []
 
         query = self.db.collection('files').where(
@@ -223,7 +470,7 @@ class FileSystem:
         Share a file with another user with specific permissions.
 
         Args:
-            owner_id: ID of the file owner
+            owner_id: username of the file owner
             file_id: ID of the file to share
             target_username: Username of the user to share with
             permissions: List of permissions to grant ['view', 'edit']
@@ -234,48 +481,60 @@ class FileSystem:
         try:
             # First, verify the target user exists
             from .auth_service import AuthService
-            auth_service = AuthService()
+            auth_service = AuthService(self._db)
             target_user = await auth_service.get_user_by_username(target_username)
 
             if not target_user:
-                print(f"Target user '{target_username}' not found")
+                logger.info("Share target user not found", extra={
+                            "file_id": file_id, "target_user": target_username})
                 return False
 
             # Get the file to verify it exists and check ownership
             file = await self.get_file(file_id)
 
             if not file:
-                print(f"File '{file_id}' not found")
+                logger.info("Share of missing file", extra={"file_id": file_id})
                 return False
 
             # Check if the requesting user is the owner
             if file.root != owner_id:
-                print(
-                    f"User '{owner_id}' is not the owner of file '{file_id}'")
+                logger.info("Share refused, requester is not the owner", extra={
+                            "file_id": file_id, "requester": owner_id})
                 return False
 
-            # Prepare updates for Firestore
-            doc_ref = self.db.collection('files').document(file_id)
-            updates = {'updated_at': SERVER_TIMESTAMP}  # type: ignore
-
-            # Handle view permission
-            if 'view' in permissions:
-                # Use your existing method to add to view list
-                await self.add_user_to_view_list(target_username, file)
+            # Edit implies view, so the user always lands in can_view
+            granted = [p for p in ('view', 'edit') if p in permissions]
+            if not granted:
+                return True
+            if 'view' not in granted:
+                granted.insert(0, 'view')
 
-            # Handle edit permission
-            if 'edit' in permissions:
-                # Use your existing method to add to edit list
-                await self.add_user_to_edit_list(target_username, file)
-
-                # If user can edit, they should also be able to view
-                # (in case 'view' wasn't explicitly included)
-                await self.add_user_to_view_list(target_username, file)
+            # File ACL and the target's inbox entry are written together
+            doc_ref = self.db.collection('files').document(file_id)
+            updates = {'can_view': firestore.ArrayUnion([target_username])}
+            if 'edit' in granted:
+                updates['can_edit'] = firestore.ArrayUnion([target_username])
+
+            inbox_ref = self._shared_inbox(target_user.id).document(file_id)
+            batch = self.db.batch()
+            batch.update(doc_ref, updates)
+            batch.set(inbox_ref, {
+                'id': file_id,
+                'name': file.name,
+                'root': file.root,
+                'directory': file.directory,
+                'permissions': firestore.ArrayUnion(granted),
+                'shared_at': firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+            await batch.commit()
+            await self._invalidate(file_id)
+            await self._emit('shared', file, [target_username, file.root],
+                             user=target_username, permissions=granted)
 
             return True
 
         except Exception as e:
-            print(f"Error sharing file: {e}")
+            logger.exception("Error sharing file", extra={"file_id": file_id})
             return False
 
     async def revoke_user_access(self, owner_id: str, file_id: str, target_username: str) -> bool:
@@ -283,7 +542,7 @@ class FileSystem:
         Revoke a user's access to a file.
 
         Args:
-            owner_id: ID of the file owner
+            owner_id: username of the file owner
             file_id: ID of the file
             target_username: Username of the user to revoke access from
 
@@ -301,14 +560,28 @@ class FileSystem:
             if file.root != owner_id:
                 return False
 
-            # Remove user from both view and edit lists
-            await self.remove_user_from_view_list(target_username, file)
-            await self.remove_user_from_edit_list(target_username, file)
+            # Remove user from both view and edit lists and from their inbox
+            doc_ref = self.db.collection('files').document(file_id)
+            batch = self.db.batch()
+            batch.update(doc_ref, {
+                'can_view': firestore.ArrayRemove([target_username]),
+                'can_edit': firestore.ArrayRemove([target_username]),
+            })
+
+            from .auth_service import AuthService
+            target_user = await AuthService(self._db).get_user_by_username(target_username)
+            if target_user:
+                batch.delete(self._shared_inbox(
+                    target_user.id).document(file_id))
+
+            await batch.commit()
+            await self._invalidate(file_id)
+            await self._emit('unshared', file, [target_username, file.root], user=target_username)
 
             return True
 
         except Exception as e:
-            print(f"Error revoking access: {e}")
+            logger.exception("Error revoking access", extra={"file_id": file_id})
             return False
 
     async def make_file_public(self, owner_id: str, file_id: str) -> bool:
@@ -338,11 +611,12 @@ class FileSystem:
                 'public': True,
                 'updated_at': firestore.SERVER_TIMESTAMP  # type: ignore
             })
+            await self._invalidate(file_id, listings=True)
 
             return True
 
         except Exception as e:
-            print(f"Error making file public: {e}")
+            logger.exception("Error making file public", extra={"file_id": file_id})
             return False
 
     async def make_file_private(self, owner: str, file_id: str) -> bool:
@@ -370,8 +644,9 @@ class FileSystem:
         doc_ref = self.db.collection('files').document(file_id)
         await doc_ref.update({
             'public': False,
-            'updated_at': SERVER_TIMESTAMP  # type: ignore
+            'updated_at': firestore.SERVER_TIMESTAMP  # type: ignore
         })
+        await self._invalidate(file_id, listings=True)
 
         return True
 
@@ -384,6 +659,7 @@ class FileSystem:
             can_view.remove(username)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_view': can_view})
+            await self._invalidate(file.id)
 
     async def remove_user_from_edit_list(self, username: str, file: VirtualFile) -> None:
         """
@@ -394,6 +670,7 @@ class FileSystem:
             can_edit.remove(username)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_edit': can_edit})
+            await self._invalidate(file.id)
 
     async def _get_user_view_list(self, file: VirtualFile) -> list[str]:
         """
@@ -420,6 +697,7 @@ class FileSystem:
             can_view.append(username)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_view': can_view})
+            await self._invalidate(file.id)
 
     async def add_user_to_edit_list(self, username: str, file: VirtualFile) -> None:
         """
@@ -430,6 +708,48 @@ class FileSystem:
             can_edit.append(username)
             doc_ref = self.db.collection('files').document(file.id)
             await doc_ref.update({'can_edit': can_edit})
+            await self._invalidate(file.id)
+
+    async def _subtree(self, file_id: str) -> list[VirtualFile]:
+        """The file and everything below it, parents before their children"""
+        file = await self.get_file(file_id)
+        if file is None:
+            return []
+        files = [file]
+        for current in files:
+            if not current.directory:
+                continue
+            query = self.db.collection('files').where('parent', '==', current.id)
+            async for doc in query.stream():
+                data = doc.to_dict()
+                if data:
+                    files.append(VirtualFile.model_validate({**data, 'id': doc.id}))
+        return files
+
+    async def share_tree(self, owner_id: str, file_id: str, usernames: list[str], permissions: list[str],
+                         job: JobContext | None = None) -> dict:
+        """Share a directory and everything below it with each user (see share_file_with_user)"""
+        files = await self._subtree(file_id)
+        total, done, shared, failed = len(files) * len(usernames), 0, 0, set()
+        for username in usernames:
+            for file in files:
+                if await self.share_file_with_user(owner_id, file.id, username, permissions):  # type: ignore[arg-type]
+                    shared += 1
+                else:
+                    failed.add(username)
+                done += 1
+                if job is not None:
+                    await job.progress(done, total)
+        return {'files': len(files), 'shared': shared, 'failed': sorted(failed)}
+
+    async def delete_tree(self, file_id: str, job: JobContext | None = None) -> dict:
+        """Delete a directory and everything below it, deepest first"""
+        files = await self._subtree(file_id)
+        for deleted, file in enumerate(reversed(files), 1):
+            await self.delete_file(file.id, file)  # type: ignore[arg-type]
+            if job is not None:
+                await job.progress(deleted, len(files))
+        return {'deleted': len(files)}
 
     async def move_file(self, file_id: str, new_parent_id: str) -> bool:
         """Move a file to a new parent folder"""
@@ -479,7 +799,17 @@ class FileSystem:
                     'updated_at': firestore.SERVER_TIMESTAMP #type:ignore
                 })
 
+            # The file and both parents' children lists changed
+            await self._invalidate(file_id, new_parent_id, *filter(None, [file.parent]))
+            await self._emit('moved', file.model_copy(update={'parent': new_parent_id}), file.can_view,
+                             **{'from': file.parent, 'to': new_parent_id})
             return True
         except Exception as e:
-            print(f"Error moving file: {e}")
+            logger.exception("Error moving file", extra={"file_id": file_id})
             return False
+
+
+SharedCache.on_invalidate('file', FileSystem._forget)
+JobRunner.register('share_tree', lambda job, **params: FileSystem(job.db).share_tree(**params, job=job))
+JobRunner.register('delete_tree', lambda job, **params: FileSystem(job.db).delete_tree(**params, job=job))
+JobRunner.register('backfill_shared_inboxes', lambda job: FileSystem(job.db).backfill_shared_inboxes(job))
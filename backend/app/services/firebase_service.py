@@ -1,37 +1,81 @@
-import firebase_admin
-from firebase_admin import credentials, firestore_async
 import os
 
-if not firebase_admin._apps:
-    cred_path = os.getenv("FIREBASE_KEY_PATH", "firebasekey.json")
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
+from ..monitoring.firestore import InstrumentedClient
+
+
+def _use_memory_backend() -> bool:
+    """FIRESTORE_BACKEND=memory swaps Firestore for an in-process stand-in (no credentials needed)"""
+    return os.getenv('FIRESTORE_BACKEND', 'firestore').lower() == 'memory'
 
 
 class FirebaseService:
-    _db = firestore_async.client()
-    _is_initialized: bool = False
+    """Owner of the process-wide Firestore client.
+
+    Importing this module has no side effects: the client is created by
+    initialize(), which the app's lifespan calls at startup (so bad
+    credentials fail the deploy rather than the first request) and which
+    `db` falls back to on first use for scripts, tests and benchmarks.
+    close() releases the gRPC channel at shutdown.
+    """
+    _db = None
+    _instrumented = None
 
     def __new__(cls, *args, **kwargs):
         if not hasattr(cls, 'instance'):
             cls.instance = super().__new__(cls)
         return cls.instance
 
-    def __init__(self):
-        if not self._is_initialized:
-            self._initialize_firebase()
-            FirebaseService._is_initialized = True
+    @classmethod
+    def initialize(cls):
+        """Create the Firestore client (and the firebase_admin app) if not done yet"""
+        if cls._db is not None:
+            return cls._db
+
+        if _use_memory_backend():
+            from .memory_firestore import MemoryFirestore
+            cls._db = MemoryFirestore()
+            return cls._db
+
+        # Deferred: firebase_admin pulls in google-auth and the gRPC stack
+        import firebase_admin
+        from firebase_admin import credentials, firestore_async
 
-    def _initialize_firebase(self):
         if not firebase_admin._apps:
-            key_path = os.getenv('FIREBASE_KEY_PATH')
+            key_path = os.getenv('FIREBASE_KEY_PATH', 'firebasekey.json')
             cred = credentials.Certificate(key_path)
             firebase_admin.initialize_app(cred)
-        FirebaseService._db = firestore_async.client()
+        cls._db = firestore_async.client()
+        return cls._db
+
+    @classmethod
+    def listener_client(cls):
+        """Client for on_snapshot listeners, see ChangeHub.
+
+        The async client has no listeners, so this is firebase_admin's sync
+        client, which runs each listener on background threads. With the
+        memory backend it is the same MemoryFirestore as initialize().
+        """
+        db = cls.initialize()
+        if _use_memory_backend():
+            return db
+        from firebase_admin import firestore
+        return firestore.client()
+
+    @classmethod
+    async def close(cls) -> None:
+        """Drop the client, closing its gRPC channel if one was opened"""
+        db, cls._db, cls._instrumented = cls._db, None, None
+        # The channel is created lazily on the first RPC
+        api = getattr(db, '_firestore_api_internal', None)
+        if api is not None:
+            await api.transport.close()
 
     @property
     def db(self):
-        if self._db is None:
-            raise RuntimeError(
-                "FirebaseService is not properly initialized: 'db' is None.")
-        return self._db
+        db = self.initialize()
+        if os.getenv('FIRESTORE_INSTRUMENTATION', 'true').lower() == 'false':
+            return db
+        # Counts reads/writes per request, see app.monitoring.firestore
+        if FirebaseService._instrumented is None or FirebaseService._instrumented._wrapped is not db:
+            FirebaseService._instrumented = InstrumentedClient(db)
+        return FirebaseService._instrumented
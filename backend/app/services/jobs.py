@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+from firebase_admin import firestore_async as firestore
+from google.api_core.exceptions import AlreadyExists
+
+from .firebase_service import FirebaseService
+from .shared_cache import SharedCache
+from ..models.jobs import Job
+from ..monitoring.metrics import JOBS, JOBS_RUNNING
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Every worker is busy and the queue is at JOB_QUEUE_SIZE"""
+
+
+class JobNotFound(LookupError):
+    pass
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler (by JobContext) once its job is cancelled"""
+
+
+class JobContext:
+    """What a running handler sees of its job: report progress, notice cancellation.
+
+    progress() persists at most every JOB_PROGRESS_INTERVAL seconds and
+    raises JobCancelled once the job has been cancelled, so handlers
+    stop at their next step; long steps can call check() in between.
+    """
+
+    def __init__(self, runner: "JobRunner", job_id: str) -> None:
+        self.runner = runner
+        self.job_id = job_id
+        self.cancelled = False
+        self.done = 0
+        self.total: int | None = None
+        self._saved_at = 0.0
+
+    @property
+    def db(self):
+        """The runner's Firestore client, for handlers to build their services on"""
+        return self.runner.db
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+    async def progress(self, done: int, total: int | None = None) -> None:
+        self.check()
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if now - self._saved_at >= self.runner.progress_interval or done == self.total:
+            self._saved_at = now
+            await self.runner._update(self.job_id, {'done': self.done, 'total': self.total})
+
+    async def _refresh(self) -> None:
+        doc = await self.runner._ref(self.job_id).get()
+        if doc.exists and (doc.to_dict() or {}).get('cancel_requested'):
+            self.cancelled = True
+
+
+Handler = Callable[..., Awaitable[dict[str, Any] | None]]
+
+
+class JobRunner:
+    """Runs bulk operations in the background, off the request that asked for them.
+
+    Handlers are registered per kind with register() and called as
+    handler(job, **params) by one of JOB_WORKERS worker tasks; submit()
+    refuses work beyond JOB_QUEUE_SIZE waiting jobs. The job's state,
+    progress and result live in jobs/{id}, so GET /jobs/{id} works from
+    any worker. Starting a job is a transaction (queued -> running), so
+    each runs once even when several processes hold its id: on start()
+    a runner also picks up jobs left queued, e.g. by a restart.
+
+    cancel() of a queued job cancels it outright; a running one is asked
+    to stop through the SharedCache ('job' invalidations reach the
+    worker running it, wherever that is). Jobs still running after
+    JOB_SHUTDOWN_GRACE seconds at shutdown fail as interrupted. A running
+    job's updated_at is touched at least every JOB_LEASE / 4 seconds; one
+    left "running" longer than JOB_LEASE, by a process that died, is
+    queued again by the next start().
+    """
+    _instance = None
+    _handlers: dict[str, Handler] = {}
+    # Jobs running in this process, by id; shared by all instances
+    _running: dict[str, JobContext] = {}
+
+    def __init__(self, db=None, workers: int = 4, queue_size: int = 100,
+                 progress_interval: float = 1.0, shutdown_grace: float = 10.0, lease: float = 120.0) -> None:
+        self._db = db
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.shutdown_grace = shutdown_grace
+        self.lease = lease
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+        self._closing = False
+
+    @classmethod
+    def initialize(cls) -> "JobRunner":
+        if cls._instance is None:
+            cls._instance = cls(
+                workers=int(os.getenv('JOB_WORKERS', 4)),
+                queue_size=int(os.getenv('JOB_QUEUE_SIZE', 100)),
+                progress_interval=float(os.getenv('JOB_PROGRESS_INTERVAL', 1)),
+                shutdown_grace=float(os.getenv('JOB_SHUTDOWN_GRACE', 10)),
+                lease=float(os.getenv('JOB_LEASE', 120)))
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        """Stop the process-wide runner, if one was created"""
+        runner, cls._instance = cls._instance, None
+        if runner is not None:
+            await runner.stop()
+
+    @classmethod
+    def register(cls, kind: str, handler: Handler) -> None:
+        cls._handlers[kind] = handler
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
+    def _ref(self, job_id: str):
+        return self.db.collection('jobs').document(job_id)
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._closing = False
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            async for doc in self.db.collection('jobs').where('status', '==', 'queued').stream():
+                if self._queue.full():
+                    break
+                self._queue.put_nowait(doc.id)
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.lease)
+            async for doc in self.db.collection('jobs').where('status', '==', 'running').stream():
+                if self._queue.full():
+                    break
+                if doc.id not in self._running and await self._requeue(doc.id, cutoff):
+                    logger.warning("Requeued a job its worker abandoned", extra={"job_id": doc.id})
+                    self._queue.put_nowait(doc.id)
+        except Exception:
+            logger.exception("Failed to pick up queued jobs")
+
+    async def stop(self) -> None:
+        self._closing = True
+        deadline = time.monotonic() + self.shutdown_grace
+        while self._local_jobs() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _local_jobs(self) -> list[JobContext]:
+        return [job for job in self._running.values() if job.runner is self]
+
+    async def submit(self, kind: str, owner: str, **params) -> Job:
+        """Queue a job of a registered kind; raises JobQueueFull when there's no room"""
+        return await self._submit(uuid.uuid4().hex, kind, owner, params)
+
+    async def _submit(self, job_id: str, kind: str, owner: str, params: dict, migration: bool = False) -> Job:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind!r}")
+        if self._queue.full():
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are already waiting")
+        await self._ref(job_id).set({
+            **Job(id=job_id, kind=kind, owner=owner, params=params, migration=migration).model_dump(
+                exclude={'id', 'created_at', 'updated_at'}),
+            'created_at': firestore.SERVER_TIMESTAMP,  # type: ignore
+            'updated_at': firestore.SERVER_TIMESTAMP,  # type: ignore
+        })
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            # Filled up while the job was being written
+            await self._ref(job_id).delete()
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are already waiting")
+        return await self.get(job_id)  # type: ignore[return-value]
+
+    async def submit_once(self, kind: str, owner: str, **params) -> Job | None:
+        """Queue a job of this kind unless one was queued or finished, by any process.
+
+        For migrations that must run once per deployment: marked in
+        migrations/{kind}, which records the job's id and, once the job
+        succeeds, completed_at (see migration_completed). A job that ends
+        otherwise removes the marker, so the next start queues it again.
+        """
+        job_id = uuid.uuid4().hex
+        marker = self.db.collection('migrations').document(kind)
+        try:
+            await marker.create({'job_id': job_id, 'created_at': firestore.SERVER_TIMESTAMP})  # type: ignore
+        except AlreadyExists:
+            return None
+        try:
+            return await self._submit(job_id, kind, owner, params, migration=True)
+        except Exception:
+            # Not queued: let the next start try again
+            await marker.delete()
+            raise
+
+    async def migration_completed(self, kind: str) -> bool:
+        """Whether the submit_once job of this kind has succeeded"""
+        marker = await self.db.collection('migrations').document(kind).get()
+        return marker.exists and (marker.to_dict() or {}).get('completed_at') is not None
+
+    async def _settle_migration(self, kind: str, job_id: str, status: str) -> None:
+        marker = self.db.collection('migrations').document(kind)
+
+        @firestore.async_transactional
+        async def settle(transaction) -> None:
+            doc = await marker.get(transaction=transaction)
+            if not doc.exists or (doc.to_dict() or {}).get('job_id') != job_id:
+                return
+            if status == 'succeeded':
+                transaction.update(marker, {'completed_at': firestore.SERVER_TIMESTAMP})
+            else:
+                transaction.delete(marker)
+
+        await settle(self.db.transaction())
+
+    async def get(self, job_id: str) -> Job | None:
+        doc = await self._ref(job_id).get()
+        if not doc.exists:
+            return None
+        return Job.model_validate({**(doc.to_dict() or {}), 'id': doc.id})
+
+    async def cancel(self, job_id: str) -> Job:
+        """Cancel a job; a running one stops at its next progress report"""
+        ref = self._ref(job_id)
+
+        @firestore.async_transactional
+        async def request(transaction) -> dict | None:
+            doc = await ref.get(transaction=transaction)
+            data = doc.to_dict() if doc.exists else None
+            if data is None:
+                return None
+            if data['status'] == 'queued':
+                transaction.update(ref, {
+                    'status': 'cancelled',
+                    'cancel_requested': True,
+                    'finished_at': firestore.SERVER_TIMESTAMP,
+                    'updated_at': firestore.SERVER_TIMESTAMP,
+                })
+            elif data['status'] == 'running':
+                transaction.update(ref, {
+                    'cancel_requested': True,
+                    'updated_at': firestore.SERVER_TIMESTAMP,
+                })
+            return data
+
+        data = await request(self.db.transaction())
+        if data is None:
+            raise JobNotFound(f"Job {job_id} not found")
+        if data['status'] == 'queued':
+            JOBS.labels(data['kind'], 'cancelled').inc()
+        elif data['status'] == 'running':
+            # Reaches _notify on every worker, the one running the job included
+            await SharedCache.initialize().invalidate('job', job_id)
+        return await self.get(job_id)  # type: ignore[return-value]
+
+    @classmethod
+    def _notify(cls, job_id: str | None) -> None:
+        jobs = list(cls._running.values()) if job_id is None else filter(None, [cls._running.get(job_id)])
+        for job in jobs:
+            asyncio.get_running_loop().create_task(job._refresh())
+
+    async def _update(self, job_id: str, fields: dict) -> None:
+        await self._ref(job_id).update({**fields, 'updated_at': firestore.SERVER_TIMESTAMP})
+
+    async def _claim(self, job_id: str) -> dict | None:
+        ref = self._ref(job_id)
+
+        @firestore.async_transactional
+        async def claim(transaction) -> dict | None:
+            doc = await ref.get(transaction=transaction)
+            data = doc.to_dict() if doc.exists else None
+            if not data or data['status'] != 'queued':
+                # Cancelled, or started by another worker
+                return None
+            transaction.update(ref, {
+                'status': 'running',
+                'started_at': firestore.SERVER_TIMESTAMP,
+                'updated_at': firestore.SERVER_TIMESTAMP,
+            })
+            return data
+
+        return await claim(self.db.transaction())
+
+    async def _requeue(self, job_id: str, cutoff: datetime) -> bool:
+        """Put a running job whose lease expired before `cutoff` back in the queue"""
+        ref = self._ref(job_id)
+
+        @firestore.async_transactional
+        async def requeue(transaction) -> bool:
+            doc = await ref.get(transaction=transaction)
+            data = doc.to_dict() if doc.exists else None
+            if not data or data['status'] != 'running':
+                return False
+            if (data.get('updated_at') or data.get('started_at') or cutoff) >= cutoff:
+                return False
+            transaction.update(ref, {'status': 'queued', 'updated_at': firestore.SERVER_TIMESTAMP})
+            return True
+
+        return await requeue(self.db.transaction())
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 4)
+            try:
+                await self._update(job_id, {})
+            except Exception:
+                logger.exception("Failed to renew job lease", extra={"job_id": job_id})
+
+    async def _work(self) -> None:
+        while not self._closing:
+            job_id = await self._queue.get()
+            try:
+                data = await self._claim(job_id)
+            except Exception:
+                logger.exception("Failed to start job", extra={"job_id": job_id})
+                continue
+            if data is not None:
+                await self._run(job_id, data)
+
+    async def _run(self, job_id: str, data: dict) -> None:
+        kind = data['kind']
+        job = JobContext(self, job_id)
+        self._running[job_id] = job
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        JOBS_RUNNING.inc()
+        outcome: dict[str, Any] = {'status': 'failed'}
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {kind!r}")
+            result = await handler(job, **data.get('params', {}))
+            outcome = {'status': 'succeeded', 'result': result}
+        except JobCancelled:
+            outcome = {'status': 'cancelled'}
+        except asyncio.CancelledError:
+            outcome = {'status': 'failed', 'error': "Interrupted by shutdown"}
+            raise
+        except Exception as e:
+            logger.exception("Job failed", extra={"job_id": job_id, "job_kind": kind})
+            outcome = {'status': 'failed', 'error': str(e)}
+        finally:
+            heartbeat.cancel()
+            del self._running[job_id]
+            JOBS_RUNNING.dec()
+            JOBS.labels(kind, outcome['status']).inc()
+            try:
+                await self._update(job_id, {
+                    **outcome, 'done': job.done, 'total': job.total,
+                    'finished_at': firestore.SERVER_TIMESTAMP,
+                })
+                if data.get('migration'):
+                    await self._settle_migration(kind, job_id, outcome['status'])
+            except Exception:
+                logger.exception("Failed to record job outcome", extra={"job_id": job_id})
+
+
+SharedCache.on_invalidate('job', JobRunner._notify)
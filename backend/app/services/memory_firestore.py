@@ -0,0 +1,596 @@
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+
+_READ_AFTER_WRITE_ERROR = "Firestore transactions require all reads to be executed before all writes."
+
+# Firestore orders values of different types by type first
+_TYPE_ORDER = ((type(None), 0), (bool, 1), (int, 2), (float, 2), (datetime, 3),
+               (str, 4), (bytes, 5), (list, 8), (dict, 9))
+
+
+def _copy(value):
+    """Copy the containers of a document; leaf values are immutable"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _type_rank(value) -> int:
+    for kind, rank in _TYPE_ORDER:
+        if isinstance(value, kind):
+            return rank
+    return 10
+
+
+def _sort_key(value):
+    if isinstance(value, dict):
+        return (9, sorted((k, _sort_key(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (8, [_sort_key(v) for v in value])
+    return (_type_rank(value), value if value is not None else 0)
+
+
+_MISSING = object()
+
+
+def _get_field(data: dict, field_path: str):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _transform(current, value):
+    """Resolve SERVER_TIMESTAMP, ArrayUnion, ArrayRemove, Increment against the current value"""
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(v for v in value.values if v not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [v for v in current if v not in value.values] if isinstance(current, list) else []
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, dict):
+        return {k: _transform(None, v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return _copy(value)
+
+
+def _set_field(data: dict, field_path: str, value) -> None:
+    *parents, last = field_path.split('.')
+    for part in parents:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is transforms.DELETE_FIELD:
+        data.pop(last, None)
+    else:
+        data[last] = _transform(data.get(last), value)
+
+
+def _merge(data: dict, updates: dict) -> None:
+    """set(merge=True): keys are field names, nested maps are merged"""
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            data.pop(key, None)
+        elif isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        else:
+            data[key] = _transform(data.get(key), value)
+
+
+class MemorySnapshot:
+    """Result of reading a MemoryDocument, like firestore's DocumentSnapshot"""
+
+    def __init__(self, reference: "MemoryDocument", data: dict | None, read_time: datetime | None = None) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.read_time = read_time or datetime.now(timezone.utc)
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> dict | None:
+        # The real client decodes a fresh dict for every read
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        if self._data is None:
+            return None
+        value = _get_field(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return _copy(value)
+
+
+class MemoryQuery:
+    """Query over one collection (or every collection with the same id, for
+    collection groups), evaluated when it is streamed."""
+
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client: "MemoryFirestore", path: str, all_descendants: bool = False) -> None:
+        self._client = client
+        self._path = path
+        self._all_descendants = all_descendants
+        self._filters: tuple = ()
+        self._orders: tuple = ()
+        self._projection: tuple | None = None
+        self._limit: int | None = None
+        self._offset = 0
+        self._start: tuple | None = None
+        self._end: tuple | None = None
+
+    def _with(self, **changes) -> "MemoryQuery":
+        query = MemoryQuery.__new__(MemoryQuery)
+        query.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            setattr(query, f"_{name}", value)
+        return query
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value=None, *, filter=None) -> "MemoryQuery":
+        if isinstance(filter, FieldFilter):
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Operator string {op_string!r} is invalid")
+        return self._with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "MemoryQuery":
+        return self._with(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths) -> "MemoryQuery":
+        return self._with(projection=tuple(field_paths))
+
+    def limit(self, count: int) -> "MemoryQuery":
+        return self._with(limit=count)
+
+    def offset(self, num_to_skip: int) -> "MemoryQuery":
+        return self._with(offset=num_to_skip)
+
+    def start_at(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._with(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._with(start=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._with(end=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._with(end=(document_fields_or_snapshot, False))
+
+    def _documents(self):
+        store = self._client._store
+        if not self._all_descendants:
+            paths = [self._path]
+        else:
+            paths = [p for p in store if p.rsplit('/', 1)[-1] == self._path]
+        for path in paths:
+            for doc_id, data in list(store.get(path, {}).items()):
+                yield MemoryDocument(self._client, path, doc_id), data
+
+    def _matches(self, data: dict) -> bool:
+        for field_path, op_string, value in self._filters:
+            if not _OPERATORS[op_string](_get_field(data, field_path), value):
+                return False
+        # Documents missing an order_by field are not returned
+        return all(_get_field(data, field) is not _MISSING for field, _ in self._orders)
+
+    def _position(self, reference: "MemoryDocument", data: dict) -> list:
+        keys = [_sort_key(_get_field(data, field)) for field, _ in self._orders]
+        return keys + [reference.path]
+
+    def _cursor(self, cursor) -> list:
+        if isinstance(cursor, MemorySnapshot):
+            return self._position(cursor.reference, cursor._data or {})
+        if isinstance(cursor, dict):
+            return [_sort_key(_get_field(cursor, field)) for field, _ in self._orders]
+        return [_sort_key(value) for value in cursor]
+
+    def _compare(self, position: list, cursor: list) -> int:
+        directions = [direction for _, direction in self._orders] + [self.ASCENDING]
+        for value, bound, direction in zip(position, cursor, directions):
+            if value != bound:
+                result = -1 if value < bound else 1
+                return -result if direction == self.DESCENDING else result
+        return 0
+
+    def _run(self) -> list[MemorySnapshot]:
+        rows = [(ref, data) for ref, data in self._documents() if self._matches(data)]
+
+        rows.sort(key=lambda row: row[0].path)
+        for field, direction in reversed(self._orders):
+            rows.sort(key=lambda row: _sort_key(_get_field(row[1], field)),
+                      reverse=direction == self.DESCENDING)
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            bound = self._cursor(cursor)
+            rows = [row for row in rows
+                    if (c := self._compare(self._position(*row), bound)) > 0 or (inclusive and c == 0)]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            bound = self._cursor(cursor)
+            rows = [row for row in rows
+                    if (c := self._compare(self._position(*row), bound)) < 0 or (inclusive and c == 0)]
+
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        read_time = datetime.now(timezone.utc)
+        snapshots = []
+        for reference, data in rows:
+            if self._projection is not None:
+                projected = {}
+                for field in self._projection:
+                    value = _get_field(data, field)
+                    if value is not _MISSING:
+                        _set_field(projected, field, value)
+                data = projected
+            snapshots.append(MemorySnapshot(reference, data, read_time))
+        return snapshots
+
+    async def get(self, transaction=None) -> list[MemorySnapshot]:
+        await self._client._rpc()
+        snapshots = self._run()
+        if transaction is not None:
+            transaction._record_reads(snapshots)
+        return snapshots
+
+    async def stream(self, transaction=None):
+        for snapshot in await self.get(transaction=transaction):
+            yield snapshot
+
+    def on_snapshot(self, callback) -> "MemoryWatch":
+        return MemoryWatch(self._client, self._run, callback)
+
+
+def _comparable(field_value, value) -> bool:
+    return field_value is not _MISSING and _type_rank(field_value) == _type_rank(value)
+
+
+_OPERATORS = {
+    '==': lambda field, value: field is not _MISSING and field == value,
+    '!=': lambda field, value: field is not _MISSING and field is not None and field != value,
+    '<': lambda field, value: _comparable(field, value) and field < value,
+    '<=': lambda field, value: _comparable(field, value) and field <= value,
+    '>': lambda field, value: _comparable(field, value) and field > value,
+    '>=': lambda field, value: _comparable(field, value) and field >= value,
+    'in': lambda field, value: field is not _MISSING and field in value,
+    'not-in': lambda field, value: field is not _MISSING and field is not None and field not in value,
+    'array_contains': lambda field, value: isinstance(field, list) and value in field,
+    'array_contains_any': lambda field, value: isinstance(field, list) and any(v in field for v in value),
+}
+
+
+class MemoryCollection(MemoryQuery):
+    @property
+    def id(self) -> str:
+        return self._path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: str | None = None) -> "MemoryDocument":
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]
+        return MemoryDocument(self._client, self._path, document_id)
+
+    async def add(self, document_data: dict, document_id: str | None = None):
+        reference = self.document(document_id)
+        await reference.create(document_data)
+        return datetime.now(timezone.utc), reference
+
+
+class MemoryDocument:
+    def __init__(self, client: "MemoryFirestore", collection_path: str, document_id: str) -> None:
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MemoryDocument) and other.path == self.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    @property
+    def path(self) -> str:
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self) -> MemoryCollection:
+        return MemoryCollection(self._client, self._collection_path)
+
+    def collection(self, collection_id: str) -> MemoryCollection:
+        return MemoryCollection(self._client, f"{self.path}/{collection_id}")
+
+    def _snapshot(self) -> MemorySnapshot:
+        return MemorySnapshot(self, self._client._store.get(self._collection_path, {}).get(self.id))
+
+    async def get(self, field_paths=None, transaction=None) -> MemorySnapshot:
+        await self._client._rpc()
+        snapshot = self._snapshot()
+        if transaction is not None:
+            transaction._record_reads([snapshot])
+        return snapshot
+
+    async def _write(self, op: str, data: dict | None = None, merge: bool = False) -> None:
+        await self._client._rpc()
+        self._client._commit([(op, self, data, merge)])
+
+    async def set(self, document_data: dict, merge: bool = False) -> None:
+        await self._write('set', document_data, merge)
+
+    async def create(self, document_data: dict) -> None:
+        await self._write('create', document_data)
+
+    async def update(self, field_updates: dict) -> None:
+        await self._write('update', field_updates)
+
+    async def delete(self) -> None:
+        await self._write('delete')
+
+    def on_snapshot(self, callback) -> "MemoryWatch":
+        def run():
+            snapshot = self._snapshot()
+            return [snapshot] if snapshot.exists else []
+        return MemoryWatch(self._client, run, callback)
+
+
+class MemoryWatch:
+    """Listener returned by on_snapshot, like firestore's Watch.
+
+    callback(docs, changes, read_time) runs once with the current results,
+    then after every commit that changes them. Firestore calls back on a
+    background thread; this calls back inline, from the commit.
+    """
+
+    def __init__(self, client: "MemoryFirestore", run, callback) -> None:
+        self._client = client
+        self._run = run
+        self._callback = callback
+        self._seen: dict[str, tuple[int, MemorySnapshot]] | None = None
+        client._watches.append(self)
+        self._evaluate()
+
+    def _evaluate(self) -> None:
+        docs = self._run()
+        current = {doc.reference.path: (index, doc) for index, doc in enumerate(docs)}
+        first, previous = self._seen is None, self._seen or {}
+        self._seen = current
+
+        changes = [DocumentChange(ChangeType.REMOVED, doc, index, -1)
+                   for path, (index, doc) in previous.items() if path not in current]
+        for path, (index, doc) in current.items():
+            if path not in previous:
+                changes.append(DocumentChange(ChangeType.ADDED, doc, -1, index))
+            elif previous[path][1]._data != doc._data:
+                changes.append(DocumentChange(ChangeType.MODIFIED, doc, previous[path][0], index))
+        if first or changes:
+            self._callback(docs, changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self) -> None:
+        if self in self._client._watches:
+            self._client._watches.remove(self)
+
+
+def _path_of(reference) -> tuple[str, str]:
+    collection_path, _, document_id = reference.path.rpartition('/')
+    return collection_path, document_id
+
+
+class MemoryBatch:
+    """Writes queued locally and applied all-or-nothing on commit"""
+
+    def __init__(self, client: "MemoryFirestore") -> None:
+        self._client = client
+        self._writes: list = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def _queue(self, op: str, reference, data: dict | None = None, merge: bool = False) -> None:
+        collection_path, document_id = _path_of(reference)
+        self._writes.append(
+            (op, MemoryDocument(self._client, collection_path, document_id), data, merge))
+
+    def set(self, reference, document_data: dict, merge: bool = False) -> None:
+        self._queue('set', reference, document_data, merge)
+
+    def create(self, reference, document_data: dict) -> None:
+        self._queue('create', reference, document_data)
+
+    def update(self, reference, field_updates: dict) -> None:
+        self._queue('update', reference, field_updates)
+
+    def delete(self, reference) -> None:
+        self._queue('delete', reference)
+
+    async def commit(self) -> list:
+        await self._client._rpc()
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class MemoryTransaction(MemoryBatch):
+    """Optimistic transaction usable with firestore_async.async_transactional.
+
+    Every document read records the version it saw; commit aborts (and the
+    decorator retries) if any of them changed in the meantime.
+    """
+
+    def __init__(self, client: "MemoryFirestore", max_attempts: int = 5, read_only: bool = False) -> None:
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id: bytes | None = None
+        self._reads: dict[str, int] = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self) -> bytes | None:
+        return self._id
+
+    def _record_reads(self, snapshots) -> None:
+        if self._writes:
+            raise ValueError(_READ_AFTER_WRITE_ERROR)
+        for snapshot in snapshots:
+            self._reads.setdefault(
+                snapshot.reference.path, self._client._versions.get(snapshot.reference.path, 0))
+
+    def _queue(self, op: str, reference, data: dict | None = None, merge: bool = False) -> None:
+        if self._read_only:
+            raise ValueError("Cannot perform write operation in read-only transaction.")
+        super()._queue(op, reference, data, merge)
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    async def _begin(self, retry_id: bytes | None = None) -> None:
+        if self.in_progress:
+            raise ValueError("Transaction already in progress")
+        await self._client._rpc()
+        self._id = uuid.uuid4().bytes
+
+    async def _rollback(self) -> None:
+        self._clean_up()
+
+    async def _commit(self) -> list:
+        if not self.in_progress:
+            raise ValueError("Transaction not in progress, cannot be used in API requests.")
+        await self._client._rpc()
+        versions = self._client._versions
+        if any(versions.get(path, 0) != seen for path, seen in self._reads.items()):
+            self._clean_up()
+            raise Aborted("Transaction contention: a document read was modified")
+        writes = self._writes
+        self._clean_up()
+        return self._client._commit(writes)
+
+    async def commit(self) -> list:
+        return await self._commit()
+
+
+class MemoryFirestore:
+    """In-memory stand-in for the firestore_async client.
+
+    Implements the part of the API the services use, with the same call
+    shapes and semantics: filters (==, !=, <, <=, >, >=, in, not-in,
+    array_contains, array_contains_any), order_by, cursors, limit/offset,
+    select, collection groups, field transforms (SERVER_TIMESTAMP,
+    ArrayUnion, ArrayRemove, Increment, DELETE_FIELD), atomic batches and
+    optimistic transactions that work with async_transactional. Writes raise
+    the same AlreadyExists/NotFound errors as Firestore. Documents and
+    queries also have on_snapshot(), as on the sync client.
+
+    Every call that would be an RPC sleeps for `latency` seconds plus up to
+    `jitter` (FIRESTORE_MEMORY_LATENCY_MS / FIRESTORE_MEMORY_JITTER_MS), so
+    the app can be load tested with realistic round trips. Selected with
+    FIRESTORE_BACKEND=memory, see FirebaseService.
+    """
+
+    def __init__(self, latency: float | None = None, jitter: float | None = None) -> None:
+        self.latency = latency if latency is not None else float(
+            os.getenv('FIRESTORE_MEMORY_LATENCY_MS', 0)) / 1000
+        self.jitter = jitter if jitter is not None else float(
+            os.getenv('FIRESTORE_MEMORY_JITTER_MS', 0)) / 1000
+        self.rpcs = 0
+        self._store: dict[str, dict[str, dict]] = {}
+        self._versions: dict[str, int] = {}
+        self._watches: list[MemoryWatch] = []
+
+    async def _rpc(self) -> None:
+        self.rpcs += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _commit(self, writes: list) -> list:
+        """Apply writes atomically: preconditions are checked for all of them first"""
+        staged: dict[MemoryDocument, dict | None] = {}
+        for op, reference, data, merge in writes:
+            current = staged[reference] if reference in staged else \
+                self._store.get(reference._collection_path, {}).get(reference.id)
+            if op == 'create' and current is not None:
+                raise AlreadyExists(f"Document already exists: {reference.path}")
+            if op == 'update' and current is None:
+                raise NotFound(f"No document to update: {reference.path}")
+
+            if op == 'delete':
+                staged[reference] = None
+                continue
+            document = _copy(current) if current is not None and (merge or op == 'update') else {}
+            if op == 'update':
+                for field_path, value in data.items():
+                    _set_field(document, field_path, value)
+            elif merge:
+                _merge(document, data)
+            else:
+                for key, value in data.items():
+                    if value is not transforms.DELETE_FIELD:
+                        document[key] = _transform(None, value)
+            staged[reference] = document
+
+        update_time = datetime.now(timezone.utc)
+        for reference, document in staged.items():
+            collection = self._store.setdefault(reference._collection_path, {})
+            if document is None:
+                collection.pop(reference.id, None)
+            else:
+                collection[reference.id] = document
+            self._versions[reference.path] = self._versions.get(reference.path, 0) + 1
+        for watch in list(self._watches):
+            watch._evaluate()
+        return [update_time] * len(writes)
+
+    def collection(self, *collection_path: str) -> MemoryCollection:
+        return MemoryCollection(self, '/'.join(collection_path))
+
+    def collection_group(self, collection_id: str) -> MemoryQuery:
+        return MemoryQuery(self, collection_id, all_descendants=True)
+
+    def document(self, *document_path: str) -> MemoryDocument:
+        collection_path, _, document_id = '/'.join(document_path).rpartition('/')
+        return MemoryDocument(self, collection_path, document_id)
+
+    def batch(self) -> MemoryBatch:
+        return MemoryBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> MemoryTransaction:
+        return MemoryTransaction(self, max_attempts, read_only)
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        await self._rpc()
+        snapshots = [reference._snapshot() for reference in
+                     (MemoryDocument(self, *_path_of(ref)) for ref in references)]
+        if transaction is not None:
+            transaction._record_reads(snapshots)
+        for snapshot in snapshots:
+            yield snapshot
+
+    def clear(self) -> None:
+        self._store.clear()
+        self._versions.clear()
+        for watch in list(self._watches):
+            watch._evaluate()
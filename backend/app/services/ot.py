@@ -0,0 +1,139 @@
+"""Operational transformation for plain text, in the ot.js operation format.
+
+An operation is a list of components applied left to right over the whole
+document: a positive int retains that many characters, a string inserts
+it, a negative int deletes that many characters. "hello" -> "hello world"
+is [5, " world"]. Lengths count Unicode code points.
+"""
+
+Operation = list
+
+
+class InvalidOperation(ValueError):
+    """The operation is malformed or doesn't fit the document"""
+
+
+def _retain(component) -> bool:
+    return isinstance(component, int) and not isinstance(component, bool) and component > 0
+
+
+def _delete(component) -> bool:
+    return isinstance(component, int) and not isinstance(component, bool) and component < 0
+
+
+def _insert(component) -> bool:
+    return isinstance(component, str) and component != ''
+
+
+def _append(operation: Operation, component) -> None:
+    """Add a component, merging it with the last one where possible (keeps operations canonical)"""
+    if component == 0 or component == '':
+        return
+    if operation:
+        last = operation[-1]
+        if _retain(component) and _retain(last) or _delete(component) and _delete(last):
+            operation[-1] = last + component
+            return
+        if _insert(component) and _insert(last):
+            operation[-1] = last + component
+            return
+        if _insert(component) and _delete(last):
+            # Inserts go before deletes at the same position
+            if len(operation) > 1 and _insert(operation[-2]):
+                operation[-2] += component
+            else:
+                operation.insert(len(operation) - 1, component)
+            return
+    operation.append(component)
+
+
+def normalize(operation: Operation) -> Operation:
+    """Validate `operation` and return it in canonical form"""
+    if not isinstance(operation, list):
+        raise InvalidOperation("An operation is a list of components")
+    result: Operation = []
+    for component in operation:
+        if not (_retain(component) or _delete(component) or _insert(component)):
+            raise InvalidOperation(f"Invalid component: {component!r}")
+        _append(result, component)
+    return result
+
+
+def base_length(operation: Operation) -> int:
+    """Length of the documents the operation applies to"""
+    return sum(abs(c) for c in operation if not isinstance(c, str))
+
+
+def target_length(operation: Operation) -> int:
+    """Length of the documents it produces"""
+    return sum(c if _retain(c) else len(c) for c in operation if not _delete(c))
+
+
+def apply(document: str, operation: Operation) -> str:
+    if base_length(operation) != len(document):
+        raise InvalidOperation(
+            f"Operation is for a document of length {base_length(operation)}, not {len(document)}")
+    parts, index = [], 0
+    for component in operation:
+        if _retain(component):
+            parts.append(document[index:index + component])
+            index += component
+        elif _insert(component):
+            parts.append(component)
+        else:
+            index -= component
+    return ''.join(parts)
+
+
+def _take(components: list, position: int):
+    return components[position] if position < len(components) else None
+
+
+def transform(a: Operation, b: Operation) -> tuple[Operation, Operation]:
+    """Transform concurrent operations a and b, made on the same document.
+
+    Returns (a', b') with apply(apply(doc, a), b') == apply(apply(doc, b), a').
+    When both insert at the same position, a's text comes first.
+    """
+    if base_length(a) != base_length(b):
+        raise InvalidOperation("Concurrent operations must apply to the same document")
+    a_prime: Operation = []
+    b_prime: Operation = []
+    i = j = 0
+    x, y = _take(a, 0), _take(b, 0)
+    while x is not None or y is not None:
+        if _insert(x):
+            _append(a_prime, x)
+            _append(b_prime, len(x))
+            i += 1
+            x = _take(a, i)
+            continue
+        if _insert(y):
+            _append(a_prime, len(y))
+            _append(b_prime, y)
+            j += 1
+            y = _take(b, j)
+            continue
+        if x is None or y is None:
+            raise InvalidOperation("Concurrent operations must apply to the same document")
+
+        # Both retain or delete: consume the shorter span from each
+        span = min(abs(x), abs(y))
+        if _retain(x) and _retain(y):
+            _append(a_prime, span)
+            _append(b_prime, span)
+        elif _delete(x) and _retain(y):
+            _append(a_prime, -span)
+        elif _retain(x) and _delete(y):
+            _append(b_prime, -span)
+        # Both deleting the same text: nothing left to do for either
+
+        x = x - span if x > 0 else x + span
+        y = y - span if y > 0 else y + span
+        if x == 0:
+            i += 1
+            x = _take(a, i)
+        if y == 0:
+            j += 1
+            y = _take(b, j)
+    return a_prime, b_prime
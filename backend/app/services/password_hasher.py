@@ -0,0 +1,84 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class HasherOverloaded(Exception):
+    """Raised when the bcrypt pool's queue is full; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            f"Password hashing is overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool so it never blocks the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most `max_workers` hashes run at once and at most `max_queue` more may
+    wait; anything beyond that is rejected with HasherOverloaded instead of
+    piling up behind a login storm.
+    """
+
+    def __init__(self, rounds: int | None = None, max_workers: int | None = None, max_queue: int | None = None) -> None:
+        self.rounds = rounds or int(os.getenv('BCRYPT_ROUNDS', 12))
+        self.max_workers = max_workers or int(
+            os.getenv('BCRYPT_WORKERS', min(4, os.cpu_count() or 1)))
+        self.max_queue = max_queue if max_queue is not None else int(
+            os.getenv('BCRYPT_MAX_QUEUE', 32))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='bcrypt')
+        self._pending = 0
+        # Moving average of one bcrypt call, used to estimate Retry-After
+        self._avg_seconds = 0.25
+
+    @property
+    def pending(self) -> int:
+        """Number of hash/verify calls running or queued"""
+        return self._pending
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_workers + self.max_queue:
+            waves = math.ceil(self._pending / self.max_workers)
+            raise HasherOverloaded(max(1, math.ceil(waves * self._avg_seconds)))
+
+        self._pending += 1
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - started
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    def _hash_sync(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    @staticmethod
+    def _verify_sync(plain_password: str, hashed_password: str) -> bool:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash_sync, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self._verify_sync, plain_password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        """True if the hash was made with a different cost factor than configured"""
+        # bcrypt hashes look like $2b$12$<salt+hash>
+        try:
+            cost = int(hashed_password.split('$')[2])
+        except (IndexError, ValueError):
+            return True
+        return cost != self.rounds
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,296 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+import orjson
+from pydantic import BaseModel
+
+from .cache import TTLCache, _MISSING
+from .singleflight import SingleFlight
+from ..monitoring.metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """Backend living in this process; invalidations reach only its own subscribers.
+
+    The default, and enough for a single worker. With several workers or
+    instances use the Redis backend, or every worker keeps its own copy.
+    """
+
+    def __init__(self, maxsize: int = 100_000) -> None:
+        self._data = TTLCache(maxsize=maxsize)
+        self._subscribers: dict[str, list[Callable]] = {}
+
+    async def ping(self) -> None:
+        pass
+
+    async def mget(self, *keys: str) -> list:
+        return [self._data.get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data.set(key, value, ttl=ttl)
+
+    async def bump(self, key: str, ttl: float) -> int:
+        version = int(self._data.get(key) or 0) + 1
+        self._data.set(key, version, ttl=ttl)
+        return version
+
+    async def publish(self, channel: str, message: str) -> None:
+        for callback in list(self._subscribers.get(channel, ())):
+            callback(message)
+
+    async def listen(self, channel: str, callback: Callable) -> None:
+        """Deliver messages on `channel` to callback until cancelled"""
+        self._subscribers.setdefault(channel, []).append(callback)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self._subscribers[channel].remove(callback)
+
+    async def close(self) -> None:
+        self._data.clear()
+
+
+class RedisBackend:
+    """Backend on anything speaking the Redis protocol (Redis, Valkey, KeyDB, fakeredis).
+
+    Needs the optional `redis` package; pass `client` to use an existing
+    redis.asyncio client instead of connecting to `url`.
+    """
+
+    def __init__(self, url: str | None = None, client=None) -> None:
+        if client is None:
+            try:
+                from redis import asyncio as redis
+            except ImportError as e:
+                raise RuntimeError("CACHE_BACKEND=redis needs the 'redis' package") from e
+            client = redis.from_url(url or 'redis://localhost:6379/0')
+        self._redis = client
+
+    async def ping(self) -> None:
+        await self._redis.ping()
+
+    async def mget(self, *keys: str) -> list:
+        return await self._redis.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self._redis.set(key, value, px=max(1, int(ttl * 1000)))
+
+    async def bump(self, key: str, ttl: float) -> int:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.pexpire(key, max(1, int(ttl * 1000)))
+            version, _ = await pipe.execute()
+        return version
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._redis.publish(channel, message)
+
+    async def listen(self, channel: str, callback: Callable) -> None:
+        """Deliver messages on `channel` to callback until cancelled.
+
+        After a lost connection it resubscribes and calls callback(None),
+        since invalidations may have been missed in between.
+        """
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        callback(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Cache invalidation channel lost, resubscribing: %r", e)
+                callback(None)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+@functools.cache
+def _fingerprint(model: type[BaseModel]) -> str:
+    """Short hash of a model's fields, so entries written for another shape of it are never read"""
+    shape = sorted((name, repr(field.annotation)) for name, field in model.model_fields.items())
+    return hashlib.sha1(repr(shape).encode()).hexdigest()[:8]
+
+
+class SharedCache:
+    """Cache tier shared by every worker and instance, in front of Firestore lookups.
+
+    Two levels: a short-lived TTLCache in the process, then the backend
+    (CACHE_BACKEND=memory|redis, CACHE_URL for Redis). Values are pydantic
+    models stored as JSON; None is cached too, for CACHE_NEGATIVE_TTL.
+
+    Keys are versioned twice over:
+    - data keys carry a fingerprint of the model, so a deploy that changes
+      a model never reads entries written by the old code;
+    - every entry records the version of its key when the load started,
+      and invalidate() bumps that version. A lookup that raced a write and
+      stored the old value is therefore never served.
+    invalidate() also broadcasts the key on a pub/sub channel, and every
+    process subscribed with start() drops its local copy and tells the
+    listeners registered with on_invalidate().
+
+    Use it for read-only paths; code about to write should read Firestore.
+    """
+    _instance = None
+    _listeners: dict[str, list[Callable[[str | None], None]]] = {}
+
+    def __init__(self, backend, ttl: float = 300.0, negative_ttl: float = 30.0,
+                 local_ttl: float = 5.0, local_size: int = 10_000, namespace: str = 'sensei') -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = min(negative_ttl, ttl)
+        self.namespace = namespace
+        self.channel = f"{namespace}:invalidate"
+        self._local = TTLCache(maxsize=local_size, ttl=local_ttl, name='shared_local')
+        self._hits, self._misses = cache_counters('shared')
+        # Concurrent misses for one key share the backend round trip and the load
+        self._flights = SingleFlight('shared_cache')
+        # Bumped on every invalidation, so a load that raced one isn't kept locally
+        self._generation = 0
+        self._listener = None
+
+    @classmethod
+    def initialize(cls) -> "SharedCache":
+        """The process-wide cache, created from the environment on first use"""
+        if cls._instance is None:
+            name = os.getenv('CACHE_BACKEND', 'memory').lower()
+            if name == 'redis':
+                backend, ttl = RedisBackend(os.getenv('CACHE_URL')), 300
+            elif name == 'memory':
+                # Other workers can't be told about writes, so keep entries as short as the local tier
+                backend, ttl = MemoryBackend(), 5
+            else:
+                raise ValueError(f"Unknown CACHE_BACKEND: {name!r}")
+            cls._instance = cls(
+                backend,
+                ttl=float(os.getenv('CACHE_TTL', ttl)),
+                negative_ttl=float(os.getenv('CACHE_NEGATIVE_TTL', 30)),
+                local_ttl=float(os.getenv('CACHE_LOCAL_TTL', 5)),
+                local_size=int(os.getenv('CACHE_LOCAL_SIZE', 10_000)),
+                namespace=os.getenv('CACHE_NAMESPACE', 'sensei'))
+        return cls._instance
+
+    async def start(self) -> None:
+        """Subscribe to invalidations from other processes"""
+        if self._listener is None:
+            self._listener = asyncio.create_task(
+                self.backend.listen(self.channel, self._on_message))
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self.backend.close()
+
+    @classmethod
+    async def close(cls) -> None:
+        """Stop the process-wide cache, if one was created"""
+        cache, cls._instance = cls._instance, None
+        if cache is not None:
+            await cache.stop()
+
+    @classmethod
+    def on_invalidate(cls, kind: str, callback: Callable[[str | None], None]) -> None:
+        """Call callback(key) whenever a `kind` entry is invalidated here or elsewhere.
+
+        callback(None) means any key may have changed (invalidations were lost).
+        """
+        cls._listeners.setdefault(kind, []).append(callback)
+
+    def _data_key(self, kind: str, key: str, model: type[BaseModel]) -> str:
+        return f"{self.namespace}:{kind}:{_fingerprint(model)}:{key}"
+
+    def _version_key(self, kind: str, key: str) -> str:
+        return f"{self.namespace}:ver:{kind}:{key}"
+
+    async def get_or_load(self, kind: str, key: str, model: type[BaseModel],
+                          load: Callable[[], Awaitable[BaseModel | None]]) -> Any:
+        """Return the cached `model` for (kind, key), calling `load()` on a miss"""
+        value = self._local.get((kind, key), _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        return await self._flights.do(
+            (kind, key), lambda: self._fetch(kind, key, model, load, generation))
+
+    async def _fetch(self, kind: str, key: str, model: type[BaseModel],
+                     load: Callable[[], Awaitable[BaseModel | None]], generation: int) -> Any:
+        data_key = self._data_key(kind, key, model)
+        try:
+            blob, version = await self.backend.mget(data_key, self._version_key(kind, key))
+        except Exception as e:
+            # The cache is an optimisation: carry on without it
+            logger.warning("Cache backend unavailable: %r", e)
+            return await load()
+
+        version = int(version or 0)
+        if blob is not None:
+            entry = orjson.loads(blob)
+            if entry['v'] == version:
+                self._hits.inc()
+                value = None if entry['d'] is None else model.model_validate(entry['d'])
+                self._keep_local(kind, key, value, generation)
+                return value
+
+        self._misses.inc()
+        value = await load()
+        if value is not None and not isinstance(value, model):
+            value = model.model_validate(value, from_attributes=True)
+        blob = orjson.dumps({'v': version, 'd': None if value is None else value.model_dump(mode='json')})
+        try:
+            await self.backend.set(data_key, blob, self.negative_ttl if value is None else self.ttl)
+        except Exception as e:
+            logger.warning("Cache backend unavailable: %r", e)
+        self._keep_local(kind, key, value, generation)
+        return value
+
+    def _keep_local(self, kind: str, key: str, value: Any, generation: int) -> None:
+        if generation == self._generation:
+            self._local.set((kind, key), value)
+
+    async def invalidate(self, kind: str, key: str) -> None:
+        """Forget (kind, key) everywhere; call after the write has been committed"""
+        self._drop_local(kind, key)
+        try:
+            # Outlive any entry stored under the old version
+            await self.backend.bump(self._version_key(kind, key), self.ttl * 2)
+            await self.backend.publish(self.channel, f"{kind}:{key}")
+        except Exception:
+            logger.exception("Cache invalidation failed", extra={"cache_key": f"{kind}:{key}"})
+
+    def _on_message(self, message: bytes | str | None) -> None:
+        if message is None:
+            self._generation += 1
+            self._local.clear()
+            self._flights.clear()
+            for kind, callbacks in self._listeners.items():
+                for callback in callbacks:
+                    callback(None)
+            return
+        if isinstance(message, bytes):
+            message = message.decode()
+        kind, _, key = message.partition(':')
+        self._drop_local(kind, key)
+
+    def _drop_local(self, kind: str, key: str) -> None:
+        self._generation += 1
+        self._local.pop((kind, key))
+        self._flights.forget((kind, key))
+        for callback in self._listeners.get(kind, ()):
+            callback(key)
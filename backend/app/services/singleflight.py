@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..monitoring.metrics import singleflight_counters
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one.
+
+    The first caller for a key (the leader) runs `fn`; callers arriving while
+    it is in flight await the same result, or the same exception. Nothing is
+    kept once it completes, so this adds no staleness beyond the call itself.
+    After a write, forget() the key: later callers then start a fresh call
+    instead of joining one that may have read the old data.
+
+    Callers share the returned object and must treat it as read-only.
+    Meant to be used from the event loop thread only.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._leaders, self._shared = singleflight_counters(name)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self._leaders.inc()
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self._shared.inc()
+        # One caller going away (client disconnect) mustn't cancel the others' call
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marks the exception retrieved even if every caller went away
+            task.exception()
+
+    def forget(self, key: Hashable) -> None:
+        self._calls.pop(key, None)
+
+    def clear(self) -> None:
+        self._calls.clear()
+
+    def __len__(self) -> int:
+        return len(self._calls)
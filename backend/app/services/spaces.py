@@ -0,0 +1,580 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable
+
+from firebase_admin import firestore_async as firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+
+from . import ot
+from .filesystem import FileSystem
+from .firebase_service import FirebaseService
+from .singleflight import SingleFlight
+from ..models.models import VirtualFile
+from ..models.spaces import AppliedOperation, ChatMessage, CodeSpace, EditRequest, OperationLog, SpaceUser
+from ..models.users import UserPublic
+from ..monitoring.tracing import trace_public_methods
+
+logger = logging.getLogger(__name__)
+
+JOIN_CODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+class SpaceNotFound(LookupError):
+    pass
+
+
+class StaleOperation(Exception):
+    """The client is too far behind the live document and must reload the space"""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class LiveDocument:
+    """The active file of one space while it is being edited: content, version and recent operations.
+
+    Operations are applied here, in memory; LiveDocuments writes the content
+    back to the file every few seconds, so typing costs one Firestore write
+    per interval however many operations were made.
+    """
+
+    def __init__(self, space_id: str, file_id: str, content: str, version: int,
+                 members: set[str], editors: set[str], history: int = 1000) -> None:
+        self.space_id = space_id
+        self.file_id = file_id
+        self.content = content
+        self.version = version
+        self.persisted_version = version
+        self.members = members
+        self.editors = editors
+        # The last `history` operations, for transforming operations made on older versions
+        self.history: deque[AppliedOperation] = deque(maxlen=history)
+        # user id -> time of their last operation, written with the next snapshot
+        self.activity: dict[str, int] = {}
+        self.last_used = time.monotonic()
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.persisted_version
+
+    def _oldest(self) -> int:
+        return self.version - len(self.history)
+
+    def submit(self, user_id: str, base_version: int, ops: list, max_length: int) -> AppliedOperation:
+        """Apply an operation made on `base_version`, transformed past everything applied since"""
+        ops = ot.normalize(ops)
+        if base_version > self.version:
+            raise ot.InvalidOperation(f"Version {base_version} doesn't exist yet")
+        if base_version < self._oldest():
+            raise StaleOperation(f"Version {base_version} is too old, reload the space")
+
+        for applied in list(self.history)[base_version - self._oldest():]:
+            ops, _ = ot.transform(ops, applied.ops)
+        if ot.target_length(ops) > max_length:
+            raise ot.InvalidOperation(f"Documents are limited to {max_length} characters")
+        self.content = ot.apply(self.content, ops)
+
+        self.version += 1
+        applied = AppliedOperation(version=self.version, user_id=user_id, ops=ops)
+        self.history.append(applied)
+        self.activity[user_id] = _now_ms()
+        self.last_used = time.monotonic()
+        return applied
+
+    def operations_since(self, version: int) -> list[AppliedOperation]:
+        if version > self.version:
+            raise ot.InvalidOperation(f"Version {version} doesn't exist yet")
+        if version < self._oldest():
+            raise StaleOperation(f"Version {version} is too old, reload the space")
+        self.last_used = time.monotonic()
+        return list(self.history)[version - self._oldest():]
+
+
+class LiveDocuments:
+    """The live documents of this process, and the task that snapshots them.
+
+    Every SPACES_SNAPSHOT_INTERVAL seconds the content of each document
+    edited since the last snapshot is written to its file, with the new
+    version on the space, in one batch. flush() does it on demand (save)
+    and close() at shutdown. Documents idle for SPACES_DOCUMENT_IDLE seconds
+    are unloaded once written; those whose file or space was deleted are
+    unloaded with their unwritten edits.
+
+    A document lives in the process that loaded it: with several workers
+    or instances, route each space to one of them (sticky sessions), or
+    their edits diverge until the next reload.
+    """
+    _instance = None
+
+    def __init__(self, db=None, interval: float = 2.0, history: int = 1000,
+                 idle: float = 600.0, max_length: int = 1_000_000) -> None:
+        self._db = db
+        self.interval = interval
+        self.history = history
+        self.idle = idle
+        self.max_length = max_length
+        self._documents: dict[str, LiveDocument] = {}
+        self._loads = SingleFlight('spaces')
+        self._flush_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+
+    @classmethod
+    def initialize(cls) -> "LiveDocuments":
+        if cls._instance is None:
+            cls._instance = cls(
+                interval=float(os.getenv('SPACES_SNAPSHOT_INTERVAL', 2)),
+                history=int(os.getenv('SPACES_OPERATION_HISTORY', 1000)),
+                idle=float(os.getenv('SPACES_DOCUMENT_IDLE', 600)),
+                max_length=int(os.getenv('SPACES_MAX_DOCUMENT_LENGTH', 1_000_000)))
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        """Write every pending edit and stop the process-wide instance, if one was created"""
+        documents, cls._instance = cls._instance, None
+        if documents is not None:
+            await documents.stop()
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                self._unload_idle()
+            except Exception:
+                # Retried on the next tick; the edits are still in memory
+                logger.exception("Space snapshot failed")
+
+    def loaded(self, space_id: str) -> LiveDocument | None:
+        return self._documents.get(space_id)
+
+    async def get(self, space_id: str) -> LiveDocument | None:
+        """The space's live document, loaded from Firestore on first use; None without an active file"""
+        document = self._documents.get(space_id)
+        if document is not None:
+            return document
+        return await self._loads.do(space_id, lambda: self._load(space_id))
+
+    async def _load(self, space_id: str) -> LiveDocument | None:
+        space_ref = self.db.collection('spaces').document(space_id)
+        space, members = await asyncio.gather(
+            space_ref.get(), space_ref.collection('members').get())
+        data = space.to_dict() if space.exists else None
+        if not data or not data.get('active_file_id'):
+            return None
+        file = await self.db.collection('files').document(data['active_file_id']).get()
+        if not file.exists:
+            return None
+
+        document = self._documents.get(space_id)
+        if document is None:
+            document = LiveDocument(
+                space_id, file.id, (file.to_dict() or {}).get('content') or '', data.get('version', 0),
+                members={m.id for m in members},
+                editors={m.id for m in members if (m.to_dict() or {}).get('can_edit')},
+                history=self.history)
+            self._documents[space_id] = document
+        return document
+
+    async def flush(self, space_id: str | None = None) -> None:
+        """Write the content of edited documents (all of them, or one space's) to their files"""
+        async with self._flush_lock:
+            documents = [d for d in self._documents.values()
+                         if d.dirty and (space_id is None or d.space_id == space_id)]
+            # A batch takes at most 500 writes: the file, the space and up to a few members each
+            for start in range(0, len(documents), 50):
+                await self._write(documents[start:start + 50])
+
+    def _stage(self, batch, document: LiveDocument, activity: dict[str, int], members: bool = True) -> None:
+        batch.update(self.db.collection('files').document(document.file_id), {
+            'content': document.content,
+            'updated_at': firestore.SERVER_TIMESTAMP,  # type: ignore
+        })
+        space_ref = self.db.collection('spaces').document(document.space_id)
+        batch.update(space_ref, {
+            'version': document.version,
+            'last_activity': max(activity.values(), default=_now_ms()),
+        })
+        if members:
+            for user_id, last_activity in list(activity.items())[:8]:
+                if user_id in document.members:
+                    batch.update(space_ref.collection('members').document(user_id),
+                                 {'last_activity': last_activity})
+
+    async def _write(self, documents: list[LiveDocument]) -> None:
+        snapshots = []
+        for document in documents:
+            activity, document.activity = document.activity, {}
+            snapshots.append((document, document.version, activity))
+        batch = self.db.batch()
+        for document, _, activity in snapshots:
+            self._stage(batch, document, activity)
+        written = []
+        try:
+            try:
+                await batch.commit()
+                written = snapshots
+            except NotFound:
+                # A file, space or member was deleted meanwhile, failing the whole batch:
+                # write the documents one by one, without member activity
+                for snapshot in snapshots:
+                    single = self.db.batch()
+                    self._stage(single, snapshot[0], snapshot[2], members=False)
+                    try:
+                        await single.commit()
+                        written.append(snapshot)
+                    except NotFound:
+                        # Its file or space is gone, and its edits with them
+                        logger.warning("Unloading space %s, its file or space was deleted", snapshot[0].space_id)
+                        self._drop(snapshot[0])
+        except Exception:
+            for document, version, activity in snapshots:
+                if (document, version, activity) not in written:
+                    document.activity = {**activity, **document.activity}
+            raise
+
+        for document, version, _ in written:
+            document.persisted_version = max(document.persisted_version, version)
+        await FileSystem(self._db)._invalidate(*(document.file_id for document, _, _ in written))
+
+    def _drop(self, document: LiveDocument) -> None:
+        if self._documents.get(document.space_id) is document:
+            del self._documents[document.space_id]
+        self._loads.forget(document.space_id)
+
+    @classmethod
+    def file_deleted(cls, file_id: str) -> None:
+        """Unload the documents of the process-wide instance that edit a deleted file"""
+        documents = cls._instance
+        if documents is None:
+            return
+        for document in [d for d in documents._documents.values() if d.file_id == file_id]:
+            documents._drop(document)
+
+    async def switch(self, space_id: str, update: Callable[[], Awaitable[None]]) -> LiveDocument | None:
+        """Write and forget the space's document, then `update` the space (e.g. its active file).
+
+        Runs as the space's load: get() calls meanwhile wait for it and get
+        the document loaded after the update, never one of the old file.
+        """
+        # A load of the old file already in flight finishes first
+        await self.get(space_id)
+
+        async def write_update_load() -> LiveDocument | None:
+            document = self._documents.pop(space_id, None)
+            if document is not None and document.dirty:
+                try:
+                    async with self._flush_lock:
+                        await self._write([document])
+                except Exception:
+                    self._documents.setdefault(space_id, document)
+                    raise
+            await update()
+            return await self._load(space_id)
+
+        return await self._loads.do(space_id, write_update_load)
+
+    async def unload(self, space_id: str) -> None:
+        """Write the space's pending edits and forget its document (e.g. the active file changed)"""
+        await self.flush(space_id)
+        self._documents.pop(space_id, None)
+        self._loads.forget(space_id)
+
+    def _unload_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle
+        for space_id, document in list(self._documents.items()):
+            if not document.dirty and document.last_used < cutoff:
+                del self._documents[space_id]
+
+
+@trace_public_methods
+class SpaceService:
+    """Collaborative code spaces: membership, chat, edit requests and live editing.
+
+    Firestore layout:
+        spaces/{space_id}                   the space, with member_ids for listing
+        spaces/{space_id}/members/{user_id} a SpaceUser, plus edit_requested_at
+        spaces/{space_id}/messages/{id}     chat, read newest first
+        space_codes/{join_code}             {space_id}, reserved when the space is created
+    Anyone can join a public space by id; private ones need the join code.
+    The creator picks the active file (one they can edit) and decides edit
+    requests. Edits to the active file are operations applied to its live
+    document (see LiveDocuments) and reach Firestore in periodic snapshots.
+    """
+
+    def __init__(self, db=None, documents: LiveDocuments | None = None) -> None:
+        self._db = db
+        self._documents = documents
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
+    @property
+    def documents(self) -> LiveDocuments:
+        return self._documents if self._documents is not None else LiveDocuments.initialize()
+
+    def _space_ref(self, space_id: str):
+        return self.db.collection('spaces').document(space_id)
+
+    @staticmethod
+    def _member(user: UserPublic, is_creator: bool = False) -> dict:
+        now = _now_ms()
+        return {'id': user.id, 'username': user.username, 'is_creator': is_creator,
+                'can_edit': is_creator, 'joined_at': now, 'last_activity': now,
+                'edit_requested_at': None}
+
+    async def create_space(self, user: UserPublic, name: str, is_public: bool = False) -> CodeSpace:
+        space_id = str(uuid.uuid4())
+        now = _now_ms()
+        for _ in range(5):
+            join_code = ''.join(secrets.choice(JOIN_CODE_ALPHABET) for _ in range(6))
+            space_ref = self._space_ref(space_id)
+            batch = self.db.batch()
+            # Fails the whole batch if the code is taken
+            batch.create(self.db.collection('space_codes').document(join_code), {'space_id': space_id})
+            batch.create(space_ref, {
+                'id': space_id, 'name': name, 'join_code': join_code, 'is_public': is_public,
+                'created_at': now, 'creator_id': user.id, 'creator_name': user.username,
+                'active_file_id': None, 'version': 0, 'last_activity': now, 'member_ids': [user.id],
+            })
+            batch.create(space_ref.collection('members').document(user.id), self._member(user, is_creator=True))
+            try:
+                await batch.commit()
+                break
+            except AlreadyExists:
+                continue
+        else:
+            raise RuntimeError("Could not find a free join code")
+        return await self.get_space(space_id, user)
+
+    async def _read(self, space_id: str) -> tuple[dict, dict[str, dict]]:
+        space_ref = self._space_ref(space_id)
+        space, members = await asyncio.gather(space_ref.get(), space_ref.collection('members').get())
+        data = space.to_dict() if space.exists else None
+        if not data:
+            raise SpaceNotFound(f"Space {space_id} not found")
+        return data, {m.id: m.to_dict() for m in members}
+
+    def _build(self, data: dict, members: dict[str, dict], messages: list[dict] | None = None,
+               active_file: VirtualFile | None = None, version: int | None = None) -> CodeSpace:
+        idle_ms = float(os.getenv('SPACES_IDLE_SECONDS', 300)) * 1000
+        now = _now_ms()
+        ordered = sorted(members.values(), key=lambda m: (not m.get('is_creator'), m.get('joined_at', 0)))
+        return CodeSpace(
+            id=data['id'], name=data['name'], join_code=data['join_code'], created_at=data['created_at'],
+            creator_id=data['creator_id'], creator_name=data['creator_name'], is_public=data['is_public'],
+            last_activity=data['last_activity'],
+            version=version if version is not None else data.get('version', 0),
+            users=[SpaceUser(**{**m, 'is_active': now - m['last_activity'] < idle_ms}) for m in ordered],
+            edit_requests=[EditRequest(id=f"{data['id']}:{m['id']}", user_id=m['id'], username=m['username'],
+                                       timestamp=m['edit_requested_at'])
+                           for m in ordered if m.get('edit_requested_at')],
+            messages=[ChatMessage(**m) for m in messages or []],
+            active_file=active_file)
+
+    async def get_space(self, space_id: str, user: UserPublic) -> CodeSpace:
+        """The space with its members, recent messages and active file, as the user sees it"""
+        limit = int(os.getenv('SPACES_MESSAGE_LIMIT', 50))
+        messages_query = self._space_ref(space_id).collection('messages') \
+            .order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit)
+        (data, members), messages = await asyncio.gather(self._read(space_id), messages_query.get())
+        if user.id not in members and not data['is_public']:
+            raise PermissionError("You are not a member of this space")
+
+        active_file, version = None, None
+        if data.get('active_file_id'):
+            document = await self.documents.get(space_id)
+            active_file = await FileSystem(self._db).get_file(data['active_file_id'], cached=True)
+            if active_file is not None and document is not None:
+                # Edits not written yet
+                active_file = active_file.model_copy(update={'content': document.content})
+                version = document.version
+        return self._build(data, members, [m.to_dict() for m in reversed(messages)], active_file, version)
+
+    async def list_spaces(self, user: UserPublic, limit: int = 50) -> list[CodeSpace]:
+        """Public spaces and the user's own, most recently active first; without messages or files"""
+        spaces = self.db.collection('spaces')
+        public, joined = await asyncio.gather(
+            spaces.where('is_public', '==', True).limit(limit).get(),
+            spaces.where('member_ids', 'array_contains', user.id).limit(limit).get())
+        found = {doc.id: doc.to_dict() for doc in [*public, *joined]}
+        found = sorted(found.values(), key=lambda d: d['last_activity'], reverse=True)[:limit]
+        members = await asyncio.gather(*(
+            self._space_ref(data['id']).collection('members').get() for data in found))
+        return [self._build(data, {m.id: m.to_dict() for m in docs}) for data, docs in zip(found, members)]
+
+    async def join_by_code(self, user: UserPublic, join_code: str) -> CodeSpace:
+        code = await self.db.collection('space_codes').document(join_code.strip().upper()).get()
+        if not code.exists:
+            raise SpaceNotFound("No space with this join code")
+        return await self.join_space(user, code.to_dict()['space_id'], with_code=True)
+
+    async def join_space(self, user: UserPublic, space_id: str, with_code: bool = False) -> CodeSpace:
+        data, members = await self._read(space_id)
+        member_ref = self._space_ref(space_id).collection('members').document(user.id)
+        if user.id in members:
+            await member_ref.update({'username': user.username, 'last_activity': _now_ms()})
+        else:
+            if not data['is_public'] and not with_code:
+                raise PermissionError("This space is private, join it with its code")
+            batch = self.db.batch()
+            batch.set(member_ref, self._member(user))
+            batch.update(self._space_ref(space_id), {
+                'member_ids': firestore.ArrayUnion([user.id]),  # type: ignore
+                'last_activity': _now_ms()})
+            await batch.commit()
+            if (document := self.documents.loaded(space_id)) is not None:
+                document.members.add(user.id)
+        return await self.get_space(space_id, user)
+
+    async def leave_space(self, user: UserPublic, space_id: str) -> None:
+        """Leave the space; the last member to leave deletes it"""
+        space_ref = self._space_ref(space_id)
+        member_ref = space_ref.collection('members').document(user.id)
+
+        @firestore.async_transactional
+        async def remove(transaction) -> dict | None:
+            space = await space_ref.get(transaction=transaction)
+            data = space.to_dict() if space.exists else None
+            if not data or user.id not in data.get('member_ids', []):
+                return None
+            remaining = [m for m in data['member_ids'] if m != user.id]
+            transaction.delete(member_ref)
+            if remaining:
+                transaction.update(space_ref, {'member_ids': remaining, 'last_activity': _now_ms()})
+            else:
+                transaction.delete(space_ref)
+                transaction.delete(self.db.collection('space_codes').document(data['join_code']))
+            return {**data, 'member_ids': remaining}
+
+        if (document := self.documents.loaded(space_id)) is not None and document.members <= {user.id}:
+            # The space may go with its last member: write the edits while it exists
+            await self.documents.flush(space_id)
+        data = await remove(self.db.transaction())
+        if data is None:
+            raise SpaceNotFound(f"You are not in space {space_id}")
+        if document := self.documents.loaded(space_id):
+            document.members.discard(user.id)
+            document.editors.discard(user.id)
+        if not data['member_ids']:
+            await self.documents.unload(space_id)
+            await self._delete_messages(space_id)
+
+    async def _delete_messages(self, space_id: str) -> None:
+        messages = self._space_ref(space_id).collection('messages')
+        while docs := await messages.limit(500).get():
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            await batch.commit()
+
+    async def _require_member(self, space_id: str, user: UserPublic) -> tuple[dict, dict[str, dict]]:
+        data, members = await self._read(space_id)
+        if user.id not in members:
+            raise PermissionError("You are not a member of this space")
+        return data, members
+
+    async def send_message(self, user: UserPublic, space_id: str, message: str) -> ChatMessage:
+        member_ref = self._space_ref(space_id).collection('members').document(user.id)
+        if not (await member_ref.get()).exists:
+            raise PermissionError("You are not a member of this space")
+        chat = ChatMessage(id=str(uuid.uuid4()), user_id=user.id, username=user.username,
+                           message=message, timestamp=_now_ms())
+        batch = self.db.batch()
+        batch.create(self._space_ref(space_id).collection('messages').document(chat.id), chat.model_dump())
+        batch.update(member_ref, {'last_activity': chat.timestamp})
+        batch.update(self._space_ref(space_id), {'last_activity': chat.timestamp})
+        await batch.commit()
+        return chat
+
+    async def request_edit(self, user: UserPublic, space_id: str) -> EditRequest:
+        _, members = await self._require_member(space_id, user)
+        if members[user.id].get('can_edit'):
+            raise ValueError("You can already edit in this space")
+        now = _now_ms()
+        await self._space_ref(space_id).collection('members').document(user.id).update(
+            {'edit_requested_at': now, 'last_activity': now})
+        return EditRequest(id=f"{space_id}:{user.id}", user_id=user.id, username=user.username, timestamp=now)
+
+    async def decide_edit(self, creator: UserPublic, space_id: str, user_id: str, grant: bool) -> CodeSpace:
+        """Grant or deny a pending edit request; denying without one revokes editing"""
+        data, members = await self._read(space_id)
+        if data['creator_id'] != creator.id:
+            raise PermissionError("Only the creator of the space decides who edits")
+        if user_id not in members:
+            raise SpaceNotFound(f"User {user_id} is not in this space")
+        if user_id == creator.id:
+            raise ValueError("The creator can always edit")
+        await self._space_ref(space_id).collection('members').document(user_id).update(
+            {'can_edit': grant, 'edit_requested_at': None})
+        if (document := self.documents.loaded(space_id)) is not None:
+            (document.editors.add if grant else document.editors.discard)(user_id)
+        return await self.get_space(space_id, creator)
+
+    async def set_active_file(self, user: UserPublic, space_id: str, file_id: str) -> CodeSpace:
+        data, _ = await self._read(space_id)
+        if data['creator_id'] != user.id:
+            raise PermissionError("Only the creator of the space picks the file")
+        file = await FileSystem(self._db).get_file(file_id)
+        if file is None:
+            raise SpaceNotFound(f"File {file_id} not found")
+        # Edits are written to the file on the creator's behalf
+        if user.username not in (file.can_edit or []) or file.directory:
+            raise PermissionError("You can only open a file you can edit")
+        if data.get('active_file_id') != file_id:
+            await self.documents.switch(space_id, lambda: self._space_ref(space_id).update(
+                {'active_file_id': file_id, 'version': 0, 'last_activity': _now_ms()}))
+        return await self.get_space(space_id, user)
+
+    async def _live(self, space_id: str) -> LiveDocument:
+        document = await self.documents.get(space_id)
+        if document is None:
+            raise SpaceNotFound("This space has no active file")
+        return document
+
+    async def submit_operation(self, user: UserPublic, space_id: str, base_version: int, ops: list) -> AppliedOperation:
+        """Apply an edit to the active file; no Firestore round trip once the document is loaded"""
+        document = await self._live(space_id)
+        if user.id not in document.editors:
+            raise PermissionError("You don't have edit permission in this space")
+        return document.submit(user.id, base_version, ops, self.documents.max_length)
+
+    async def get_operations(self, user: UserPublic, space_id: str, since: int) -> OperationLog:
+        """The operations applied after version `since`, for catching up"""
+        document = await self._live(space_id)
+        if user.id not in document.members:
+            raise PermissionError("You are not a member of this space")
+        return OperationLog(version=document.version, operations=document.operations_since(since))
+
+    async def save(self, user: UserPublic, space_id: str) -> int:
+        """Write the active file now rather than at the next snapshot; returns the version written"""
+        document = await self._live(space_id)
+        if user.id not in document.editors:
+            raise PermissionError("You don't have edit permission in this space")
+        await self.documents.flush(space_id)
+        return document.persisted_version
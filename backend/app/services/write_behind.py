@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+
+from firebase_admin import firestore_async as firestore
+from google.api_core.exceptions import NotFound
+
+from .firebase_service import FirebaseService
+from .shared_cache import SharedCache
+from ..monitoring.metrics import WRITE_BEHIND_SAVES
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Autosaves held in memory and written to Firestore together.
+
+    put() keeps only the latest content per file; every AUTOSAVE_WINDOW
+    seconds the files saved since the last flush are written in one batch,
+    so an editor autosaving every keystroke costs one write per file per
+    window. flush() writes now (an explicit save), close() at shutdown.
+    pending() lets FileSystem serve the buffered content to reads made in
+    this process; other workers see it once it is flushed.
+    """
+    _instance = None
+
+    def __init__(self, db=None, window: float = 2.0) -> None:
+        self._db = db
+        self.window = window
+        # file_id -> (content, sequence number of the save)
+        self._pending: dict[str, tuple[str, int]] = {}
+        self._sequence = 0
+        self._flush_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._buffered, self._written = WRITE_BEHIND_SAVES.labels("buffered"), WRITE_BEHIND_SAVES.labels("written")
+
+    @classmethod
+    def initialize(cls) -> "WriteBehindBuffer":
+        if cls._instance is None:
+            cls._instance = cls(window=float(os.getenv('AUTOSAVE_WINDOW', 2)))
+        return cls._instance
+
+    @classmethod
+    async def close(cls) -> None:
+        """Write every buffered save and stop the process-wide buffer, if one was created"""
+        buffer, cls._instance = cls._instance, None
+        if buffer is not None:
+            await buffer.stop()
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else FirebaseService().db
+
+    @property
+    def enabled(self) -> bool:
+        """AUTOSAVE_WINDOW=0 turns write-behind off: autosaves are written right away"""
+        return self.window > 0
+
+    def start(self) -> None:
+        if self._flusher is None and self.enabled:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                # Still buffered; retried on the next tick
+                logger.exception("Autosave flush failed")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, file_id: str, content: str) -> None:
+        self._sequence += 1
+        self._pending[file_id] = (content, self._sequence)
+        self._buffered.inc()
+
+    def pending(self, file_id: str) -> str | None:
+        """The buffered content of the file, if a save is waiting to be written"""
+        entry = self._pending.get(file_id)
+        return entry[0] if entry is not None else None
+
+    async def discard(self, file_id: str) -> None:
+        """Drop the file's buffered save, e.g. before a direct write or a delete.
+
+        Waits for a flush in progress, so it can't land after the caller's write.
+        """
+        async with self._flush_lock:
+            self._pending.pop(file_id, None)
+
+    async def flush(self, file_id: str | None = None) -> list[str]:
+        """Write the buffered saves (of every file, or just this one); returns the ids written"""
+        async with self._flush_lock:
+            saves = [(fid, content, sequence) for fid, (content, sequence) in self._pending.items()
+                     if file_id is None or fid == file_id]
+            written = []
+            for start in range(0, len(saves), 500):
+                written += await self._write(saves[start:start + 500])
+            return written
+
+    async def _write(self, saves: list[tuple[str, str, int]]) -> list[str]:
+        def update(writer, fid: str, content: str) -> None:
+            writer.update(self.db.collection('files').document(fid), {
+                'content': content,
+                'updated_at': firestore.SERVER_TIMESTAMP  # type: ignore
+            })
+
+        batch = self.db.batch()
+        for fid, content, _ in saves:
+            update(batch, fid, content)
+        try:
+            await batch.commit()
+            written = saves
+        except NotFound:
+            # A file was deleted meanwhile, failing the whole batch: write the rest one by one
+            written = []
+            for save in saves:
+                single = self.db.batch()
+                update(single, save[0], save[1])
+                try:
+                    await single.commit()
+                    written.append(save)
+                except NotFound:
+                    self._pending.pop(save[0], None)
+
+        for fid, _, sequence in written:
+            # A save made while writing stays buffered for the next flush
+            if self._pending.get(fid, (None, None))[1] == sequence:
+                del self._pending[fid]
+        self._written.inc(len(written))
+        cache = SharedCache.initialize()
+        for fid, _, _ in written:
+            # Reaches FileSystem._forget on every worker
+            await cache.invalidate('file', fid)
+        return [fid for fid, _, _ in written]
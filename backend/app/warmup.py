@@ -0,0 +1,87 @@
+"""Warm-up run in the background after startup.
+
+A fresh worker pays for several things on its first requests: the gRPC
+channel to Firestore and its OAuth token, the cache backend connection,
+the OpenAPI schema, spinning up the bcrypt threads and pydantic/orjson's
+first serialisations. warm_up()
+does them all up front; /ready answers 503 until it has finished, so the
+load balancer only sends traffic to warm workers.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import bcrypt
+
+logger = logging.getLogger("sensei.warmup")
+
+
+async def _firestore(app) -> None:
+    from .services.firebase_service import FirebaseService
+    # The raw client, so the read isn't counted against any request
+    db = FirebaseService.initialize()
+    await db.collection('users').limit(1).get()
+
+
+async def _cache(app) -> None:
+    from .services.shared_cache import SharedCache
+    await SharedCache.initialize().backend.ping()
+
+
+async def _openapi(app) -> None:
+    app.openapi()
+
+
+async def _password_hasher(app) -> None:
+    from .services.auth_service import AuthService
+    hasher = AuthService._password_hasher
+    # One cheap call per worker thread starts them all; keep them out of the Retry-After estimate
+    average = hasher._avg_seconds
+    await asyncio.gather(*(hasher._run(bcrypt.gensalt, 4) for _ in range(hasher.max_workers)))
+    hasher._avg_seconds = average
+
+
+async def _serialization(app) -> None:
+    from .models.models import VirtualFile
+    from .routers.responses import TrustedJSONResponse
+    file = VirtualFile.model_validate({
+        'id': 'warmup', 'root': 'warmup', 'directory': False, 'name': 'warmup.py',
+        'content': '', 'can_view': ['warmup'], 'can_edit': ['warmup'],
+        'created_at': datetime.now(timezone.utc)})
+    TrustedJSONResponse([file])
+
+
+STEPS = {
+    'firestore': _firestore,
+    'cache': _cache,
+    'openapi': _openapi,
+    'password_hasher': _password_hasher,
+    'serialization': _serialization,
+}
+
+
+async def warm_up(app) -> dict:
+    """Run every step, then mark the app ready.
+
+    Steps are best effort: a failure is logged and reported by /ready but
+    doesn't keep the worker out of rotation, since it would fail the same
+    way on a live request.
+    """
+    timeout = float(os.getenv("WARMUP_STEP_TIMEOUT", 10))
+    results = {}
+    for name, step in STEPS.items():
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(app), timeout)
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %r", name, e)
+            results[name] = {"ok": False, "error": repr(e)}
+        else:
+            results[name] = {"ok": True}
+        results[name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    app.state.warmup = results
+    app.state.ready = True
+    logger.info("Warm-up complete", extra={"warmup": results})
+    return results
@@ -0,0 +1,122 @@
+"""Synthetic users, file trees and content corpora for the benchmarks.
+
+Everything is generated from a seeded random.Random, so the same
+parameters give the same data on every run and results stay comparable
+between commits.
+"""
+import random
+import string
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from app.models.users import User
+
+
+# How directories are filled: depth first with few children per directory
+# gives long chains, breadth first with many children gives shallow, wide trees
+SHAPES = {
+    "deep": {"fanout": 4, "dir_ratio": 0.5, "max_depth": 256, "depth_first": True},
+    "wide": {"fanout": 250, "dir_ratio": 0.04, "max_depth": 4, "depth_first": False},
+}
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Corpus:
+    """Vocabulary of made-up identifiers drawn with a Zipf-like distribution,
+    so a few words are in almost every file and most are rare."""
+
+    def __init__(self, rng: random.Random, size: int = 5000) -> None:
+        self.rng = rng
+        self.words = [self._word() for _ in range(size)]
+        self._cum_weights = list(accumulate(1 / rank for rank in range(1, size + 1)))
+
+    def _word(self) -> str:
+        return "".join(self.rng.choices(string.ascii_lowercase, k=self.rng.randint(3, 10)))
+
+    def sample(self, k: int) -> list[str]:
+        return self.rng.choices(self.words, cum_weights=self._cum_weights, k=k)
+
+    def content(self, lines: int) -> str:
+        """Code-looking text, one short statement per line"""
+        return "\n".join(
+            f"{a} = {b}({c}, {d})" for a, b, c, d in
+            (self.sample(4) for _ in range(lines))
+        )
+
+    @property
+    def common_word(self) -> str:
+        return self.words[0]
+
+    @property
+    def rare_word(self) -> str:
+        return self.words[-1]
+
+
+def make_users(count: int) -> list[User]:
+    return [
+        User(id=str(uuid.UUID(int=i)), username=f"user{i}",
+             email=f"user{i}@example.com", password="not-a-hash")
+        for i in range(count)
+    ]
+
+
+def _document(rng: random.Random, owner: str, parent: str | None, directory: bool, corpus: Corpus) -> dict:
+    created = EPOCH + timedelta(seconds=rng.randint(0, 365 * 86400))
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "root": owner,
+        "directory": directory,
+        "parent": parent,
+        "name": "_".join(corpus.sample(2)) + ("" if directory else ".py"),
+        "content": None if directory else corpus.content(rng.randint(5, 60)),
+        "children": [],
+        "can_view": [owner],
+        "can_edit": [owner],
+        "public": False,
+        "created_at": created,
+        "updated_at": created,
+    }
+
+
+def make_tree(owner: str, nodes: int, shape: str, corpus: Corpus, rng: random.Random) -> list[dict]:
+    """File documents (as stored in 'files') forming one user's tree of `nodes` entries"""
+    params = SHAPES[shape]
+    documents = []
+    pending = []
+
+    while len(documents) < nodes:
+        if not pending:
+            top = _document(rng, owner, None, True, corpus)
+            documents.append(top)
+            pending.append((top, 1))
+            continue
+
+        directory, depth = pending.pop() if params["depth_first"] else pending.pop(0)
+        for _ in range(params["fanout"]):
+            if len(documents) >= nodes:
+                break
+            is_dir = depth < params["max_depth"] and rng.random() < params["dir_ratio"]
+            child = _document(rng, owner, directory["id"], is_dir, corpus)
+            directory["children"].append(child["id"])
+            documents.append(child)
+            if is_dir:
+                pending.append((child, depth + 1))
+
+    return documents
+
+
+def share(documents: list[dict], users: list[User], rng: random.Random,
+          share_ratio: float = 0.1, edit_ratio: float = 0.3, public_ratio: float = 0.05) -> None:
+    """Grant random users access to a share of the documents and make some public"""
+    usernames = [user.username for user in users]
+    for document in documents:
+        if rng.random() < share_ratio:
+            for username in rng.sample(usernames, k=min(3, len(usernames))):
+                if username == document["root"]:
+                    continue
+                document["can_view"].append(username)
+                if rng.random() < edit_ratio:
+                    document["can_edit"].append(username)
+        document["public"] = rng.random() < public_ratio
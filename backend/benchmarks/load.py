@@ -0,0 +1,317 @@
+"""End-to-end load test of the API with a realistic mix of user actions.
+
+Runs from the backend directory:
+
+    python -m benchmarks.load                                  # in-process app, memory stand-in
+    FIRESTORE_MEMORY_LATENCY_MS=20 python -m benchmarks.load --users 50 --duration 60
+    python -m benchmarks.load --url http://localhost:8000 --users 200 --slo slo.json
+
+Each virtual user registers, logs in and creates a few files, then loops
+over weighted actions (login, tree, open file, autosave, search, share,
+public browse) with a think time between them. The report gives
+throughput, p50/p95/p99 latency and error rate per action and checks them
+against SLOs; the exit status is 1 when an SLO is missed, so runs can gate
+changes and compare worker counts.
+
+Without --url the app runs in this process over httpx's ASGI transport,
+on the in-memory Firestore (FIRESTORE_BACKEND=memory) unless
+FIRESTORE_BACKEND is already set. With --url it drives any running
+deployment; note that it registers real users (load-<run>-<n>).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+
+
+API = "/api/v1"
+
+# Relative frequency of each action in a virtual user's loop
+DEFAULT_MIX = {
+    "open_file": 30,
+    "autosave": 20,
+    "tree": 15,
+    "public_browse": 15,
+    "search": 10,
+    "share": 5,
+    "login": 5,
+}
+
+# "*" applies to every action without its own entry
+DEFAULT_SLOS = {
+    "*": {"p95_ms": 250, "p99_ms": 500, "error_rate": 0.01},
+    "login": {"p95_ms": 1000, "p99_ms": 2000, "error_rate": 0.01},
+    "search": {"p95_ms": 500, "p99_ms": 1000, "error_rate": 0.01},
+}
+
+WORDS = ("render", "fetch", "parse", "token", "cache", "socket", "tree",
+         "buffer", "query", "stream", "index", "worker", "schema", "route")
+
+
+class Recorder:
+    """Latency samples and failures per action"""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.recording = False
+
+    def record(self, action: str, seconds: float, status: int | str, ok: bool) -> None:
+        if not self.recording:
+            return
+        self.latencies[action].append(seconds)
+        self.statuses[action][str(status)] += 1
+        if not ok:
+            self.errors[action] += 1
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, username: str,
+                 population: list[str], rng: random.Random, think: float) -> None:
+        self.client = client
+        self.recorder = recorder
+        self.username = username
+        self.email = f"{username}@example.com"
+        self.password = "load-test-password"
+        self.population = population
+        self.rng = rng
+        self.think = think
+        self.headers: dict[str, str] = {}
+        self.file_ids: list[str] = []
+
+    async def _request(self, action: str, method: str, path: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=self.headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(action, time.perf_counter() - started, type(e).__name__, False)
+            return None
+        self.recorder.record(action, time.perf_counter() - started,
+                             response.status_code, response.status_code < 400)
+        return response
+
+    def _content(self) -> str:
+        return "\n".join(
+            f"{self.rng.choice(WORDS)} = {self.rng.choice(WORDS)}({self.rng.choice(WORDS)})"
+            for _ in range(self.rng.randint(5, 40)))
+
+    async def setup(self, files: int) -> bool:
+        """Register, log in and create a directory with a few files, one of them public"""
+        response = await self.client.post(f"{API}/auth/register", json={
+            "username": self.username, "email": self.email, "password": self.password})
+        if response.status_code != 201 or not await self.login():
+            return False
+
+        directory_id = str(uuid.uuid4())
+        response = await self.client.post(f"{API}/filesystem/files/create", headers=self.headers, json={
+            "id": directory_id, "name": "src", "directory": True})
+        if response.status_code != 201:
+            return False
+        for i in range(files):
+            file_id = str(uuid.uuid4())
+            response = await self.client.post(f"{API}/filesystem/files/create", headers=self.headers, json={
+                "id": file_id, "name": f"{self.rng.choice(WORDS)}_{i}.py", "directory": False,
+                "content": self._content()})
+            if response.status_code != 201:
+                return False
+            self.file_ids.append(file_id)
+        if self.file_ids:
+            await self.client.put(f"{API}/filesystem/files/{self.file_ids[0]}/public",
+                                  headers=self.headers, params={"make_public": True})
+        return True
+
+    async def login(self) -> bool:
+        response = await self._request("login", "POST", f"{API}/auth/login", json={
+            "email": self.email, "password": self.password})
+        if response is None or response.status_code != 200:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return True
+
+    async def tree(self) -> None:
+        await self._request("tree", "GET", f"{API}/filesystem/user/tree")
+
+    async def open_file(self) -> None:
+        await self._request("open_file", "GET", f"{API}/filesystem/files/{self.rng.choice(self.file_ids)}")
+
+    async def autosave(self) -> None:
+        await self._request("autosave", "PUT", f"{API}/filesystem/files/{self.rng.choice(self.file_ids)}",
+                            json={"content": self._content()})
+
+    async def search(self) -> None:
+        await self._request("search", "GET", f"{API}/filesystem/search",
+                            params={"query": self.rng.choice(WORDS)})
+
+    async def share(self) -> None:
+        target = self.rng.choice(self.population)
+        if target == self.username:
+            return
+        await self._request("share", "POST", f"{API}/filesystem/files/{self.rng.choice(self.file_ids)}/share",
+                            json={"username": target, "permissions": ["view"]})
+
+    async def public_browse(self) -> None:
+        response = await self._request("public_browse", "GET", f"{API}/filesystem/files/public",
+                                       params={"limit": 20})
+        if response is not None and response.status_code == 200 and response.json():
+            file_id = self.rng.choice(response.json())["id"]
+            await self._request("public_file", "GET", f"{API}/filesystem/files/public/{file_id}")
+
+    async def run(self, mix: dict[str, int], deadline: float) -> None:
+        actions, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(actions, weights)[0])()
+            if self.think:
+                await asyncio.sleep(self.rng.expovariate(1 / self.think))
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(recorder: Recorder, elapsed: float, slos: dict) -> dict:
+    rows = dict(recorder.latencies)
+    rows["all"] = [s for samples in recorder.latencies.values() for s in samples]
+    report = {}
+    for action, samples in sorted(rows.items()):
+        if not samples:
+            continue
+        ordered = sorted(samples)
+        errors = sum(recorder.errors.values()) if action == "all" else recorder.errors[action]
+        row = {
+            "requests": len(ordered),
+            "errors": errors,
+            "error_rate": errors / len(ordered),
+            "rps": len(ordered) / elapsed,
+            "p50_ms": _percentile(ordered, 50) * 1000,
+            "p95_ms": _percentile(ordered, 95) * 1000,
+            "p99_ms": _percentile(ordered, 99) * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+        if action != "all":
+            row["statuses"] = dict(recorder.statuses[action])
+            slo = {**slos.get("*", {}), **slos.get(action, {})}
+            row["slo_violations"] = [
+                f"{metric} {row[metric]:.3g} > {limit}"
+                for metric, limit in slo.items() if row[metric] > limit]
+        report[action] = row
+    return report
+
+
+def print_report(report: dict, elapsed: float) -> None:
+    print(f"\n{'action':<14}{'reqs':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'errors':>8}  SLO")
+    for action, row in report.items():
+        slo = "" if action == "all" else ("ok" if not row["slo_violations"]
+                                          else "FAIL: " + ", ".join(row["slo_violations"]))
+        print(f"{action:<14}{row['requests']:>8}{row['rps']:>9.1f}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['error_rate']:>8.1%}  {slo}")
+    print(f"measured for {elapsed:.1f}s")
+
+
+async def run_load(url: str | None, users: int, duration: float, ramp_up: float, think: float,
+                   files: int, mix: dict[str, int], seed: int) -> tuple[Recorder, float, int]:
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:6]
+    usernames = [f"load-{run_id}-{i}" for i in range(users)]
+
+    async with AsyncExitStack() as stack:
+        if url is None:
+            os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+            from main import app
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+            base_url = "http://loadtest"
+        else:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=users, max_keepalive_connections=users))
+            base_url = url
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(transport=transport, base_url=base_url, timeout=30))
+
+        vus = [VirtualUser(client, recorder, username, usernames, random.Random(seed + i), think)
+               for i, username in enumerate(usernames)]
+        ready = await asyncio.gather(*(vu.setup(files) for vu in vus))
+        vus = [vu for vu, ok in zip(vus, ready) if ok]
+        if not vus:
+            raise RuntimeError("No virtual user could register and log in")
+
+        recorder.recording = True
+        started = time.perf_counter()
+        deadline = started + ramp_up + duration
+
+        async def start(vu: VirtualUser, delay: float):
+            await asyncio.sleep(delay)
+            await vu.run(mix, deadline)
+
+        await asyncio.gather(*(start(vu, ramp_up * i / len(vus)) for i, vu in enumerate(vus)))
+        elapsed = time.perf_counter() - started
+        recorder.recording = False
+
+    return recorder, elapsed, users - len(vus)
+
+
+def _parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        action, _, weight = item.partition("=")
+        if action not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action '{action}'")
+        mix[action] = int(weight)
+    return mix
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running deployment (default: in-process app)")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure after ramp-up starts")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=0.2, help="mean think time between actions, seconds")
+    parser.add_argument("--files", type=int, default=5, help="files each user creates during setup")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX,
+                        help="action weights, e.g. open_file=50,search=10 (default: %(default)s)")
+    parser.add_argument("--slo", type=Path, help="JSON file of SLOs merged over the defaults")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    slos = dict(DEFAULT_SLOS)
+    if args.slo:
+        for action, limits in json.loads(args.slo.read_text()).items():
+            slos[action] = {**slos.get(action, {}), **limits}
+
+    recorder, elapsed, failed_setup = asyncio.run(run_load(
+        args.url, args.users, args.duration, args.ramp_up, args.think, args.files, args.mix, args.seed))
+    report = summarize(recorder, elapsed, slos)
+    print_report(report, elapsed)
+    if failed_setup:
+        print(f"{failed_setup} virtual user(s) failed setup and were not run")
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            "params": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            "slos": slos,
+            "elapsed_s": elapsed,
+            "failed_setup": failed_setup,
+            "report": report,
+        }, indent=2))
+
+    missed = [action for action, row in report.items() if row.get("slo_violations")]
+    return 1 if missed or failed_setup else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
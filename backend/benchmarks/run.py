@@ -0,0 +1,288 @@
+"""Benchmarks for the hot paths of the filesystem service.
+
+Runs from the backend directory:
+
+    python -m benchmarks.run                               # 10k nodes, deep and wide trees
+    python -m benchmarks.run --nodes 10000 100000 --output before.json
+    python -m benchmarks.run --compare before.json         # exits 1 on regressions
+
+The services run unmodified against the in-memory Firestore stand-in
+(FIRESTORE_BACKEND=memory), so results measure our code and the client
+plumbing, not the network. Results are written as JSON (by default to
+benchmarks/results/<commit>.json) so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ["FIRESTORE_BACKEND"] = "memory"
+
+from fastapi import HTTPException  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from app.models.models import VirtualFile  # noqa: E402
+from app.permissions.file_permissions import PermissionRequired  # noqa: E402
+from app.routers.responses import TrustedJSONResponse  # noqa: E402
+from app.services.filesystem import FileSystem  # noqa: E402
+from app.services.firebase_service import FirebaseService  # noqa: E402
+
+from .data import SHAPES, Corpus, make_tree, make_users, share  # noqa: E402
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+PERMISSION_CHECKS = 1000
+
+
+class Dataset:
+    """One synthetic tree, its users and everything derived from it"""
+
+    def __init__(self, shape: str, nodes: int, users: int, seed: int) -> None:
+        rng = random.Random(seed)
+        self.shape = shape
+        self.corpus = Corpus(rng)
+        self.users = make_users(users)
+        self.owner, self.reader = self.users[0], self.users[1]
+        self.documents = make_tree(
+            self.owner.username, nodes, shape, self.corpus, rng)
+        share(self.documents, self.users, rng)
+        self.files = [VirtualFile.model_validate(d) for d in self.documents]
+        self.file_dict = {f.id: f for f in self.files}
+        self.roots = [f for f in self.files if f.parent is None]
+        self.sample_ids = rng.sample(
+            list(self.file_dict), k=min(PERMISSION_CHECKS, nodes))
+
+    async def load(self, db) -> None:
+        db.clear()
+        collection = db.collection('files')
+        for document in self.documents:
+            await collection.document(document['id']).set(document)
+
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark; it returns (callable run once per round, items per round)"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def build_tree_node(ds: Dataset, fs: FileSystem):
+    def run():
+        for root in ds.roots:
+            fs._build_tree_node(root, ds.file_dict)
+    return run, len(ds.files)
+
+
+@benchmark
+def get_file_tree(ds: Dataset, fs: FileSystem):
+    return lambda: fs.get_file_tree(ds.owner.username), len(ds.files)
+
+
+@benchmark
+def matches_search(ds: Dataset, fs: FileSystem):
+    # A rare word makes most documents scan their whole content
+    def run():
+        for document in ds.documents:
+            fs._matches_search(document, ds.corpus.rare_word)
+    return run, len(ds.documents)
+
+
+@benchmark
+def search_files_common(ds: Dataset, fs: FileSystem):
+    return lambda: fs.search_files(ds.corpus.common_word, ds.owner.username), len(ds.documents)
+
+
+@benchmark
+def search_files_rare(ds: Dataset, fs: FileSystem):
+    return lambda: fs.search_files(ds.corpus.rare_word, ds.owner.username), len(ds.documents)
+
+
+@benchmark
+def model_validate(ds: Dataset, fs: FileSystem):
+    def run():
+        for document in ds.documents:
+            VirtualFile.model_validate(document)
+    return run, len(ds.documents)
+
+
+@benchmark
+def listing_response(ds: Dataset, fs: FileSystem):
+    return lambda: TrustedJSONResponse(ds.files), len(ds.files)
+
+
+@benchmark
+def listing_response_validated(ds: Dataset, fs: FileSystem):
+    # What FastAPI does with a response_model: validate, dump, json.dumps
+    adapter = TypeAdapter(list[VirtualFile])
+
+    def run():
+        files = adapter.validate_python(ds.files)
+        json.dumps(adapter.dump_python(files, mode="json"), separators=(",", ":")).encode()
+    return run, len(ds.files)
+
+
+def _permission_checks(permission: str, user, ids: list[str]):
+    @PermissionRequired(permission)
+    async def endpoint(file_id: str, current_user):
+        return file_id
+
+    async def run():
+        for file_id in ids:
+            try:
+                await endpoint(file_id=file_id, current_user=user)
+            except HTTPException:
+                pass
+    return run, len(ids)
+
+
+@benchmark
+def permission_view(ds: Dataset, fs: FileSystem):
+    return _permission_checks("view", ds.owner, ds.sample_ids)
+
+
+@benchmark
+def permission_edit(ds: Dataset, fs: FileSystem):
+    return _permission_checks("edit", ds.owner, ds.sample_ids)
+
+
+@benchmark
+def permission_denied(ds: Dataset, fs: FileSystem):
+    return _permission_checks("view", ds.reader, ds.sample_ids)
+
+
+async def measure(run, rounds: int) -> list[float]:
+    """Seconds taken by each round; an extra first round warms up and is dropped"""
+    gc.collect()
+    times = []
+    for _ in range(rounds + 1):
+        started = time.perf_counter()
+        result = run()
+        if inspect.isawaitable(result):
+            await result
+        times.append(time.perf_counter() - started)
+    return times[1:]
+
+
+def summarize(times: list[float], items: int) -> dict:
+    median = statistics.median(times)
+    return {
+        "rounds": len(times),
+        "items": items,
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.mean(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "items_per_s": items / median if median else None,
+    }
+
+
+async def run_benchmarks(shapes: list[str], sizes: list[int], users: int, rounds: int,
+                         seed: int, only: list[str] | None = None) -> dict:
+    db = FirebaseService.initialize()
+    fs = FileSystem()
+    results = {}
+    for shape in shapes:
+        for nodes in sizes:
+            ds = Dataset(shape, nodes, users, seed)
+            await ds.load(db)
+            for name, setup in BENCHMARKS.items():
+                if only and name not in only:
+                    continue
+                run, items = setup(ds, fs)
+                key = f"{name}[{shape}-{nodes}]"
+                results[key] = summarize(await measure(run, rounds), items)
+                print(f"{key:<40} median {results[key]['median_s'] * 1000:10.2f} ms"
+                      f"  ({results[key]['items_per_s']:,.0f} items/s)", flush=True)
+    db.clear()
+    return results
+
+
+def _commit() -> str | None:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{sha}-dirty" if dirty else sha
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print median changes against a baseline run and return the names that regressed"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        change = result["median_s"] / before["median_s"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {before['median_s'] * 1000:10.2f} -> "
+              f"{result['median_s'] * 1000:10.2f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10_000],
+                        help="tree sizes to generate (default: 10000)")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="run only these benchmarks")
+    parser.add_argument("--output", type=Path,
+                        help="JSON results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative median slowdown counted as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run_benchmarks(
+        args.shapes, args.nodes, args.users, args.rounds, args.seed, args.only))
+
+    commit = _commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": {"nodes": args.nodes, "shapes": args.shapes, "users": args.users,
+                       "rounds": args.rounds, "seed": args.seed},
+        },
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"{commit or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
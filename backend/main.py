@@ -1,34 +1,109 @@
 import datetime
+import logging
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import uvicorn
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
-from app.routers import auth_router, filesystem_router
+from app.routers import auth_router, filesystem_router, admin_router, spaces_router, jobs_router
 from app.services.firebase_service import FirebaseService
+from app.services.shared_cache import SharedCache
+from app.services.change_hub import ChangeHub
+from app.services.file_events import FileEvents
+from app.services.spaces import LiveDocuments
+from app.services.write_behind import WriteBehindBuffer
+from app.services.jobs import JobRunner
+from app.monitoring.metrics import MetricsMiddleware, metrics_endpoint
+from app.monitoring.firestore import FirestoreAccountingMiddleware
+from app.monitoring.profiling import ProfilingMiddleware
+from app.monitoring.loop_monitor import LoopMonitor
+from app.monitoring.logs import RequestContextMiddleware, setup_logging, shutdown_logging
+from app.monitoring.tracing import TracingMiddleware, setup_tracing, shutdown_tracing
+from app.warmup import warm_up
+
+logger = logging.getLogger("sensei")
+
+# Run as background jobs at startup, across workers and deploys, until one succeeds
+# (JobRunner.submit_once); reservations back the uniqueness check in AuthService.create_user
+ROLLOUT_MIGRATIONS = ('backfill_reservations',)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
-    print("Starting Sensei ...")
+    setup_logging()
+    setup_tracing()
+    logger.info("Starting Sensei ...")
 
-    # Initialize Firebase
+    # Initialize Firebase here rather than at import, so bad credentials fail startup
     try:
-        firebase_service = FirebaseService()
-        print("Firebase initialized successfully")
+        FirebaseService.initialize()
+        logger.info("Firebase initialized successfully")
     except Exception as e:
-        print(f"Firebase initialization failed: {e}")
+        logger.exception("Firebase initialization failed")
+        shutdown_logging()
         raise
 
+    # Hear about writes made by other workers and instances
+    await SharedCache.initialize().start()
+    # Tree and share events for GET /api/v1/filesystem/events, from every worker
+    await FileEvents.initialize().start()
+
+    # Snapshots of collaborative edits, see LiveDocuments
+    LiveDocuments.initialize().start()
+    # Autosaves buffered by PUT /files/{id}?autosave=true
+    WriteBehindBuffer.initialize().start()
+    # Bulk operations started with 202 Accepted, see JobRunner
+    await JobRunner.initialize().start()
+    # Data migrations every deployment needs, run once across workers and restarts
+    for migration in ROLLOUT_MIGRATIONS:
+        try:
+            await JobRunner.initialize().submit_once(migration, "system")
+        except Exception:
+            logger.exception("Failed to queue migration", extra={"migration": migration})
+
+    # Watch for blocking code stalling the event loop
+    loop_monitor = None
+    if os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true":
+        loop_monitor = LoopMonitor()
+        loop_monitor.start(app)
+
+    # Serve right away; /ready reports 503 until the warm-up is done
+    app.state.ready = False
+    app.state.warmup = {}
+    warmup_task = None
+    if os.getenv("WARMUP_ENABLED", "true").lower() == "true":
+        warmup_task = asyncio.create_task(warm_up(app))
+    else:
+        app.state.ready = True
+
     yield
 
-    
-    print("Shutting down Sensei ...")
-    print("Shutdown complete")
+    app.state.ready = False
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
+    logger.info("Shutting down Sensei ...")
+    # Let running jobs finish, then write edits still in memory, while Firestore is up;
+    # a step that fails is logged and the rest still run
+    for close in (JobRunner.close, LiveDocuments.close, WriteBehindBuffer.close,
+                  ChangeHub.close, FileEvents.close, SharedCache.close, FirebaseService.close):
+        try:
+            await close()
+        except Exception:
+            logger.exception("Shutdown step failed", extra={"step": close.__qualname__})
+    logger.info("Shutdown complete")
+    try:
+        shutdown_tracing()
+    except Exception:
+        logger.exception("Failed to flush traces")
+    # Last, so the records above are written
+    shutdown_logging()
 
 
 
@@ -72,8 +147,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursor of /auth/users/all/, read by the frontend
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Prometheus request metrics, scraped from /metrics
+app.add_middleware(MetricsMiddleware)
+# Per-request Firestore read/write accounting, reported in Server-Timing
+app.add_middleware(FirestoreAccountingMiddleware)
+# Root span per request; services add child spans (TRACING_EXPORTER=console|file)
+app.add_middleware(TracingMiddleware)
+# Request ids, user and route on every log line, plus JSON access logs
+app.add_middleware(RequestContextMiddleware)
+# Opt-in: admins can profile a request with the X-Profile: 1 header
+if os.getenv("PROFILING_ENABLED", "false").lower() == "true":
+    app.add_middleware(ProfilingMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 # Exception handlers
 @app.exception_handler(404)
@@ -103,6 +193,9 @@ async def internal_server_error_handler(request, exc):
 # Include routers
 app.include_router(auth_router.router)
 app.include_router(filesystem_router.router)
+app.include_router(admin_router.router)
+app.include_router(spaces_router.router)
+app.include_router(jobs_router.router)
 
 
 # Root endpoints
@@ -116,7 +209,11 @@ async def root():
         "redoc": "/redoc",
         "endpoints": {
             "authentication": "/api/v1/auth",
-            "filesystem": "/api/v1/filesystem"
+            "filesystem": "/api/v1/filesystem",
+            "spaces": "/api/v1/spaces",
+            "jobs": "/api/v1/jobs",
+            "file_changes": "WS /api/v1/filesystem/ws",
+            "file_events": "GET /api/v1/filesystem/events"
         },
         "features": [
             "User Authentication & Authorization",
@@ -124,7 +221,8 @@ async def root():
             "File Sharing & Permissions",
             "Search Functionality",
             "Public File Access",
-            "Hierarchical File Tree"
+            "Hierarchical File Tree",
+            "Collaborative Code Spaces"
         ]
     }
 
@@ -153,6 +251,16 @@ async def health_check():
     }
 
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness probe: 503 until the warm-up has finished, and again while shutting down"""
+    content = {
+        "status": "ready" if getattr(app.state, "ready", False) else "not ready",
+        "warmup": getattr(app.state, "warmup", {}),
+    }
+    return JSONResponse(status_code=200 if content["status"] == "ready" else 503, content=content)
+
+
 @app.get("/api/v1", tags=["API Info"])
 async def api_info():
     """API version information"""
@@ -173,27 +281,31 @@ async def api_info():
                 "user_files": "GET /api/v1/filesystem/user/files/",
                 "search": "GET /api/v1/filesystem/search",
                 "share": "POST /api/v1/filesystem/files/{file_id}/share",
-                "public_files": "GET /api/v1/filesystem/files/public"
+                "public_files": "GET /api/v1/filesystem/files/public",
+                "watch": "WS /api/v1/filesystem/ws",
+                "events": "GET /api/v1/filesystem/events",
+                "share_tree": "POST /api/v1/filesystem/files/{file_id}/share-tree",
+                "delete_tree": "DELETE /api/v1/filesystem/files/{file_id}/tree"
+            },
+            "spaces": {
+                "list": "GET /api/v1/spaces",
+                "create": "POST /api/v1/spaces",
+                "join": "POST /api/v1/spaces/join",
+                "get": "GET /api/v1/spaces/{space_id}",
+                "leave": "DELETE /api/v1/spaces/{space_id}",
+                "edit": "POST /api/v1/spaces/{space_id}/operations"
+            },
+            "jobs": {
+                "get": "GET /api/v1/jobs/{job_id}",
+                "cancel": "POST /api/v1/jobs/{job_id}/cancel"
             }
         }
     }
 
 
 if __name__ == "__main__":
-    host = os.getenv("HOST", "0.0.0.0")
-    port = int(os.getenv("PORT", 8000))
+    # Development server with reload; production runs serve.py (workers, graceful drain)
+    import serve
+
     reload = os.getenv("RELOAD", "true").lower() == "true"
-    log_level = os.getenv("LOG_LEVEL", "info")
-
-    print(f"Starting Sensei on {host}:{port}")
-    print(f"API Documentation: http://{host}:{port}/docs")
-    print(f"ReDoc Documentation: http://{host}:{port}/redoc")
-
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=reload,
-        log_level=log_level,
-        access_log=True
-    )
+    serve.main(["--reload"] if reload else [])
@@ -0,0 +1,101 @@
+"""Production entry point: several uvicorn workers behind one port.
+
+Runs from the backend directory:
+
+    python serve.py                      # WEB_CONCURRENCY workers (default: one per core)
+    python serve.py --workers 4 --port 10000
+    python serve.py --reload             # development, single process
+
+Every option also reads an environment variable (see --help), so render.yaml
+only needs to set the environment. Each worker runs the app's lifespan,
+which warms the worker up in the background; point the load balancer's
+health check at /ready, not /health. On SIGTERM uvicorn stops accepting
+connections, closes idle keep-alive ones and gives in-flight requests
+--graceful-timeout seconds to finish before the lifespan shutdown runs.
+
+Collaborative spaces edit in memory, in whichever worker loaded the
+space: run one worker unless each space's requests reach the same one.
+"""
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+
+def _env_int(name: str, default: int | None) -> int | None:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _fastest(implementation: str) -> str:
+    # uvloop and httptools come with uvicorn[standard]; fall back to asyncio/h11 without them
+    return implementation if importlib.util.find_spec(implementation) else "auto"
+
+
+def _prepare_metrics_dir() -> None:
+    """Give the workers a fresh shared directory for Prometheus metrics, see app.monitoring.metrics"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Files left by a previous run would be summed into this one's metrics
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="sensei-metrics-")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=_env_int("PORT", 8000))
+    parser.add_argument("--workers", type=int, default=_env_int("WEB_CONCURRENCY", os.cpu_count() or 1),
+                        help="worker processes (env WEB_CONCURRENCY, default: CPU count)")
+    parser.add_argument("--keep-alive", type=int, default=_env_int("KEEP_ALIVE_TIMEOUT", 75),
+                        help="seconds an idle connection is kept open; keep it above the load "
+                             "balancer's idle timeout (env KEEP_ALIVE_TIMEOUT, default: 75)")
+    parser.add_argument("--graceful-timeout", type=int, default=_env_int("GRACEFUL_TIMEOUT", 30),
+                        help="seconds in-flight requests get to finish on shutdown "
+                             "(env GRACEFUL_TIMEOUT, default: 30)")
+    parser.add_argument("--backlog", type=int, default=_env_int("BACKLOG", 2048))
+    parser.add_argument("--limit-concurrency", type=int, default=_env_int("LIMIT_CONCURRENCY", None),
+                        help="per worker; beyond it new requests get a 503 (env LIMIT_CONCURRENCY)")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--reload", action="store_true", help="development: single process, reload on change")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    import uvicorn
+
+    args = parse_args(argv)
+    workers = 1 if args.reload else max(1, args.workers)
+    if workers > 1:
+        _prepare_metrics_dir()
+        # Each worker has its own bcrypt pool; share the cores instead of multiplying them
+        os.environ.setdefault("BCRYPT_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    print(f"Starting Sensei on {args.host}:{args.port} with {workers} worker(s)", file=sys.stderr)
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=args.reload,
+        loop=_fastest("uvloop"),
+        http=_fastest("httptools"),
+        lifespan="on",
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        backlog=args.backlog,
+        limit_concurrency=args.limit_concurrency,
+        # Trusted proxies come from FORWARDED_ALLOW_IPS, read by uvicorn itself
+        proxy_headers=True,
+        log_level=args.log_level,
+        # RequestContextMiddleware writes the access log
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
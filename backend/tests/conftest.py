@@ -45,6 +45,14 @@ def mock_firebase_service():
     return mock_service
 
 
+@pytest.fixture
+def memory_db():
+    """In-memory Firestore with real query, batch and transaction semantics"""
+    from app.monitoring.firestore import InstrumentedClient
+    from app.services.memory_firestore import MemoryFirestore
+    return InstrumentedClient(MemoryFirestore())
+
+
 @pytest.fixture
 def mock_auth_service():
     """Mock authentication service for testing"""
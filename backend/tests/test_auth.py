@@ -1,5 +1,7 @@
+import asyncio
+
 import pytest
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi import status
 
 
@@ -138,3 +140,208 @@ class TestAuthService:
 
         assert isinstance(token, str)
         assert len(token) > 0
+
+    @pytest.mark.asyncio
+    async def test_get_current_user_is_cached(self, sample_user):
+        """Repeated requests with the same token resolve the user once"""
+        from app.services.auth_service import AuthService
+        from app.models.users import UserSecure
+        from app.services.shared_cache import SharedCache
+
+        auth_service = AuthService()
+        SharedCache._instance = None
+        auth_service._token_cache.clear()
+        user = UserSecure.model_validate({**sample_user, "password": "hash"})
+        auth_service.get_user_by_username = AsyncMock(return_value=user)
+
+        token = auth_service._create_access_token(
+            {"sub": "testuser", "email": "test@example.com", "uid": user.id})
+
+        first = await auth_service.get_current_user(token)
+        second = await auth_service.get_current_user(token)
+
+        assert first is second
+        auth_service.get_user_by_username.assert_awaited_once_with("testuser")
+
+        await auth_service.invalidate_user("testuser")
+        await auth_service.get_current_user(token)
+        assert auth_service.get_user_by_username.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_verify_token_claims_only(self):
+        """Claims-only verification returns the token subject and rejects bad tokens"""
+        from app.services.auth_service import AuthService
+
+        auth_service = AuthService()
+        token = auth_service._create_access_token(
+            {"sub": "testuser", "email": "test@example.com", "uid": "test-user-id"})
+
+        claims = auth_service.verify_token(token)
+        assert claims.username == "testuser"
+        assert claims.id == "test-user-id"
+        assert auth_service.verify_token(token + "tampered") is None
+
+    @pytest.mark.asyncio
+    async def test_password_hasher_rejects_when_queue_full(self):
+        """The bcrypt pool sheds load instead of queueing without bound"""
+        import asyncio
+        from app.services.password_hasher import PasswordHasher, HasherOverloaded
+
+        hasher = PasswordHasher(rounds=4, max_workers=1, max_queue=1)
+        hashed = await hasher.hash("testpassword123")
+        assert await hasher.verify("testpassword123", hashed)
+        assert not hasher.needs_rehash(hashed)
+        assert PasswordHasher(rounds=5).needs_rehash(hashed)
+
+        results = await asyncio.gather(
+            *(hasher.verify("testpassword123", hashed) for _ in range(3)),
+            return_exceptions=True)
+        overloaded = [r for r in results if isinstance(r, HasherOverloaded)]
+        assert len(overloaded) == 1
+        assert overloaded[0].retry_after >= 1
+        hasher.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_create_user_reserves_username_and_email(self):
+        """Registration creates the user and both reservations in one transaction"""
+        from app.services.auth_service import AuthService
+        from app.models.users import UserCreate
+
+        mock_db = MagicMock()
+        transaction = mock_db.transaction.return_value
+
+        async def no_reservations(refs, transaction=None):
+            for ref in refs:
+                yield MagicMock(exists=False, reference=ref)
+
+        mock_db.get_all = no_reservations
+
+        with patch('app.services.auth_service.FirebaseService') as mock_firebase, \
+                patch('app.services.auth_service.async_transactional', lambda fn: fn):
+            mock_firebase.return_value.db = mock_db
+            auth_service = AuthService()
+            auth_service.hash_password = AsyncMock(return_value="hashed")
+            auth_service._reservations_backfilled = AsyncMock(return_value=True)
+
+            user = await auth_service.create_user(UserCreate(
+                username="testuser", email="Test@example.com", password="testpassword123"))
+
+        assert user.username == "testuser"
+        assert transaction.create.call_count == 3
+        mock_db.collection.assert_any_call('usernames')
+        mock_db.collection.assert_any_call('emails')
+        mock_db.collection.return_value.document.assert_any_call("test%40example.com")
+
+    @pytest.mark.asyncio
+    async def test_create_user_duplicate_reservation(self):
+        """An existing reservation aborts registration without writing"""
+        from app.services.auth_service import AuthService
+        from app.models.users import UserCreate
+
+        mock_db = MagicMock()
+        transaction = mock_db.transaction.return_value
+
+        async def username_taken(refs, transaction=None):
+            yield MagicMock(exists=True, reference=refs[0])
+            yield MagicMock(exists=False, reference=refs[1])
+
+        mock_db.get_all = username_taken
+        username_ref = MagicMock(path="usernames/testuser")
+        email_ref = MagicMock(path="emails/test%40example.com")
+
+        with patch('app.services.auth_service.FirebaseService') as mock_firebase, \
+                patch('app.services.auth_service.async_transactional', lambda fn: fn):
+            mock_firebase.return_value.db = mock_db
+            auth_service = AuthService()
+            auth_service.hash_password = AsyncMock(return_value="hashed")
+            auth_service._reservations_backfilled = AsyncMock(return_value=True)
+            auth_service._username_ref = MagicMock(return_value=username_ref)
+            auth_service._email_ref = MagicMock(return_value=email_ref)
+
+            with pytest.raises(ValueError, match="Username already exists"):
+                await auth_service.create_user(UserCreate(
+                    username="testuser", email="test@example.com", password="testpassword123"))
+
+        transaction.create.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_list_users_projects_out_password(self, sample_user):
+        """User listing selects only public fields and returns a next-page cursor"""
+        from app.services.auth_service import AuthService
+
+        mock_db = MagicMock()
+        docs = []
+        for name in ("alice", "bob"):
+            doc = MagicMock()
+            doc.to_dict.return_value = {
+                **sample_user, "id": f"{name}-id", "username": name}
+            docs.append(doc)
+
+        async def stream():
+            for doc in docs:
+                yield doc
+
+        query = mock_db.collection.return_value.select.return_value.order_by.return_value
+        query.limit.return_value.stream.return_value = stream()
+
+        with patch('app.services.auth_service.FirebaseService') as mock_firebase:
+            mock_firebase.return_value.db = mock_db
+            users, next_cursor = await AuthService().list_users(limit=2)
+
+        selected = mock_db.collection.return_value.select.call_args.args[0]
+        assert "password" not in selected
+        assert [u.username for u in users] == ["alice", "bob"]
+        assert next_cursor == "bob"
+
+    @pytest.mark.asyncio
+    async def test_backfill_reservations_reports_duplicates(self, memory_db):
+        """Existing accounts get reservations; a duplicate email is reported, not taken over"""
+        from app.services.auth_service import AuthService
+
+        auth_service = AuthService(memory_db)
+        users = memory_db.collection('users')
+        await users.document("a-id").set({"username": "ann", "email": "same@example.com"})
+        await users.document("b-id").set({"username": "ben", "email": "Same@example.com"})
+
+        result = await auth_service.backfill_reservations()
+        assert result['written'] == 3
+        assert [(c['field'], c['reserved_by']) for c in result['conflicts']] == [("email", "a-id")]
+        reserved = await auth_service._email_ref("same@example.com").get()
+        assert reserved.get('user_id') == "a-id"
+
+        # Idempotent
+        assert await auth_service.backfill_reservations() == {'written': 0, 'conflicts': result['conflicts']}
+
+    @pytest.mark.asyncio
+    async def test_unreserved_accounts_block_registration_until_backfilled(self, memory_db, monkeypatch):
+        """Until the migration succeeds, registration also looks for accounts without reservations"""
+        from app.services.auth_service import AuthService
+        from app.services.jobs import JobRunner
+        from app.models.users import UserCreate
+
+        monkeypatch.setattr(AuthService, "_reservations_complete", False)
+        auth_service = AuthService(memory_db)
+        auth_service.hash_password = AsyncMock(return_value="hashed")
+        await memory_db.collection('users').document("old-id").set({"username": "old", "email": "old@example.com"})
+
+        with pytest.raises(ValueError, match="Username already exists"):
+            await auth_service.create_user(UserCreate(
+                username="old", email="new@example.com", password="testpassword123"))
+
+        runner = JobRunner(memory_db, workers=1)
+        await runner.start()
+        try:
+            job = await runner.submit_once('backfill_reservations', "system")
+            for _ in range(200):
+                if await runner.migration_completed('backfill_reservations'):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await runner.stop()
+        assert (await runner.get(job.id)).status == "succeeded"
+
+        # Now the reservation alone stops the duplicate
+        with pytest.raises(ValueError, match="Username already exists"):
+            await auth_service.create_user(UserCreate(
+                username="old", email="new@example.com", password="testpassword123"))
+        assert AuthService._reservations_complete
@@ -97,3 +97,30 @@ class TestAuthorizationService:
             )
 
             assert result["message"] == "success"
+
+
+class TestCachedPermissionChecks:
+    """Permission checks read the cached file; ACL writes invalidate it"""
+
+    @pytest.mark.asyncio
+    async def test_checks_are_cached_and_invalidated(self, memory_db, sample_file, monkeypatch):
+        from app.services.authorization_service import AuthorizationService
+        from app.services.filesystem import FileSystem
+        from app.services.shared_cache import SharedCache
+        from app.models.models import VirtualFile
+
+        monkeypatch.setattr(SharedCache, "_instance", None)
+        file = VirtualFile.model_validate({**sample_file, "can_view": ["testuser"], "can_edit": ["testuser"]})
+        await FileSystem(memory_db).create_file(file)
+        authz = AuthorizationService(memory_db)
+
+        assert await authz.can_user_view_file("testuser", file)
+        rpcs = memory_db._wrapped.rpcs
+        assert await authz.can_user_view_file("testuser", file)
+        assert await authz.can_user_edit_file("testuser", file)
+        assert memory_db._wrapped.rpcs == rpcs
+
+        await authz.add_user_to_edit_list("otheruser", file)
+        assert await authz.can_user_edit_file("otheruser", file)
+        await authz.remove_user_from_edit_list("otheruser", file)
+        assert not await authz.can_user_edit_file("otheruser", file)
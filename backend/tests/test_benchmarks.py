@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from app.models.models import VirtualFile
+from benchmarks.data import Corpus, make_tree, make_users, share
+
+
+class TestBenchmarkData:
+    """Test the synthetic data the benchmarks run on"""
+
+    @pytest.mark.parametrize("shape", ["deep", "wide"])
+    def test_tree_is_consistent(self, shape):
+        """Every child id points at a document whose parent is the directory listing it"""
+        rng = random.Random(0)
+        documents = make_tree("user0", 2000, shape, Corpus(rng), rng)
+        by_id = {d["id"]: d for d in documents}
+
+        assert len(documents) == 2000
+        assert len(by_id) == 2000
+        for document in documents:
+            VirtualFile.model_validate(document)
+            if document["parent"] is not None:
+                assert document["id"] in by_id[document["parent"]]["children"]
+            for child_id in document["children"]:
+                assert by_id[child_id]["parent"] == document["id"]
+
+    def test_shapes_differ_in_depth(self):
+        """'deep' trees nest far more levels than 'wide' ones"""
+        def depth(documents):
+            by_id = {d["id"]: d for d in documents}
+            deepest = 0
+            for document in documents:
+                level = 0
+                while document["parent"] is not None:
+                    document = by_id[document["parent"]]
+                    level += 1
+                deepest = max(deepest, level)
+            return deepest
+
+        rng = random.Random(0)
+        corpus = Corpus(rng)
+        assert depth(make_tree("user0", 2000, "deep", corpus, rng)) > 50
+        assert depth(make_tree("user0", 2000, "wide", corpus, rng)) <= 4
+
+    def test_generation_is_deterministic(self):
+        """The same seed yields the same tree, so runs are comparable"""
+        def generate():
+            rng = random.Random(42)
+            documents = make_tree("user0", 500, "deep", Corpus(rng), rng)
+            share(documents, make_users(10), rng)
+            return documents
+
+        assert generate() == generate()
+
+    def test_share_never_duplicates_owner(self):
+        """Sharing adds other users only"""
+        rng = random.Random(1)
+        documents = make_tree("user0", 1000, "wide", Corpus(rng), rng)
+        share(documents, make_users(5), rng, share_ratio=1.0)
+
+        for document in documents:
+            assert document["can_view"].count("user0") == 1
+            assert set(document["can_edit"]) <= set(document["can_view"])
+
+
+class TestLoadReport:
+    """Test the load harness report and SLO checks"""
+
+    def test_percentiles_use_nearest_rank(self):
+        from benchmarks.load import _percentile
+
+        samples = [i / 1000 for i in range(1, 101)]
+        assert _percentile(samples, 50) == 0.050
+        assert _percentile(samples, 95) == 0.095
+        assert _percentile(samples, 99) == 0.099
+        assert _percentile([0.2], 99) == 0.2
+
+    def test_summarize_flags_slo_violations(self):
+        """Actions are checked against their own SLO, falling back to '*'"""
+        from benchmarks.load import Recorder, summarize
+
+        recorder = Recorder()
+        recorder.recording = True
+        for _ in range(99):
+            recorder.record("open_file", 0.010, 200, True)
+            recorder.record("login", 0.400, 200, True)
+        recorder.record("open_file", 0.010, 500, False)
+        recorder.record("login", 0.400, 200, True)
+
+        report = summarize(recorder, elapsed=10.0, slos={
+            "*": {"p95_ms": 100, "error_rate": 0.005},
+            "login": {"p95_ms": 1000},
+        })
+
+        assert report["open_file"]["error_rate"] == 0.01
+        assert report["open_file"]["slo_violations"] == ["error_rate 0.01 > 0.005"]
+        assert report["login"]["slo_violations"] == []
+        assert report["all"]["requests"] == 200
+        assert report["all"]["rps"] == 20.0
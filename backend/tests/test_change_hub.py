@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.change_hub import ChangeHub, FileSubscription
+from app.services.firebase_service import FirebaseService
+from app.services.memory_firestore import MemoryFirestore
+
+
+async def _settle():
+    # Snapshots reach subscribers through loop callbacks
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def _file(file_id: str, parent: str | None = None, directory: bool = False, can_view=("alice",), **fields) -> dict:
+    return {"id": file_id, "root": "alice", "directory": directory, "name": file_id, "parent": parent,
+            "content": None if directory else "", "can_view": list(can_view), "can_edit": ["alice"], **fields}
+
+
+async def _seed(db, *files: dict) -> None:
+    for file in files:
+        await db.collection('files').document(file["id"]).set(file)
+
+
+class TestChangeHub:
+    """Test the shared snapshot listeners"""
+
+    @pytest.mark.asyncio
+    async def test_one_listener_per_target(self):
+        """Subscribers of one file share its listener, which closes with the last of them"""
+        db = MemoryFirestore()
+        hub = ChangeHub(db)
+        await _seed(db, _file("a"))
+        first, second = [], []
+
+        def on_first(target, changes, initial):
+            first.append((changes[0][1]["content"], initial))
+
+        def on_second(target, changes, initial):
+            second.append((changes[0][1]["content"], initial))
+
+        hub.watch(('file', 'a'), on_first)
+        await _settle()
+        hub.watch(('file', 'a'), on_second)
+        await _settle()
+        await db.collection('files').document('a').update({"content": "v2"})
+        await _settle()
+
+        assert len(hub) == 1 and len(db._watches) == 1
+        assert first == [("", True), ("v2", False)]
+        # The late subscriber starts from the listener's last snapshot
+        assert second == [("", True), ("v2", False)]
+
+        hub.unwatch(('file', 'a'), on_first)
+        assert len(db._watches) == 1
+        hub.unwatch(('file', 'a'), on_second)
+        assert len(hub) == 0 and db._watches == []
+
+    @pytest.mark.asyncio
+    async def test_listener_limit(self):
+        from app.services.change_hub import TooManyListeners
+
+        hub = ChangeHub(MemoryFirestore(), max_listeners=1)
+        hub.watch(('file', 'a'), lambda *args: None)
+        with pytest.raises(TooManyListeners):
+            hub.watch(('file', 'b'), lambda *args: None)
+
+
+class TestFileSubscription:
+    """Test the events sent for a file or subtree subscription"""
+
+    @pytest.mark.asyncio
+    async def test_subtree_events(self):
+        db = MemoryFirestore()
+        hub = ChangeHub(db)
+        await _seed(db, _file("root", directory=True), _file("f", "root"),
+                    _file("sub", "root", directory=True), _file("g", "sub"),
+                    _file("secret", "root", can_view=("bob",)))
+        events = []
+        subscription = FileSubscription(hub, "alice", "root", events.append, subtree=True)
+        subscription.start()
+        await _settle()
+
+        initial = {(e["type"], e.get("parent"), (e.get("file") or {}).get("id")) for e in events}
+        assert initial == {("updated", None, "root"), ("added", "root", "f"),
+                           ("added", "root", "sub"), ("added", "sub", "g")}
+        assert all(e["initial"] and e["subscription"] == "root" for e in events)
+        # root, plus the children of root and of sub
+        assert len(hub) == 3
+
+        events.clear()
+        files = db.collection('files')
+        await _seed(db, _file("h", "sub"))
+        await files.document('f').update({"content": "edited"})
+        await files.document('g').update({"parent": "elsewhere"})
+        await files.document('secret').update({"content": "still hidden"})
+        await _settle()
+        assert [(e["type"], e.get("parent"), e.get("file_id") or e["file"]["id"]) for e in events] == [
+            ("added", "sub", "h"), ("updated", "root", "f"), ("removed", "sub", "g")]
+
+        events.clear()
+        await files.document('sub').delete()
+        await _settle()
+        assert [(e["type"], e.get("file_id")) for e in events] == [("removed", "sub")]
+        assert len(hub) == 2
+
+        events.clear()
+        await files.document('root').delete()
+        await _settle()
+        assert [e["type"] for e in events] == ["deleted"]
+        assert not subscription.active and len(hub) == 0
+
+    @pytest.mark.asyncio
+    async def test_revoked_access_ends_subscription(self):
+        db = MemoryFirestore()
+        hub = ChangeHub(db)
+        await _seed(db, _file("a", can_view=("alice", "bob")))
+        events = []
+        subscription = FileSubscription(hub, "bob", "a", events.append)
+        subscription.start()
+        await _settle()
+
+        await db.collection('files').document('a').update({"can_view": ["alice"]})
+        await _settle()
+
+        assert [e["type"] for e in events] == ["updated", "error"]
+        assert not subscription.active and len(hub) == 0
+
+
+class TestWatchEndpoint:
+    """Test the WebSocket endpoint end to end"""
+
+    def test_push_on_update(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from starlette.websockets import WebSocketDisconnect
+        from app.services.shared_cache import SharedCache
+        from main import app
+
+        monkeypatch.setenv("FIRESTORE_BACKEND", "memory")
+        monkeypatch.setenv("LOOP_MONITOR_ENABLED", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setattr(FirebaseService, "_db", None)
+        monkeypatch.setattr(FirebaseService, "_instrumented", None)
+        monkeypatch.setattr(SharedCache, "_instance", None)
+        monkeypatch.setattr(ChangeHub, "_instance", None)
+
+        with TestClient(app) as client:
+            client.post("/api/v1/auth/register", json={
+                "username": "wsuser", "email": "wsuser@example.com", "password": "password123"})
+            token = client.post("/api/v1/auth/login", json={
+                "email": "wsuser@example.com", "password": "password123"}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            file = client.post("/api/v1/filesystem/files/create", headers=headers, json={
+                "id": "ws-file", "directory": False, "name": "a.py", "content": "v1"}).json()
+
+            with pytest.raises(WebSocketDisconnect):
+                with client.websocket_connect("/api/v1/filesystem/ws") as ws:
+                    ws.receive_json()
+
+            with client.websocket_connect(f"/api/v1/filesystem/ws?token={token}") as ws:
+                ws.send_json({"action": "subscribe", "file_id": file["id"]})
+                assert ws.receive_json()["type"] == "subscribed"
+                event = ws.receive_json()
+                assert (event["type"], event["file"]["content"], event["initial"]) == ("updated", "v1", True)
+
+                client.put(f"/api/v1/filesystem/files/{file['id']}", headers=headers, json={"content": "v2"})
+                event = ws.receive_json()
+                assert (event["type"], event["file"]["content"], event["initial"]) == ("updated", "v2", False)
+
+                ws.send_json({"action": "subscribe", "file_id": "missing"})
+                assert ws.receive_json()["detail"] == "File not found"
+
+                other = client.post("/api/v1/filesystem/files/create", headers=headers, json={
+                    "id": "ws-other", "directory": False, "name": "b.py", "content": ""}).json()
+                hub = ChangeHub.initialize()
+                hub.max_listeners = len(hub)
+                ws.send_json({"action": "subscribe", "file_id": other["id"]})
+                event = ws.receive_json()
+                assert (event["type"], event["subscription"]) == ("error", other["id"])
+                assert "change listeners" in event["detail"]
+                hub.max_listeners = 1000
+                ws.send_json({"action": "unsubscribe", "file_id": file["id"]})
+                assert ws.receive_json()["type"] == "unsubscribed"
+
+            # The connection's listeners were closed with it
+            for _ in range(50):
+                if len(ChangeHub.initialize()) == 0:
+                    break
+                time.sleep(0.01)
+            assert len(ChangeHub.initialize()) == 0
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from app.models.models import VirtualFile
+from app.services.file_events import FileEvents
+from app.services.filesystem import FileSystem
+from app.services.shared_cache import MemoryBackend
+
+
+def _file(file_id: str, **fields) -> VirtualFile:
+    return VirtualFile(id=file_id, root="alice", directory=False, name=f"{file_id}.py", **fields)
+
+
+class TestFileEvents:
+    """Test the tree and share event bus"""
+
+    @pytest.mark.asyncio
+    async def test_delivers_only_to_recipients(self):
+        events = FileEvents()
+        alice, bob = events.subscribe("alice"), events.subscribe("bob")
+
+        event = await events.publish('shared', _file("ev-a"), ["alice", "bob"], user="bob", permissions=["view"])
+        await events.publish('created', _file("ev-b"), ["alice"])
+
+        received = await alice.get()
+        assert received == {k: v for k, v in event.items() if k != 'users'}
+        assert received['file']['id'] == "ev-a" and received['permissions'] == ["view"]
+        assert (await alice.get())['type'] == 'created'
+        assert (await bob.get())['file']['id'] == "ev-a"
+        assert bob.queue.empty()
+
+        events.unsubscribe(bob)
+        await events.publish('deleted', _file("ev-a"), ["bob"])
+        assert bob.queue.empty()
+        with pytest.raises(ValueError):
+            await events.publish('renamed', _file("ev-a"), ["alice"])
+
+    @pytest.mark.asyncio
+    async def test_resumes_after_last_event_id(self):
+        events = FileEvents(replay=3)
+        ids = [(await events.publish('created', _file(f"ev-{i}"), ["alice"]))['id'] for i in range(4)]
+
+        resumed = events.subscribe("alice", last_event_id=ids[1])
+        assert [(await resumed.get())['id'] for _ in range(2)] == ids[2:]
+        assert resumed.queue.empty()
+
+        # Fell out of the replay window
+        expired = events.subscribe("alice", last_event_id=ids[0])
+        assert await expired.get() == {'type': 'reset'}
+
+    @pytest.mark.asyncio
+    async def test_overflow_resets_subscriber(self):
+        events = FileEvents(queue_size=2)
+        slow = events.subscribe("alice")
+        for i in range(3):
+            await events.publish('created', _file(f"ev-{i}"), ["alice"])
+        assert await slow.get() == {'type': 'reset'}
+        assert slow.queue.empty()
+
+    @pytest.mark.asyncio
+    async def test_fans_out_through_backend(self):
+        backend = MemoryBackend()
+        # Two workers sharing a backend
+        first, second = FileEvents(backend, 'test:events'), FileEvents(backend, 'test:events')
+        await first.start()
+        await second.start()
+        await asyncio.sleep(0)
+        try:
+            subscription = second.subscribe("alice")
+            event = await first.publish('moved', _file("ev-m", parent="dir-b"), ["alice"],
+                                        **{'from': "dir-a", 'to': "dir-b"})
+            received = await asyncio.wait_for(subscription.get(), 1)
+            assert (received['id'], received['from'], received['to']) == (event['id'], "dir-a", "dir-b")
+
+            second._on_message(None)
+            assert await subscription.get() == {'type': 'reset'}
+        finally:
+            await first.stop()
+            await second.stop()
+
+    @pytest.mark.asyncio
+    async def test_filesystem_mutations_publish(self, memory_db):
+        events = FileEvents()
+        fs = FileSystem(memory_db, events=events)
+        alice = events.subscribe("alice")
+
+        for folder in ("ev-dir-a", "ev-dir-b"):
+            await fs.create_file(VirtualFile(id=folder, root="alice", directory=True, name=folder))
+        await fs.create_file(_file("ev-file", parent="ev-dir-a", content=""))
+        assert await fs.move_file("ev-file", "ev-dir-b")
+        await fs.delete_file("ev-file")
+
+        received = [await alice.get() for _ in range(5)]
+        assert [(e['type'], e['file']['id']) for e in received] == [
+            ('created', "ev-dir-a"), ('created', "ev-dir-b"), ('created', "ev-file"),
+            ('moved', "ev-file"), ('deleted', "ev-file")]
+        moved = received[3]
+        assert (moved['from'], moved['to'], moved['file']['parent']) == ("ev-dir-a", "ev-dir-b", "ev-dir-b")
+
+
+class TestFileEventsEndpoint:
+    """Test the SSE endpoint"""
+
+    def test_streams_events_after_last_event_id(self, client, monkeypatch):
+        from app.routers import filesystem_router
+
+        events = FileEvents()
+        monkeypatch.setattr(FileEvents, '_instance', events)
+        monkeypatch.setattr(filesystem_router, 'SSE_MAX_AGE', 0.2)
+        monkeypatch.setattr(filesystem_router, 'SSE_HEARTBEAT', 0.05)
+        seen = asyncio.run(events.publish('created', _file("sse-a"), ["testuser"]))
+        missed = asyncio.run(events.publish('shared', _file("sse-b"), ["testuser"], user="testuser",
+                                            permissions=["view"]))
+
+        token = filesystem_router.auth_service._create_access_token(
+            {"sub": "testuser", "email": "test@example.com"})
+        response = client.get('/api/v1/filesystem/events', params={"token": token},
+                              headers={"Last-Event-ID": seen['id']})
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/event-stream')
+        assert response.text.startswith("retry: ")
+        assert f"id: {missed['id']}\nevent: shared\ndata: " in response.text
+        assert seen['id'] not in response.text
+        assert ": keep-alive" in response.text
+        assert events._subscribers == {}
+
+    def test_requires_token(self, client):
+        assert client.get('/api/v1/filesystem/events').status_code == 401
+        assert client.get('/api/v1/filesystem/events', params={"token": "bad"}).status_code == 401
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi import status
 
 
@@ -198,3 +198,249 @@ class TestFilesystemService:
             results = await fs.search_files("test", "testuser")
 
             assert len(results) >= 0  # Should handle the search
+
+    @pytest.mark.asyncio
+    async def test_share_file_writes_inbox_in_same_batch(self, sample_file):
+        """Sharing updates the file ACL and the target's inbox in one batch"""
+        from app.services.filesystem import FileSystem
+        from app.models.models import VirtualFile
+
+        mock_db = MagicMock()
+        batch = mock_db.batch.return_value
+        batch.commit = AsyncMock()
+
+        with patch('app.services.filesystem.FirebaseService') as mock_firebase, \
+                patch('app.services.auth_service.AuthService') as mock_auth_cls:
+            mock_firebase.return_value.db = mock_db
+            target = MagicMock(id="target-user-id")
+            mock_auth_cls.return_value.get_user_by_username = AsyncMock(
+                return_value=target)
+
+            fs = FileSystem()
+            fs.get_file = AsyncMock(
+                return_value=VirtualFile.model_validate(sample_file))
+
+            result = await fs.share_file_with_user(
+                "testuser", "test-file-id", "targetuser", ["edit"])
+
+            assert result is True
+            batch.update.assert_called_once()
+            batch.set.assert_called_once()
+            batch.commit.assert_awaited_once()
+            inbox_entry = batch.set.call_args.args[1]
+            assert inbox_entry["id"] == "test-file-id"
+            assert inbox_entry["root"] == "testuser"
+            mock_db.collection.assert_any_call('users')
+            mock_db.collection.return_value.document.assert_any_call(
+                "target-user-id")
+
+    @pytest.mark.asyncio
+    async def test_get_shared_files_reads_inbox(self):
+        """Shared files are listed from the inbox, newest first"""
+        from app.services.filesystem import FileSystem
+
+        mock_db = MagicMock()
+        entry = MagicMock()
+        entry.id = "test-file-id"
+        entry.to_dict.return_value = {
+            "name": "test.py", "root": "owner", "directory": False,
+            "permissions": ["view"]}
+
+        async def stream():
+            yield entry
+
+        inbox = mock_db.collection.return_value.document.return_value.collection.return_value
+        inbox.order_by.return_value.limit.return_value.stream.return_value = stream()
+
+        with patch('app.services.filesystem.FirebaseService') as mock_firebase:
+            mock_firebase.return_value.db = mock_db
+            fs = FileSystem()
+            results = await fs.get_shared_files("user-id", limit=10)
+
+        assert [f.id for f in results] == ["test-file-id"]
+        assert results[0].root == "owner"
+        inbox.order_by.return_value.limit.assert_called_once_with(10)
+
+    @pytest.mark.asyncio
+    async def test_shares_older_than_the_inbox_are_backfilled(self, memory_db):
+        """A user's first "shared with me" read copies shares recorded only on the files"""
+        from app.models.models import VirtualFile
+        from app.services.filesystem import FileSystem
+
+        fs = FileSystem(memory_db)
+        await memory_db.collection('users').document("old-id").set({"username": "old-user"})
+        await fs.create_file(VirtualFile(id="old-share", root="owner", directory=False, name="a.py",
+                                         content="", can_view=["old-user"]))
+
+        assert await fs.get_shared_files("old-id") == []
+        results = await fs.get_shared_files("old-id", username="old-user")
+        assert [f.id for f in results] == ["old-share"]
+        stored = await memory_db.collection('users').document("old-id").get()
+        assert stored.get('shared_inbox_backfilled') is True
+
+        # Search reads the inbox too, so it backfills as well
+        await memory_db.collection('users').document("new-id").set({"username": "new-user"})
+        await fs.create_file(VirtualFile(id="new-share", root="owner", directory=False, name="b.py",
+                                         content="", can_view=["new-user"]))
+        found = await fs.search_files("b.py", "new-user", include_public=False, user_id="new-id")
+        assert [f.id for f in found] == ["new-share"]
+
+        # Once per user
+        FileSystem._inbox_ready.clear()
+        rpcs = memory_db._wrapped.rpcs
+        await fs.get_shared_files("old-id", username="old-user")
+        assert memory_db._wrapped.rpcs == rpcs + 2
+
+    @pytest.mark.asyncio
+    async def test_delete_clears_inboxes_in_batches(self, memory_db):
+        """Inbox entries are found through can_view, not a collection-group query"""
+        from datetime import datetime
+        from app.models.models import VirtualFile
+        from app.services.filesystem import FileSystem
+
+        fs = FileSystem(memory_db)
+        usernames = [f"user{i}" for i in range(520)]
+        for username in usernames:
+            await memory_db.collection('users').document(f"{username}-id").set({
+                "id": f"{username}-id", "username": username, "email": f"{username}@example.com",
+                "role": "user", "password": "hash",
+                "created_at": datetime(2024, 1, 1), "updated_at": datetime(2024, 1, 1)})
+        await fs.create_file(VirtualFile(id="wide", root="owner", directory=False, name="a.py",
+                                         content="", can_view=usernames))
+        for username in usernames:
+            await fs._shared_inbox(f"{username}-id").document("wide").set({"id": "wide"})
+
+        def no_index(*args, **kwargs):
+            raise AssertionError("needs a collection-group index")
+        memory_db.collection_group = no_index
+
+        await fs.delete_file("wide")
+        assert await fs.get_file("wide") is None
+        for username in ("user0", "user519"):
+            assert not (await fs._shared_inbox(f"{username}-id").document("wide").get()).exists
+
+
+class TestTrustedJSONResponse:
+    """Test the orjson response used for file listings"""
+
+    def test_matches_response_model_output(self, sample_file):
+        """Rendering models directly gives the same JSON as FastAPI's response_model path"""
+        import json
+        from datetime import timezone
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+        from pydantic import TypeAdapter
+        from app.models.models import VirtualFile
+        from app.routers.responses import TrustedJSONResponse
+
+        # Firestore hands back timestamps as a datetime subclass
+        updated = DatetimeWithNanoseconds(2024, 5, 1, 8, 30, 0, 250000, tzinfo=timezone.utc)
+        files = [VirtualFile.model_validate(sample_file),
+                 VirtualFile.model_validate({**sample_file, "id": "other", "updated_at": updated})]
+
+        response = TrustedJSONResponse(files)
+
+        expected = TypeAdapter(list[VirtualFile]).dump_python(files, mode="json")
+        assert json.loads(response.body) == expected
+        assert response.headers["content-type"] == "application/json"
+
+    def test_rejects_unknown_types(self):
+        """Objects orjson can't serialise still raise"""
+        from app.routers.responses import TrustedJSONResponse
+
+        with pytest.raises(TypeError):
+            TrustedJSONResponse({"value": object()})
+
+
+class TestPublicFileCache:
+    """Test the stale-while-revalidate cache in front of public files"""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from app.services.filesystem import FileSystem
+        FileSystem._public_cache.clear()
+        yield
+        FileSystem._public_cache.clear()
+
+    async def _public_file(self, memory_db, sample_file):
+        from app.services.filesystem import FileSystem
+        from app.models.models import VirtualFile
+
+        fs = FileSystem(db=memory_db)
+        await fs.create_file(VirtualFile.model_validate(
+            {**sample_file, "public": True, "can_view": [], "can_edit": []}))
+        return fs
+
+    @pytest.mark.asyncio
+    async def test_concurrent_reads_share_one_load(self, memory_db, sample_file):
+        """A burst of visitors costs one Firestore read"""
+        import asyncio
+
+        fs = await self._public_file(memory_db, sample_file)
+        memory_db._wrapped.latency = 0.01
+        rpcs = memory_db._wrapped.rpcs
+
+        files = await asyncio.gather(*(fs.get_public_file("test-file-id") for _ in range(50)))
+        await fs.get_public_file("test-file-id")
+
+        assert all(f is not None and f.name == "test.py" for f in files)
+        assert memory_db._wrapped.rpcs - rpcs == 1
+
+    @pytest.mark.asyncio
+    async def test_writes_invalidate(self, memory_db, sample_file):
+        fs = await self._public_file(memory_db, sample_file)
+
+        assert [f.id for f in await fs.get_public_files()] == ["test-file-id"]
+        await fs.update_file("test-file-id", "print('updated')")
+        assert (await fs.get_public_file("test-file-id")).content == "print('updated')"
+
+        assert await fs.make_file_private("testuser", "test-file-id")
+        assert await fs.get_public_file("test-file-id") is None
+        assert await fs.get_public_files() == []
+
+        assert await fs.make_file_public("testuser", "test-file-id")
+        assert await fs.get_public_file("test-file-id") is not None
+        await fs.delete_file("test-file-id")
+        assert await fs.get_public_file("test-file-id") is None
+
+    @pytest.mark.asyncio
+    async def test_stale_value_served_while_refreshing(self):
+        import asyncio
+        from app.services.cache import SWRCache
+
+        cache = SWRCache(ttl=0, stale_ttl=60)
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return len(calls)
+
+        assert await cache.get_or_load("key", load) == 1
+        # Past its ttl: the old value comes back at once and a refresh starts
+        assert await cache.get_or_load("key", load) == 1
+        await asyncio.sleep(0.01)
+        assert await cache.get_or_load("key", load) == 2
+
+    @pytest.mark.asyncio
+    async def test_invalidation_discards_load_in_flight(self):
+        """A read that started before a write doesn't put the old value back"""
+        import asyncio
+        from app.services.cache import SWRCache
+
+        cache = SWRCache(ttl=60)
+        release = asyncio.Event()
+
+        async def old():
+            await release.wait()
+            return "old"
+
+        async def new():
+            return "new"
+
+        pending = asyncio.ensure_future(cache.get_or_load("key", old))
+        await asyncio.sleep(0)
+        cache.invalidate("key")
+        release.set()
+
+        assert await pending == "old"
+        assert await cache.get_or_load("key", new) == "new"
@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+
+from app.models.models import VirtualFile
+from app.services.filesystem import FileSystem
+from app.services.jobs import JobQueueFull, JobRunner
+
+
+async def _wait_finished(runner: JobRunner, job_id: str):
+    for _ in range(200):
+        job = await runner.get(job_id)
+        if job.finished:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture(autouse=True)
+def handlers():
+    gate = asyncio.Event()
+
+    async def count(job, n: int):
+        for i in range(1, n + 1):
+            await job.progress(i, n)
+        return {'counted': n}
+
+    async def wait(job):
+        while not gate.is_set():
+            await job.progress(0)
+            await asyncio.sleep(0.01)
+        return None
+
+    async def fail(job):
+        raise RuntimeError("boom")
+
+    for kind, handler in [('test_count', count), ('test_wait', wait), ('test_fail', fail)]:
+        JobRunner.register(kind, handler)
+    yield gate
+    gate.set()
+
+
+@pytest_asyncio.fixture
+async def runner(memory_db):
+    runner = JobRunner(memory_db, workers=1, queue_size=2, progress_interval=0, shutdown_grace=1)
+    await runner.start()
+    yield runner
+    await runner.stop()
+
+
+class TestJobRunner:
+    """Test the background job runner against the in-memory Firestore"""
+
+    @pytest.mark.asyncio
+    async def test_runs_job_with_progress(self, runner):
+        job = await runner.submit('test_count', "alice", n=3)
+        assert (job.status, job.owner, job.params) == ("queued", "alice", {'n': 3})
+
+        job = await _wait_finished(runner, job.id)
+        assert (job.status, job.done, job.total, job.result) == ("succeeded", 3, 3, {'counted': 3})
+        assert job.started_at and job.finished_at
+
+        failed = await _wait_finished(runner, (await runner.submit('test_fail', "alice")).id)
+        assert (failed.status, failed.error) == ("failed", "boom")
+        with pytest.raises(ValueError):
+            await runner.submit('no_such_kind', "alice")
+
+    @pytest.mark.asyncio
+    async def test_bounded_queue_and_cancel(self, runner, handlers):
+        running = await runner.submit('test_wait', "alice")
+        await asyncio.sleep(0.05)
+        assert (await runner.get(running.id)).status == "running"
+
+        # One worker: these wait, and the queue holds two
+        queued = await runner.submit('test_count', "alice", n=1)
+        await runner.submit('test_count', "alice", n=1)
+        with pytest.raises(JobQueueFull):
+            await runner.submit('test_count', "alice", n=1)
+
+        assert (await runner.cancel(queued.id)).status == "cancelled"
+        await runner.cancel(running.id)
+        assert (await _wait_finished(runner, running.id)).status == "cancelled"
+        # The cancelled job is skipped, the next one runs
+        assert (await runner.get(queued.id)).started_at is None
+
+    @pytest.mark.asyncio
+    async def test_queued_jobs_survive_a_restart(self, memory_db):
+        stopped = JobRunner(memory_db, workers=1)
+        job = await stopped.submit('test_count', "alice", n=2)
+
+        restarted = JobRunner(memory_db, workers=1)
+        await restarted.start()
+        try:
+            assert (await _wait_finished(restarted, job.id)).result == {'counted': 2}
+        finally:
+            await restarted.stop()
+
+
+class TestTreeJobs:
+    """Test subtree operations run as jobs"""
+
+    @pytest_asyncio.fixture
+    async def tree(self, memory_db):
+        fs = FileSystem(memory_db)
+        await fs.create_file(VirtualFile(id="tree-root", root="alice", directory=True, name="root"))
+        await fs.create_file(VirtualFile(id="tree-sub", root="alice", directory=True, name="sub", parent="tree-root"))
+        for file_id, parent in [("tree-a", "tree-root"), ("tree-b", "tree-sub")]:
+            await fs.create_file(VirtualFile(id=file_id, root="alice", directory=False, name=f"{file_id}.py",
+                                             parent=parent, content=""))
+        await memory_db.collection('users').document("bob-id").set({
+            "id": "bob-id", "username": "bob", "email": "bob@example.com", "role": "user",
+            "password": "hash", "created_at": datetime(2024, 1, 1), "updated_at": datetime(2024, 1, 1)})
+        return fs
+
+    @pytest.mark.asyncio
+    async def test_share_and_delete_tree(self, runner, tree):
+        job = await runner.submit('share_tree', "alice", owner_id="alice", file_id="tree-sub",
+                                  usernames=["bob", "nobody"], permissions=["edit"])
+        job = await _wait_finished(runner, job.id)
+        assert job.result == {'files': 2, 'shared': 2, 'failed': ["nobody"]}
+        assert (job.done, job.total) == (4, 4)
+        assert "bob" in (await tree.get_file("tree-b")).can_edit
+        assert "bob" not in (await tree.get_file("tree-a")).can_view
+        assert sorted(f.id for f in await tree.get_shared_files("bob-id")) == ["tree-b", "tree-sub"]
+
+        job = await _wait_finished(runner, (await runner.submit('delete_tree', "alice", file_id="tree-root")).id)
+        assert job.result == {'deleted': 4}
+        for file_id in ("tree-root", "tree-sub", "tree-a", "tree-b"):
+            assert await tree.get_file(file_id) is None
+        assert await tree.get_shared_files("bob-id") == []
+
+    @pytest.mark.asyncio
+    async def test_submit_once(self, memory_db):
+        runner = JobRunner(memory_db)
+        job = await runner.submit_once('test_count', "system", n=1)
+        assert job is not None
+        # Another worker, or the next deploy
+        assert await JobRunner(memory_db).submit_once('test_count', "system", n=1) is None
+        marker = await memory_db.collection('migrations').document('test_count').get()
+        assert marker.get('job_id') == job.id
+
+    @pytest.mark.asyncio
+    async def test_failed_migration_is_queued_again(self, runner, memory_db):
+        job = await runner.submit_once('test_fail', "system")
+        assert (await _wait_finished(runner, job.id)).status == "failed"
+        assert not (await memory_db.collection('migrations').document('test_fail').get()).exists
+
+        job = await runner.submit_once('test_count', "system", n=1)
+        await _wait_finished(runner, job.id)
+        assert await runner.migration_completed('test_count')
+        assert await runner.submit_once('test_count', "system", n=1) is None
+
+    @pytest.mark.asyncio
+    async def test_abandoned_jobs_are_requeued(self, memory_db):
+        dead = JobRunner(memory_db)
+        job = await dead.submit('test_count', "alice", n=1)
+        # Claimed by a process that then died
+        assert await dead._claim(job.id) is not None
+
+        restarted = JobRunner(memory_db, workers=1, lease=60)
+        await restarted.start()
+        try:
+            await asyncio.sleep(0.05)
+            assert (await restarted.get(job.id)).status == "running", "still within its lease"
+        finally:
+            await restarted.stop()
+
+        restarted = JobRunner(memory_db, workers=1, lease=0)
+        await restarted.start()
+        try:
+            assert (await _wait_finished(restarted, job.id)).result == {'counted': 1}
+        finally:
+            await restarted.stop()
@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+from unittest.mock import patch, AsyncMock
+from firebase_admin import firestore_async as firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+
+from app.services.memory_firestore import MemoryFirestore
+
+
+async def _seed(db, documents: dict):
+    for doc_id, data in documents.items():
+        await db.collection('files').document(doc_id).set(data)
+
+
+class TestMemoryFirestore:
+    """Test the in-memory Firestore stand-in"""
+
+    @pytest.mark.asyncio
+    async def test_where_operators(self, memory_db):
+        """==, in and array_contains filter like Firestore"""
+        await _seed(memory_db, {
+            "a": {"root": "alice", "can_view": ["alice", "bob"], "size": 1},
+            "b": {"root": "bob", "can_view": ["bob"], "size": 5},
+            "c": {"root": "carol", "can_view": ["carol", "bob"], "size": 3},
+        })
+        files = memory_db.collection('files')
+
+        async def ids(query):
+            return [doc.id async for doc in query.stream()]
+
+        assert await ids(files.where('root', '==', 'alice')) == ["a"]
+        assert await ids(files.where('root', 'in', ['alice', 'carol'])) == ["a", "c"]
+        assert await ids(files.where('can_view', 'array_contains', 'bob')) == ["a", "b", "c"]
+        assert await ids(files.where('size', '>=', 3).where('can_view', 'array_contains', 'bob')) == ["b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_order_limit_and_cursors(self, memory_db):
+        """order_by, limit and start_after page through results"""
+        await _seed(memory_db, {f"f{i}": {"n": i} for i in range(10)})
+        query = memory_db.collection('files').order_by(
+            'n', direction=firestore.Query.DESCENDING)
+
+        first = await query.limit(3).get()
+        assert [doc.get('n') for doc in first] == [9, 8, 7]
+
+        page = await query.start_after(first[-1]).limit(3).get()
+        assert [doc.get('n') for doc in page] == [6, 5, 4]
+
+        by_value = await memory_db.collection('files').order_by('n').start_after({'n': 7}).get()
+        assert [doc.get('n') for doc in by_value] == [8, 9]
+
+    @pytest.mark.asyncio
+    async def test_select_projects_fields(self, memory_db):
+        """select() only returns the requested fields"""
+        await _seed(memory_db, {"a": {"name": "a.py", "content": "x" * 100}})
+        docs = await memory_db.collection('files').select(['name']).get()
+        assert docs[0].to_dict() == {"name": "a.py"}
+
+    @pytest.mark.asyncio
+    async def test_snapshots_are_copies(self, memory_db):
+        """Mutating a read document doesn't change the stored one"""
+        await _seed(memory_db, {"a": {"can_view": ["alice"]}})
+        doc_ref = memory_db.collection('files').document('a')
+
+        data = (await doc_ref.get()).to_dict()
+        data['can_view'].append('mallory')
+
+        assert (await doc_ref.get()).to_dict() == {"can_view": ["alice"]}
+
+    @pytest.mark.asyncio
+    async def test_update_transforms_and_errors(self, memory_db):
+        """update() applies transforms and fails on missing documents"""
+        await _seed(memory_db, {"a": {"can_view": ["alice"], "meta": {"n": 1}}})
+        doc_ref = memory_db.collection('files').document('a')
+
+        await doc_ref.update({
+            'can_view': firestore.ArrayUnion(['bob', 'alice']),
+            'meta.n': firestore.Increment(2),
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        })
+        data = (await doc_ref.get()).to_dict()
+        assert data['can_view'] == ['alice', 'bob']
+        assert data['meta'] == {'n': 3}
+        assert data['updated_at'] is not None
+
+        with pytest.raises(NotFound):
+            await memory_db.collection('files').document('missing').update({'x': 1})
+        with pytest.raises(AlreadyExists):
+            await doc_ref.create({'x': 1})
+
+    @pytest.mark.asyncio
+    async def test_batch_is_all_or_nothing(self, memory_db):
+        """A failing write leaves every other write of the batch unapplied"""
+        await _seed(memory_db, {"a": {"n": 1}})
+        files = memory_db.collection('files')
+
+        batch = memory_db.batch()
+        batch.set(files.document('b'), {"n": 2})
+        batch.update(files.document('missing'), {"n": 3})
+        with pytest.raises(NotFound):
+            await batch.commit()
+
+        assert not (await files.document('b').get()).exists
+
+    @pytest.mark.asyncio
+    async def test_collection_group(self, memory_db):
+        """collection_group() matches subcollections with that id under any parent"""
+        for user in ("u1", "u2"):
+            inbox = memory_db.collection('users').document(user).collection('shared')
+            await inbox.document('f1').set({"id": "f1"})
+        docs = [doc async for doc in memory_db.collection_group('shared').where('id', '==', 'f1').stream()]
+        assert sorted(doc.reference.path for doc in docs) == [
+            "users/u1/shared/f1", "users/u2/shared/f1"]
+
+    @pytest.mark.asyncio
+    async def test_on_snapshot(self, memory_db):
+        """Listeners get the current results, then one callback per commit that changes them"""
+        await _seed(memory_db, {"a": {"parent": "d"}, "b": {"parent": "e"}})
+        query_calls, doc_calls = [], []
+        query_watch = memory_db.collection('files').where('parent', '==', 'd').on_snapshot(
+            lambda docs, changes, _: query_calls.append(
+                ([d.id for d in docs], [(c.type.name, c.document.id) for c in changes])))
+        memory_db.collection('files').document('b').on_snapshot(
+            lambda docs, changes, _: doc_calls.append([d.to_dict() for d in docs]))
+
+        await memory_db.collection('files').document('b').update({"parent": "d"})
+        await memory_db.collection('files').document('a').delete()
+        query_watch.unsubscribe()
+        await memory_db.collection('files').document('c').set({"parent": "d"})
+
+        assert query_calls == [
+            (["a"], [("ADDED", "a")]),
+            (["a", "b"], [("ADDED", "b")]),
+            (["b"], [("REMOVED", "a")]),
+        ]
+        assert doc_calls == [[{"parent": "e"}], [{"parent": "d"}]]
+
+    @pytest.mark.asyncio
+    async def test_transaction_retries_on_contention(self, memory_db):
+        """A transaction whose reads changed before commit is retried"""
+        counter = memory_db.collection('counters').document('c')
+        await counter.set({"n": 0})
+
+        @firestore.async_transactional
+        async def increment(transaction):
+            snapshot = await counter.get(transaction=transaction)
+            # Let the other transactions read the same value
+            await asyncio.sleep(0)
+            transaction.update(counter, {"n": snapshot.get('n') + 1})
+
+        await asyncio.gather(*(increment(memory_db.transaction()) for _ in range(3)))
+
+        assert (await counter.get()).get('n') == 3
+
+    @pytest.mark.asyncio
+    async def test_injected_latency(self):
+        """Each RPC waits for the configured latency"""
+        db = MemoryFirestore(latency=0.02)
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        await db.collection('files').document('a').set({"n": 1})
+        await db.collection('files').document('a').get()
+
+        assert loop.time() - started >= 0.04
+        assert db.rpcs == 2
+
+    @pytest.mark.asyncio
+    async def test_create_user_rejects_duplicate_username(self, memory_db):
+        """Registration reservations hold under real transaction semantics"""
+        from app.services.auth_service import AuthService
+        from app.models.users import UserCreate
+
+        with patch('app.services.auth_service.FirebaseService') as mock_firebase:
+            mock_firebase.return_value.db = memory_db
+            service = AuthService()
+            service.hash_password = AsyncMock(return_value="hashed")
+
+            await service.create_user(UserCreate(
+                username="alice", email="alice@example.com", password="password123"))
+            with pytest.raises(ValueError) as exc_info:
+                await service.create_user(UserCreate(
+                    username="alice", email="other@example.com", password="password123"))
+
+        assert exc_info.value.args[0] == {"username": "Username already exists"}
+        users = await memory_db.collection('users').get()
+        assert len(users) == 1
@@ -0,0 +1,228 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from fastapi import status
+
+
+class TestMetrics:
+    """Test Prometheus metrics collection"""
+
+    def test_metrics_endpoint_reports_route_templates(self, client):
+        """Requests are recorded under their route template, unmatched paths are grouped"""
+        client.get("/")
+        client.get("/definitely/not/a/route")
+
+        response = client.get("/metrics")
+
+        assert response.status_code == status.HTTP_200_OK
+        body = response.text
+        assert 'sensei_http_request_duration_seconds_count{method="GET",route="/"}' in body
+        assert 'route="<unmatched>",status="404"' in body
+        assert "/definitely/not/a/route" not in body
+
+    def test_named_cache_counts_hits_and_misses(self):
+        """A named TTLCache reports hits and misses"""
+        from app.services.cache import TTLCache
+        from app.monitoring.metrics import CACHE_REQUESTS
+
+        cache = TTLCache(maxsize=2, ttl=60, name="test_cache")
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+
+        assert CACHE_REQUESTS.labels("test_cache", "hit")._value.get() == 1
+        assert CACHE_REQUESTS.labels("test_cache", "miss")._value.get() == 1
+
+
+class TestFirestoreAccounting:
+    """Test the instrumented Firestore client"""
+
+    @pytest.mark.asyncio
+    async def test_reads_and_writes_are_accounted_to_request(self):
+        """Document gets, query streams and batch commits are counted"""
+        from app.monitoring.firestore import (
+            InstrumentedClient, FirestoreStats, _request_stats)
+
+        raw = MagicMock()
+        raw_doc = raw.collection.return_value.document.return_value
+        raw_doc.get = AsyncMock(return_value=MagicMock(exists=True))
+
+        async def stream():
+            for i in range(3):
+                yield MagicMock(id=str(i))
+
+        raw.collection.return_value.where.return_value.stream.return_value = stream()
+        raw.batch.return_value.commit = AsyncMock()
+
+        db = InstrumentedClient(raw)
+        stats = FirestoreStats()
+        token = _request_stats.set(stats)
+        try:
+            await db.collection('files').document('a').get()
+            docs = [d async for d in db.collection('files').where(
+                'root', '==', 'testuser').stream()]
+            batch = db.batch()
+            batch.update(db.collection('files').document('a'), {'x': 1})
+            batch.delete(db.collection('files').document('b'))
+            await batch.commit()
+        finally:
+            _request_stats.reset(token)
+
+        assert len(docs) == 3
+        assert stats.reads == 4
+        assert stats.queries == 1
+        assert stats.writes == 2
+        assert stats.calls == 3
+        # The wrapped batch receives raw references
+        assert raw.batch.return_value.update.call_args.args[0] is raw_doc
+        assert 'fs-reads;desc="4"' in stats.server_timing()
+
+    def test_server_timing_header(self, client):
+        """Every response carries a Server-Timing header"""
+        response = client.get("/")
+        assert "firestore;dur=" in response.headers["server-timing"]
+
+
+class TestProfiling:
+    """Test the profiling hooks"""
+
+    @pytest.mark.asyncio
+    async def test_sampling_profiler_returns_collapsed_stacks(self):
+        """The sampling profiler emits 'frame;frame count' lines"""
+        from app.monitoring.profiling import SamplingProfiler
+
+        collapsed = await SamplingProfiler(interval=0.001).profile(0.05)
+
+        lines = collapsed.strip().splitlines()
+        assert lines
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) >= 1
+        assert ";" in stack
+
+    def test_profile_endpoint_requires_admin(self, client):
+        """Non-admins cannot run the worker profiler"""
+        from main import app
+        from app.routers.auth_router import get_current_user
+
+        app.dependency_overrides[get_current_user] = lambda: MagicMock(
+            role="user")
+        try:
+            response = client.post("/api/v1/admin/profile?seconds=0.01")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestLoopMonitor:
+    """Test event loop stall detection"""
+
+    @pytest.mark.asyncio
+    async def test_blocking_endpoint_is_attributed(self):
+        """A blocking call is caught and attributed to the route on the stack"""
+        import asyncio
+        import time
+        from app.monitoring.loop_monitor import LoopMonitor
+
+        def blocking_endpoint():
+            time.sleep(0.3)
+
+        app = MagicMock()
+        app.routes = [MagicMock(endpoint=blocking_endpoint, path="/slow")]
+
+        monitor = LoopMonitor(interval=0.02, stall_threshold=0.1)
+        monitor.start(app)
+        try:
+            await asyncio.sleep(0.05)
+            blocking_endpoint()
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.stop()
+
+        assert [s["route"] for s in monitor.stalls] == ["/slow"]
+        assert monitor.stalls[0]["duration"] >= 0.2
+        assert "blocking_endpoint" in monitor.stalls[0]["stack"]
+
+
+class TestStructuredLogging:
+    """Test JSON logging and request context"""
+
+    def test_json_formatter_includes_request_context(self):
+        """Records are rendered as JSON with the request context and extras"""
+        import json
+        import logging
+        from app.monitoring.logs import (
+            ContextFilter, JsonFormatter, _request_context)
+
+        record = logging.LogRecord(
+            "sensei.test", logging.INFO, __file__, 1, "Shared %s", ("a.py",), None)
+        record.file_id = "test-file-id"
+        token = _request_context.set(
+            {"request_id": "req-1", "user": "testuser", "_scope": {"type": "http"}})
+        try:
+            ContextFilter().filter(record)
+        finally:
+            _request_context.reset(token)
+
+        entry = json.loads(JsonFormatter().format(record))
+        assert entry["message"] == "Shared a.py"
+        assert entry["request_id"] == "req-1"
+        assert entry["user"] == "testuser"
+        assert entry["file_id"] == "test-file-id"
+        assert "_scope" not in entry
+
+    def test_sampling_never_drops_warnings(self):
+        """Sampled records are dropped at rate 0 unless they are warnings or worse"""
+        import logging
+        from app.monitoring.logs import SamplingFilter
+
+        info = logging.LogRecord("x", logging.INFO, "", 0, "", None, None)
+        info.sample_rate = 0.0
+        warning = logging.LogRecord("x", logging.WARNING, "", 0, "", None, None)
+        warning.sample_rate = 0.0
+
+        assert SamplingFilter().filter(info) is False
+        assert SamplingFilter().filter(warning) is True
+
+    def test_request_id_header(self, client):
+        """Responses echo an incoming X-Request-ID"""
+        response = client.get("/", headers={"X-Request-ID": "abc123"})
+        assert response.headers["x-request-id"] == "abc123"
+
+
+class TestTracing:
+    """Test tracing spans around service methods"""
+
+    @pytest.mark.asyncio
+    async def test_public_methods_run_in_spans(self):
+        """Public service methods open a span named Class.method, private ones don't"""
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        from app.monitoring import tracing
+        from app.monitoring.tracing import trace_public_methods
+
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+
+        @trace_public_methods
+        class Service:
+            async def outer(self):
+                return await self.inner()
+
+            async def inner(self):
+                return self._helper()
+
+            def _helper(self):
+                return 42
+
+        original_tracer = tracing.tracer
+        tracing.tracer = provider.get_tracer("test")
+        try:
+            assert await Service().outer() == 42
+        finally:
+            tracing.tracer = original_tracer
+
+        spans = {span.name: span for span in exporter.get_finished_spans()}
+        assert set(spans) == {"Service.outer", "Service.inner"}
+        assert spans["Service.inner"].parent.span_id == spans["Service.outer"].context.span_id
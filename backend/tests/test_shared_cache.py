@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from app.models.models import VirtualFile
+from app.services.shared_cache import MemoryBackend, RedisBackend, SharedCache
+
+
+def _file(content="print(1)"):
+    return VirtualFile(id="f1", root="alice", directory=False, name="a.py", content=content)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backends(request):
+    """Factory of backends that share state, as two workers would"""
+    if request.param == "memory":
+        backend = MemoryBackend()
+        return lambda: backend
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisBackend(client=fakeredis.FakeAsyncRedis(server=server))
+
+
+@pytest_asyncio.fixture
+async def workers(backends):
+    """Two caches on one backend, both listening for invalidations"""
+    caches = [SharedCache(backends(), ttl=60, negative_ttl=10, local_ttl=60) for _ in range(2)]
+    for cache in caches:
+        await cache.start()
+    # Let the subscriptions settle
+    await asyncio.sleep(0.05)
+    yield caches
+    for cache in caches:
+        await cache.stop()
+
+
+class Loader:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+class TestSharedCache:
+    """Test the shared cache tier on each backend"""
+
+    @pytest.mark.asyncio
+    async def test_second_worker_hits_backend(self, workers):
+        first, second = workers
+        load = Loader(_file())
+
+        assert (await first.get_or_load("file", "f1", VirtualFile, load)).content == "print(1)"
+        assert (await second.get_or_load("file", "f1", VirtualFile, load)).content == "print(1)"
+        assert load.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_values_are_cached(self, workers):
+        first, second = workers
+        load = Loader(None)
+
+        assert await first.get_or_load("file", "nope", VirtualFile, load) is None
+        assert await second.get_or_load("file", "nope", VirtualFile, load) is None
+        assert load.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidation_reaches_other_workers(self, workers):
+        first, second = workers
+        seen = []
+        SharedCache.on_invalidate("test", seen.append)
+        await first.get_or_load("test", "f1", VirtualFile, Loader(_file("old")))
+        await second.get_or_load("test", "f1", VirtualFile, Loader(_file("old")))
+
+        await first.invalidate("test", "f1")
+        await asyncio.sleep(0.05)
+
+        assert "f1" in seen
+        fresh = await second.get_or_load("test", "f1", VirtualFile, Loader(_file("new")))
+        assert fresh.content == "new"
+
+    @pytest.mark.asyncio
+    async def test_load_racing_a_write_is_not_served(self, workers):
+        """A value loaded before an invalidation is stored under a dead version"""
+        first, second = workers
+        release = asyncio.Event()
+
+        async def stale_load():
+            await release.wait()
+            return _file("old")
+
+        pending = asyncio.ensure_future(first.get_or_load("file", "f1", VirtualFile, stale_load))
+        await asyncio.sleep(0.01)
+        await second.invalidate("file", "f1")
+        release.set()
+        assert (await pending).content == "old"
+
+        await asyncio.sleep(0.05)
+        fresh = await first.get_or_load("file", "f1", VirtualFile, Loader(_file("new")))
+        assert fresh.content == "new"
+
+    @pytest.mark.asyncio
+    async def test_keys_follow_model_shape(self, workers):
+        """Entries written for one model are never read as another"""
+        from app.models.users import UserPublic
+
+        first, _ = workers
+        assert first._data_key("file", "f1", VirtualFile) != first._data_key("file", "f1", UserPublic)
+
+
+class TestSharedCacheFailures:
+    @pytest.mark.asyncio
+    async def test_backend_errors_fall_back_to_load(self):
+        class Down(MemoryBackend):
+            async def mget(self, *keys):
+                raise ConnectionError("down")
+
+        cache = SharedCache(Down())
+        load = Loader(_file())
+
+        assert (await cache.get_or_load("file", "f1", VirtualFile, load)).id == "f1"
+        assert (await cache.get_or_load("file", "f1", VirtualFile, load)).id == "f1"
+        assert load.calls == 2
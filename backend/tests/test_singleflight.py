@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from app.services.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    """Test coalescing of concurrent identical reads"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return object()
+
+        results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(20)))
+
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+        assert len(flights) == 0
+        # Nothing is kept once the call completes
+        await flights.do("key", fetch)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_caller(self):
+        flights = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flights.do("key", fail) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_the_call(self):
+        flights = SingleFlight("test")
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "value"
+
+        first = asyncio.ensure_future(flights.do("key", fetch))
+        second = asyncio.ensure_future(flights.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == "value"
+
+    @pytest.mark.asyncio
+    async def test_forget_starts_a_fresh_call(self):
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def old():
+            await release.wait()
+            return "old"
+
+        async def new():
+            return "new"
+
+        pending = asyncio.ensure_future(flights.do("key", old))
+        await asyncio.sleep(0)
+        flights.forget("key")
+
+        assert await flights.do("key", new) == "new"
+        release.set()
+        assert await pending == "old"
+
+
+class TestCoalescedLookups:
+    """Test the services read hot documents once per burst"""
+
+    @pytest.mark.asyncio
+    async def test_get_file_burst_costs_one_read(self, memory_db, sample_file):
+        from app.models.models import VirtualFile
+        from app.services.filesystem import FileSystem
+
+        fs = FileSystem(db=memory_db)
+        await fs.create_file(VirtualFile.model_validate(
+            {**sample_file, "can_view": [], "can_edit": []}))
+        memory_db._wrapped.latency = 0.01
+        rpcs = memory_db._wrapped.rpcs
+
+        files = await asyncio.gather(*(fs.get_file("test-file-id") for _ in range(25)))
+
+        assert all(f.content == sample_file["content"] for f in files)
+        assert memory_db._wrapped.rpcs - rpcs == 1
+
+    @pytest.mark.asyncio
+    async def test_write_is_visible_to_later_reads(self, memory_db, sample_file):
+        """A read issued after a write never joins one that started before it"""
+        from app.models.models import VirtualFile
+        from app.services.filesystem import FileSystem
+
+        fs = FileSystem(db=memory_db)
+        await fs.create_file(VirtualFile.model_validate(
+            {**sample_file, "can_view": [], "can_edit": []}))
+        memory_db._wrapped.latency = 0.01
+
+        before = asyncio.ensure_future(fs.get_file("test-file-id"))
+        await asyncio.sleep(0)
+        await fs.update_file("test-file-id", "print('new')")
+        after = await fs.get_file("test-file-id")
+
+        assert after.content == "print('new')"
+        await before
+
+    @pytest.mark.asyncio
+    async def test_user_lookup_burst_costs_one_query(self, memory_db):
+        from app.models.users import UserCreate
+        from app.services.auth_service import AuthService
+
+        auth = AuthService(db=memory_db)
+        await auth.create_user(UserCreate(
+            username="alice", email="alice@example.com", password="password123"))
+        memory_db._wrapped.latency = 0.01
+        rpcs = memory_db._wrapped.rpcs
+
+        users = await asyncio.gather(*(auth.get_user_by_username("alice") for _ in range(25)))
+
+        assert {u.username for u in users} == {"alice"}
+        assert memory_db._wrapped.rpcs - rpcs == 1
@@ -0,0 +1,228 @@
+import asyncio
+
+import pytest
+
+from app.models.models import VirtualFile
+from app.models.users import UserPublic
+from app.services import ot
+from app.services.filesystem import FileSystem
+from app.services.spaces import LiveDocument, LiveDocuments, SpaceNotFound, SpaceService, StaleOperation
+
+
+def _user(name: str) -> UserPublic:
+    return UserPublic(id=f"{name}-id", username=name, email=f"{name}@example.com")
+
+
+@pytest.fixture
+def service(memory_db):
+    # No background task: tests flush explicitly
+    return SpaceService(memory_db, documents=LiveDocuments(memory_db))
+
+
+class TestOperationalTransform:
+    """Test the ot.js-format text operations"""
+
+    def test_apply_and_normalize(self):
+        assert ot.normalize([2, 3, "a", "b", -1, -1]) == [5, "ab", -2]
+        assert ot.apply("hello", [5, " world"]) == "hello world"
+        assert ot.apply("hello", [1, -3, "EY", 1]) == "hEYo"
+        with pytest.raises(ot.InvalidOperation):
+            ot.apply("hello", [4, "x"])
+        with pytest.raises(ot.InvalidOperation):
+            ot.normalize([1, None])
+
+    @pytest.mark.parametrize("a, b", [
+        ([3, "X", 3], [3, "Y", 3]),
+        ([1, -2, 3], [2, "Z", 4]),
+        ([-6], [2, -2, 2]),
+        (["start", 6], [6, "end"]),
+    ])
+    def test_transform_converges(self, a, b):
+        document = "abcdef"
+        a_prime, b_prime = ot.transform(a, b)
+        assert ot.apply(ot.apply(document, a), b_prime) == ot.apply(ot.apply(document, b), a_prime)
+
+    def test_live_document_transforms_concurrent_operations(self):
+        document = LiveDocument("s", "f", "abc", 0, members={"u1", "u2"}, editors={"u1", "u2"}, history=2)
+        document.submit("u1", 0, [3, "!"], 100)
+        # Made without seeing u1's edit
+        applied = document.submit("u2", 0, ["> ", 3], 100)
+        assert document.content == "> abc!"
+        assert (applied.version, applied.ops) == (2, ["> ", 4])
+        assert [op.version for op in document.operations_since(1)] == [2]
+
+        document.submit("u1", 2, [6, "?"], 100)
+        with pytest.raises(StaleOperation):
+            document.submit("u2", 0, [3, "x"], 100)
+
+
+class TestSpaceService:
+    """Test spaces against the in-memory Firestore"""
+
+    @pytest.mark.asyncio
+    async def test_membership_and_chat(self, service):
+        alice, bob, carol = _user("alice"), _user("bob"), _user("carol")
+        space = await service.create_space(alice, "pairing", is_public=False)
+        assert space.join_code and space.users[0].is_creator and space.users[0].can_edit
+
+        with pytest.raises(PermissionError):
+            await service.join_space(bob, space.id)
+        joined = await service.join_by_code(bob, space.join_code.lower())
+        assert [u.username for u in joined.users] == ["alice", "bob"]
+
+        await service.send_message(bob, space.id, "hi")
+        with pytest.raises(PermissionError):
+            await service.send_message(carol, space.id, "let me in")
+        assert [m.message for m in (await service.get_space(space.id, alice)).messages] == ["hi"]
+
+        listed = await service.list_spaces(bob)
+        assert [s.id for s in listed] == [space.id]
+        assert await service.list_spaces(carol) == []
+
+        await service.leave_space(bob, space.id)
+        await service.leave_space(alice, space.id)
+        with pytest.raises(SpaceNotFound):
+            await service.get_space(space.id, alice)
+        with pytest.raises(SpaceNotFound):
+            await service.join_by_code(bob, space.join_code)
+
+    @pytest.mark.asyncio
+    async def test_edit_request_handoff(self, service):
+        alice, bob = _user("alice"), _user("bob")
+        space = await service.create_space(alice, "review", is_public=True)
+        await service.join_space(bob, space.id)
+
+        request = await service.request_edit(bob, space.id)
+        assert request.pending
+        with pytest.raises(PermissionError):
+            await service.decide_edit(bob, space.id, bob.id, True)
+
+        space = await service.decide_edit(alice, space.id, bob.id, True)
+        assert space.edit_requests == []
+        assert next(u for u in space.users if u.id == bob.id).can_edit
+
+        space = await service.decide_edit(alice, space.id, bob.id, False)
+        assert not next(u for u in space.users if u.id == bob.id).can_edit
+
+    @pytest.mark.asyncio
+    async def test_operations_are_coalesced_into_snapshots(self, service, memory_db):
+        alice, bob = _user("alice"), _user("bob")
+        file = await FileSystem(memory_db).create_file(VirtualFile(
+            id="space-file", root="alice", directory=False, name="main.py", content="print()"))
+        space = await service.create_space(alice, "live", is_public=True)
+        await service.join_space(bob, space.id)
+        space = await service.set_active_file(alice, space.id, file.id)
+        assert (space.active_file.content, space.version) == ("print()", 0)
+
+        with pytest.raises(PermissionError):
+            await service.submit_operation(bob, space.id, 0, [7, "\n"])
+        await service.decide_edit(alice, space.id, bob.id, True)
+
+        writes = memory_db._wrapped.rpcs
+        # Two editors typing at once, each on the version they last saw
+        await asyncio.gather(*(
+            service.submit_operation(user, space.id, 0, ops)
+            for user, ops in [(alice, ["# ", 7]), (bob, [7, "\n"])]))
+        for version in range(2, 12):
+            await service.submit_operation(alice, space.id, version, [len("# print()\n") + version - 2, "x"])
+        assert memory_db._wrapped.rpcs == writes, "operations must not touch Firestore"
+
+        expected = "# print()\n" + "x" * 10
+        assert (await service.get_space(space.id, bob)).active_file.content == expected
+        assert (await FileSystem(memory_db).get_file(file.id)).content == "print()"
+
+        assert await service.save(alice, space.id) == 12
+        assert (await FileSystem(memory_db).get_file(file.id)).content == expected
+        log = await service.get_operations(bob, space.id, 10)
+        assert [op.version for op in log.operations] == [11, 12]
+
+    @pytest.mark.asyncio
+    async def test_switching_files_while_editing(self, service, memory_db, monkeypatch):
+        from app.services.memory_firestore import MemoryDocument
+
+        alice = _user("alice")
+        fs = FileSystem(memory_db)
+        for name in ("old", "new"):
+            await fs.create_file(VirtualFile(
+                id=f"{name}-file", root="alice", directory=False, name=f"{name}.py", content=name))
+        space = await service.create_space(alice, "switch")
+        await service.set_active_file(alice, space.id, "old-file")
+        await service.submit_operation(alice, space.id, 0, [3, "!"])
+
+        update = MemoryDocument.update
+
+        async def slow_switch(self, field_updates: dict) -> None:
+            if 'active_file_id' in field_updates:
+                # A slow round trip: readers land while the space still names the old file
+                await asyncio.sleep(0.02)
+            await update(self, field_updates)
+
+        async def readers():
+            for _ in range(20):
+                await service.get_space(space.id, alice)
+                await asyncio.sleep(0.002)
+
+        monkeypatch.setattr(MemoryDocument, "update", slow_switch)
+        await asyncio.gather(service.set_active_file(alice, space.id, "new-file"), readers())
+
+        document = service.documents.loaded(space.id)
+        assert (document.file_id, document.version) == ("new-file", 0)
+        await service.submit_operation(alice, space.id, 0, [3, "?"])
+        await service.documents.flush()
+        assert (await fs.get_file("old-file")).content == "old!"
+        assert (await fs.get_file("new-file")).content == "new?"
+        assert (await service.get_space(space.id, alice)).version == 1
+
+    @pytest.mark.asyncio
+    async def test_deleted_files_are_unloaded(self, service, memory_db, monkeypatch):
+        alice = _user("alice")
+        fs = FileSystem(memory_db)
+        spaces = []
+        for name in ("kept", "gone", "deleted"):
+            file = await fs.create_file(VirtualFile(
+                id=f"{name}-file", root="alice", directory=False, name=f"{name}.py", content=""))
+            space = await service.create_space(alice, name)
+            await service.set_active_file(alice, space.id, file.id)
+            await service.submit_operation(alice, space.id, 0, [name])
+            spaces.append(space.id)
+        kept, gone, deleted = spaces
+
+        # Deleted behind the snapshot's back: fails the batch, the other documents are still written
+        await memory_db.collection('files').document("gone-file").delete()
+        await service.documents.flush()
+        assert (await fs.get_file("kept-file")).content == "kept"
+        assert service.documents.loaded(kept) is not None and service.documents.loaded(gone) is None
+        with pytest.raises(SpaceNotFound):
+            await service.submit_operation(alice, gone, 1, [4, "!"])
+
+        monkeypatch.setattr(LiveDocuments, "_instance", service.documents)
+        await fs.delete_file("deleted-file")
+        assert service.documents.loaded(deleted) is None
+        assert (await service.get_space(deleted, alice)).active_file is None
+
+        # The last member leaving deletes the space, after its edits are written
+        await service.submit_operation(alice, kept, 1, [4, "!"])
+        await service.leave_space(alice, kept)
+        assert (await fs.get_file("kept-file")).content == "kept!"
+
+    @pytest.mark.asyncio
+    async def test_snapshots_survive_a_restart(self, memory_db):
+        alice = _user("alice")
+        documents = LiveDocuments(memory_db, interval=0.01)
+        service = SpaceService(memory_db, documents=documents)
+        file = await FileSystem(memory_db).create_file(VirtualFile(
+            id="restart-file", root="alice", directory=False, name="a.txt", content=""))
+        space = await service.create_space(alice, "restart")
+        await service.set_active_file(alice, space.id, file.id)
+
+        documents.start()
+        await service.submit_operation(alice, space.id, 0, ["hello"])
+        await asyncio.sleep(0.05)
+        await documents.stop()
+        assert (await FileSystem(memory_db).get_file(file.id)).content == "hello"
+
+        # A new process picks up where the last snapshot left off
+        restarted = SpaceService(memory_db, documents=LiveDocuments(memory_db))
+        space = await restarted.get_space(space.id, alice)
+        assert (space.active_file.content, space.version) == ("hello", 1)
+        await restarted.submit_operation(alice, space.id, 1, [5, "!"])
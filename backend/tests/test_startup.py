@@ -0,0 +1,127 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from app.services.firebase_service import FirebaseService
+from app.services.memory_firestore import MemoryFirestore
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# Cumulative import time of main; about 0.8s on a laptop, so this only catches big regressions
+IMPORT_BUDGET_S = float(os.getenv("IMPORT_BUDGET_S", 3.0))
+
+
+def _import_main(**env) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import main\n"
+         "from app.services.firebase_service import FirebaseService\n"
+         "print(FirebaseService._db is None)"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60,
+        env={**os.environ, **env})
+
+
+class TestStartup:
+    """Test that importing the app is cheap and side-effect free"""
+
+    def test_import_needs_no_credentials(self):
+        """No client is created at import, so a missing key doesn't break it"""
+        result = _import_main(FIREBASE_KEY_PATH="/nonexistent/firebasekey.json",
+                              FIRESTORE_BACKEND="firestore")
+
+        assert result.returncode == 0, result.stderr[-2000:]
+        assert result.stdout.strip() == "True"
+
+    def test_import_time_budget(self):
+        result = _import_main(FIREBASE_KEY_PATH="/nonexistent/firebasekey.json")
+        assert result.returncode == 0, result.stderr[-2000:]
+
+        # "import time: self [us] | cumulative | imported package"
+        timings = re.findall(r"^import time:\s+\d+ \|\s+(\d+) \| main$",
+                             result.stderr, re.MULTILINE)
+        assert timings, "no import time reported for main"
+        assert int(timings[0]) / 1e6 < IMPORT_BUDGET_S
+
+    @pytest.mark.asyncio
+    async def test_initialize_and_close(self, monkeypatch):
+        """initialize() is idempotent and close() drops the client for the next start"""
+        monkeypatch.setenv("FIRESTORE_BACKEND", "memory")
+        monkeypatch.setattr(FirebaseService, "_db", None)
+        monkeypatch.setattr(FirebaseService, "_instrumented", None)
+
+        db = FirebaseService.initialize()
+        assert isinstance(db, MemoryFirestore)
+        assert FirebaseService.initialize() is db
+        assert FirebaseService().db._wrapped is db
+
+        await FirebaseService.close()
+        assert FirebaseService._db is None
+        assert FirebaseService._instrumented is None
+
+
+class TestReadiness:
+    """Test the warm-up and the /ready probe"""
+
+    def test_ready_after_warm_up(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from main import app
+
+        monkeypatch.setenv("FIRESTORE_BACKEND", "memory")
+        monkeypatch.setenv("LOOP_MONITOR_ENABLED", "false")
+        monkeypatch.setattr(FirebaseService, "_db", None)
+        monkeypatch.setattr(FirebaseService, "_instrumented", None)
+
+        with TestClient(app) as client:
+            response = client.get("/ready")
+            for _ in range(100):
+                if response.status_code == 200:
+                    break
+                assert response.status_code == 503
+                time.sleep(0.05)
+                response = client.get("/ready")
+
+            assert response.status_code == 200
+            warmup = response.json()["warmup"]
+            assert set(warmup) == {"firestore", "cache", "openapi", "password_hasher", "serialization"}
+            assert all(step["ok"] for step in warmup.values()), warmup
+            # /health stays a liveness check
+            assert client.get("/health").status_code == 200
+
+        assert app.state.ready is False
+
+    def test_shutdown_continues_past_a_failed_step(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from app.services.spaces import LiveDocuments
+        from main import app
+
+        monkeypatch.setenv("FIRESTORE_BACKEND", "memory")
+        monkeypatch.setenv("LOOP_MONITOR_ENABLED", "false")
+        monkeypatch.setenv("WARMUP_ENABLED", "false")
+        monkeypatch.setattr(FirebaseService, "_db", None)
+        monkeypatch.setattr(FirebaseService, "_instrumented", None)
+
+        async def unavailable():
+            raise RuntimeError("Firestore unavailable")
+        monkeypatch.setattr(LiveDocuments, "close", unavailable)
+        # Dropped again afterwards, since the real close() doesn't run
+        monkeypatch.setattr(LiveDocuments, "_instance", None)
+
+        with TestClient(app):
+            assert FirebaseService._db is not None
+        # The steps after the failed one still ran
+        assert FirebaseService._db is None
+
+    def test_serve_reads_environment(self, monkeypatch):
+        import serve
+
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        monkeypatch.setenv("PORT", "10000")
+        monkeypatch.setenv("GRACEFUL_TIMEOUT", "5")
+
+        args = serve.parse_args([])
+        assert (args.workers, args.port, args.graceful_timeout) == (3, 10000, 5)
+        assert serve.parse_args(["--workers", "1"]).workers == 1
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.models.models import VirtualFile
+from app.services.filesystem import FileSystem
+from app.services.write_behind import WriteBehindBuffer
+
+
+async def _create(fs: FileSystem, file_id: str, content: str = "v0") -> VirtualFile:
+    return await fs.create_file(VirtualFile(
+        id=file_id, root="alice", directory=False, name=f"{file_id}.py", content=content))
+
+
+class TestWriteBehind:
+    """Test write-behind autosaves"""
+
+    @pytest.mark.asyncio
+    async def test_saves_are_merged_into_one_write(self, memory_db):
+        buffer = WriteBehindBuffer(memory_db, window=60)
+        fs = FileSystem(memory_db, buffer=buffer)
+        await _create(fs, "wb-a")
+        await _create(fs, "wb-b")
+
+        rpcs = memory_db._wrapped.rpcs
+        for i in range(1, 21):
+            await fs.update_file("wb-a", f"a{i}", buffered=True)
+            await fs.update_file("wb-b", f"b{i}", buffered=True)
+        assert memory_db._wrapped.rpcs == rpcs
+        assert len(buffer) == 2
+
+        # Reads in this process see the buffered content, through the cache too
+        assert (await fs.get_file("wb-a")).content == "a20"
+        assert (await fs.get_file("wb-b", cached=True)).content == "b20"
+        stored = await memory_db._wrapped.collection('files').document('wb-a').get()
+        assert stored.get('content') == "v0"
+
+        rpcs = memory_db._wrapped.rpcs
+        assert sorted(await buffer.flush()) == ["wb-a", "wb-b"]
+        # One batch for both files
+        assert memory_db._wrapped.rpcs == rpcs + 1
+        assert len(buffer) == 0
+        stored = await memory_db._wrapped.collection('files').document('wb-a').get()
+        assert stored.get('content') == "a20"
+
+    @pytest.mark.asyncio
+    async def test_direct_write_and_delete_drop_buffered_saves(self, memory_db):
+        buffer = WriteBehindBuffer(memory_db, window=60)
+        fs = FileSystem(memory_db, buffer=buffer)
+        await _create(fs, "wb-c")
+        await _create(fs, "wb-d")
+        await _create(fs, "wb-e")
+
+        await fs.update_file("wb-c", "autosaved", buffered=True)
+        await fs.update_file("wb-c", "saved")
+        await fs.update_file("wb-d", "autosaved", buffered=True)
+        await fs.update_file("wb-e", "autosaved", buffered=True)
+        # Deleted behind the buffer's back: the batch fails, the other file is still written
+        await memory_db._wrapped.collection('files').document('wb-d').delete()
+
+        assert await buffer.flush() == ["wb-e"]
+        assert (await fs.get_file("wb-c")).content == "saved"
+        assert (await fs.get_file("wb-e")).content == "autosaved"
+        assert len(buffer) == 0
+
+    @pytest.mark.asyncio
+    async def test_flushes_on_window_and_stop(self, memory_db):
+        buffer = WriteBehindBuffer(memory_db, window=0.01)
+        fs = FileSystem(memory_db, buffer=buffer)
+        await _create(fs, "wb-f")
+        buffer.start()
+
+        await fs.update_file("wb-f", "tick", buffered=True)
+        await asyncio.sleep(0.05)
+        assert len(buffer) == 0
+
+        await fs.update_file("wb-f", "last", buffered=True)
+        await buffer.stop()
+        stored = await memory_db._wrapped.collection('files').document('wb-f').get()
+        assert stored.get('content') == "last"
+
+    @pytest.mark.asyncio
+    async def test_disabled_writes_through(self, memory_db):
+        buffer = WriteBehindBuffer(memory_db, window=0)
+        fs = FileSystem(memory_db, buffer=buffer)
+        await _create(fs, "wb-g")
+
+        await fs.update_file("wb-g", "now", buffered=True)
+        assert len(buffer) == 0
+        stored = await memory_db._wrapped.collection('files').document('wb-g').get()
+        assert stored.get('content') == "now"
@@ -14,7 +14,7 @@ import { CreateFolderDialog } from "@/components/create-folder-dialog"
 import { ShareFileDialog } from "@/components/share-file-dialog"
 import { CodeEditor } from "@/components/code-editor"
 import { FileSystemExplorer } from "@/components/file-system-explorer"
-import { VirtualFile } from "@/types"
+import { SharedFile, VirtualFile } from "@/types"
 
 
 interface User {
@@ -27,7 +27,7 @@ interface User {
 export default function DashboardPage() {
   const [user, setUser] = useState<User | null>(null)
   const [files, setFiles] = useState<VirtualFile[]>([])
-  const [sharedFiles, setSharedFiles] = useState<VirtualFile[]>([])
+  const [sharedFiles, setSharedFiles] = useState<SharedFile[]>([])
   const [publicFiles, setPublicFiles] = useState<VirtualFile[]>([])
   const [searchQuery, setSearchQuery] = useState("")
   const [searchResults, setSearchResults] = useState<VirtualFile[]>([])
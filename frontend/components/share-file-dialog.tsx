@@ -65,21 +65,30 @@ export function ShareFileDialog({ open, onOpenChange, file }: ShareFileDialogPro
   const fetchUsers = async () => {
     try {
       const token = localStorage.getItem("token")
-      console.log("Fetching users from:", `${apiUrl}/api/v1/auth/users/all/`)
-
-      const response = await fetch(`${apiUrl}/api/v1/auth/users/all/`, {
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
-      })
-
-      if (response.ok) {
-        const usersData = await response.json()
-        setUsers(usersData)
-      } else {
-        const errorData = await response.json().catch(() => ({}))
-        console.error("Error fetching users:", response.status, errorData)
-      }
+      const collected: User[] = []
+      // The endpoint returns one page at a time; X-Next-Cursor points at the next one
+      let cursor: string | null = null
+      do {
+        const url = new URL(`${apiUrl}/api/v1/auth/users/all/`)
+        url.searchParams.set("limit", "1000")
+        if (cursor) url.searchParams.set("cursor", cursor)
+        console.log("Fetching users from:", url.toString())
+
+        const response = await fetch(url.toString(), {
+          headers: {
+            Authorization: `Bearer ${token}`,
+          },
+        })
+
+        if (!response.ok) {
+          const errorData = await response.json().catch(() => ({}))
+          console.error("Error fetching users:", response.status, errorData)
+          break
+        }
+        collected.push(...(await response.json()))
+        cursor = response.headers.get("X-Next-Cursor")
+      } while (cursor)
+      setUsers(collected)
     } catch (error) {
       console.error("Error fetching users:", error)
     }
@@ -11,4 +11,13 @@ export interface VirtualFile {
     root: string
     children?: string[]
     parent?: string | null
-}
\ No newline at end of file
+}
+// Entry of GET /api/v1/filesystem/files/shared-with-me; fetch the file itself by id
+export interface SharedFile {
+    id: string
+    name: string
+    root: string
+    directory: boolean
+    permissions: ("view" | "edit")[]
+    shared_at: string | null
+}